@@ -1,22 +1,35 @@
+from django.conf import settings
 from django.contrib import admin
-from home.models import Document, Answer, ProcessedDocument
+from django.core.paginator import Paginator
+from django.db.models.functions import Length
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.defaultfilters import filesizeformat
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from home.models import Document, Answer, CachedAnswer, ProcessedDocument, ExtractedText, RequestProfile
 
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('description', 'uploaded_by', 'uploaded_at', 'is_processed')
-    list_filter = ('is_processed', 'uploaded_at')
+    list_display = ('description', 'uploaded_by', 'uploaded_at', 'is_processed', 'warm_status')
+    list_filter = ('is_processed', 'uploaded_at', 'warm_status')
     search_fields = ('description',)
-    readonly_fields = ('uploaded_at',)
+    readonly_fields = ('uploaded_at', 'content_hash', 'warm_status', 'warm_done', 'warm_total')
     fieldsets = (
         ("Thông tin cơ bản", {
             'fields': ('description', 'document')
         }),
         ("Xử lý", {
-            'fields': ('is_processed',)
+            'fields': ('is_processed', 'extractor')
+        }),
+        ("Trả lời trước", {
+            'fields': ('warm_questions', 'warm_status', 'warm_done', 'warm_total'),
+            'classes': ('collapse',)
         }),
         ("Metadata", {
-            'fields': ('uploaded_by', 'uploaded_at'),
+            'fields': ('uploaded_by', 'uploaded_at', 'content_hash'),
             'classes': ('collapse',)
         }),
     )
@@ -27,7 +40,7 @@ class AnswerAdmin(admin.ModelAdmin):
     list_display = ('ask_content_preview', 'uploaded_by', 'ask_at', 'answer_length_preview')
     list_filter = ('ask_at', 'uploaded_by')
     search_fields = ('ask_content', 'answer_content')
-    readonly_fields = ('ask_at', 'answer_at')
+    readonly_fields = ('ask_at', 'answer_at', 'timings', 'chunk_refs', 'context_preview')
     fieldsets = (
         ("Câu hỏi", {
             'fields': ('ask_content', 'ask_at', 'uploaded_by')
@@ -36,7 +49,11 @@ class AnswerAdmin(admin.ModelAdmin):
             'fields': ('answer_content', 'answer_at')
         }),
         ("Context (Chunks liên quan)", {
-            'fields': ('context',),
+            'fields': ('chunk_refs', 'context_preview'),
+            'classes': ('collapse',)
+        }),
+        ("Hiệu năng", {
+            'fields': ('timings',),
             'classes': ('collapse',)
         }),
         ("File tham chiếu", {
@@ -45,12 +62,27 @@ class AnswerAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Trang danh sách: không tải các cột lớn, chỉ lấy độ dài câu trả lời từ DB
+        match = request.resolver_match
+        if match and match.url_name and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer('answer_content', 'context', 'chunk_refs', 'timings').annotate(
+                answer_length=Length('answer_content'))
+        return queryset
+
+    def context_preview(self, obj):
+        return format_html('<pre style="white-space: pre-wrap;">{}</pre>', obj.get_context())
+    context_preview.short_description = "Context"
+
     def ask_content_preview(self, obj):
         return obj.ask_content[:50] + "..." if len(obj.ask_content) > 50 else obj.ask_content
     ask_content_preview.short_description = "Câu hỏi"
     
     def answer_length_preview(self, obj):
-        length = len(obj.answer_content)
+        length = getattr(obj, 'answer_length', None)
+        if length is None:
+            length = len(obj.answer_content)
         if length > 200:
             return f"Dài ({length} ký tự)"
         elif length > 100:
@@ -60,25 +92,158 @@ class AnswerAdmin(admin.ModelAdmin):
     answer_length_preview.short_description = "Độ dài câu trả lời"
 
 
+@admin.register(CachedAnswer)
+class CachedAnswerAdmin(admin.ModelAdmin):
+    list_display = ('question', 'document', 'hit_count', 'embedding_model', 'created_at')
+    list_filter = ('embedding_model', 'created_at')
+    search_fields = ('question', 'answer_content')
+    readonly_fields = ('question_key', 'embedding_model', 'chunk_refs', 'hit_count', 'created_at', 'updated_at')
+    exclude = ('embedding',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('embedding')
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(ProcessedDocument)
 class ProcessedDocumentAdmin(admin.ModelAdmin):
-    list_display = ('file_name', 'document', 'uploaded_at')
-    list_filter = ('uploaded_at',)
+    list_display = ('file_name', 'document', 'embedding_model', 'stored_text_size', 'uploaded_at')
+    list_filter = ('uploaded_at', 'embedding_model')
     search_fields = ('file_name',)
-    readonly_fields = ('uploaded_at', 'embeddings')
+    readonly_fields = ('uploaded_at', 'embedding_model', 'text_hash', 'text_stats', 'embeddings_size', 'chunks_link')
     fieldsets = (
         ("Thông tin", {
             'fields': ('file_name', 'document')
         }),
         ("Nội dung", {
-            'fields': ('text_content',)
+            'fields': ('text_stats', 'chunks_link')
         }),
-        ("Embeddings (Binary)", {
-            'fields': ('embeddings',),
+        ("Embeddings", {
+            'fields': ('embedding_model', 'embeddings_size'),
             'classes': ('collapse',)
         }),
         ("Metadata", {
-            'fields': ('uploaded_at',),
+            'fields': ('uploaded_at', 'text_hash'),
             'classes': ('collapse',)
         }),
     )
+    chunks_per_page = 20
+
+    def get_queryset(self, request):
+        # Không tải embeddings (blob lớn) ở mọi trang, chỉ lấy kích thước từ DB;
+        # trang danh sách cũng không tải văn bản
+        queryset = super().get_queryset(request).defer('embeddings').annotate(
+            text_bytes=Length('text_content'), embeddings_bytes=Length('embeddings'))
+        match = request.resolver_match
+        if match and match.url_name and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer('text_content')
+        return queryset
+
+    def get_urls(self):
+        urls = [
+            path('<int:pk>/chunks/', self.admin_site.admin_view(self.chunks_view),
+                 name='home_processeddocument_chunks'),
+        ]
+        return urls + super().get_urls()
+
+    def chunks_view(self, request, pk):
+        """Xem văn bản theo từng chunk (phân trang) thay vì một textarea chứa toàn bộ tài liệu."""
+        from home.rag import split_text_into_chunks
+
+        doc = get_object_or_404(ProcessedDocument.objects.only('id', 'file_name', 'text_content'), pk=pk)
+        chunks = split_text_into_chunks(doc.text_content, chunk_size=settings.RAG_CHUNK_SIZE)
+        page = Paginator(chunks, self.chunks_per_page).get_page(request.GET.get('page'))
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': doc,
+            'title': f"Chunks: {doc.file_name}",
+            'page': page,
+            'first_index': page.start_index() - 1 if chunks else 0,
+            'chunk_size': settings.RAG_CHUNK_SIZE,
+        }
+        return TemplateResponse(request, 'admin/home/processeddocument/chunks.html', context)
+
+    def stored_text_size(self, obj):
+        return filesizeformat(obj.text_bytes or 0)
+    stored_text_size.short_description = "Văn bản (nén)"
+
+    def text_stats(self, obj):
+        length = len(obj.text_content)
+        stored = getattr(obj, 'text_bytes', None) or 0
+        encoded = len(obj.text_content.encode('utf-8'))
+        ratio = f", nén còn {stored / encoded:.0%}" if encoded else ""
+        return f"{length} ký tự ({filesizeformat(encoded)} UTF-8, lưu {filesizeformat(stored)}{ratio})"
+    text_stats.short_description = "Văn bản"
+
+    def embeddings_size(self, obj):
+        return filesizeformat(getattr(obj, 'embeddings_bytes', None) or 0)
+    embeddings_size.short_description = "Kích thước embeddings"
+
+    def chunks_link(self, obj):
+        if obj.pk is None:
+            return "-"
+        url = reverse('admin:home_processeddocument_chunks', args=[obj.pk])
+        return format_html('<a href="{}">Xem nội dung theo chunk</a>', url)
+    chunks_link.short_description = "Nội dung"
+
+
+@admin.register(ExtractedText)
+class ExtractedTextAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'extractor', 'page_count', 'text_length', 'created_at')
+    list_filter = ('extractor',)
+    search_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'extractor', 'page_count', 'text_length', 'created_at')
+    exclude = ('data',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('data')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'view_name', 'user', 'duration_ms', 'sql_count', 'sql_time_ms', 'trigger', 'created_at')
+    list_filter = ('view_name', 'trigger', 'created_at')
+    search_fields = ('path',)
+    readonly_fields = (
+        'path', 'view_name', 'method', 'user', 'status_code', 'trigger', 'duration_ms',
+        'sql_count', 'sql_time_ms', 'sql_queries', 'stats_preview', 'download_link', 'created_at',
+    )
+    exclude = ('stats_text', 'profile_data')
+
+    def get_queryset(self, request):
+        # Không tải stats/profile (lớn) cho trang danh sách
+        return super().get_queryset(request).defer('stats_text', 'profile_data', 'sql_queries')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='home_requestprofile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.profile_data or b""), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
+
+    def stats_preview(self, obj):
+        return format_html('<pre style="max-height: 600px; overflow: auto;">{}</pre>', obj.stats_text)
+    stats_preview.short_description = "cProfile (cumulative)"
+
+    def download_link(self, obj):
+        url = reverse('admin:home_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">Tải file .prof (mở bằng snakeviz / pstats)</a>', url)
+    download_link.short_description = "File profile"
@@ -0,0 +1,138 @@
+"""
+Kiểm soát số request chạy pipeline RAG (encode + Gemini) đồng thời trong mỗi process.
+
+Tối đa RAG_MAX_CONCURRENT request được chạy cùng lúc; request đến sau chờ trong hàng đợi ngắn
+(RAG_QUEUE_SIZE chỗ, tối đa RAG_QUEUE_TIMEOUT giây) theo độ ưu tiên: staff, rồi user đã đăng nhập,
+rồi khách, cuối cùng là batch API. Hàng đợi đầy hoặc chờ quá hạn thì trả lời "bận" ngay (HTTP 429)
+thay vì để mọi request cùng chậm.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from home import metrics
+
+PRIORITY_STAFF = 0
+PRIORITY_USER = 1
+PRIORITY_ANONYMOUS = 2
+PRIORITY_BATCH = 3
+PRIORITY_NAMES = {
+    PRIORITY_STAFF: 'staff',
+    PRIORITY_USER: 'user',
+    PRIORITY_ANONYMOUS: 'anonymous',
+    PRIORITY_BATCH: 'batch',
+}
+
+
+class Busy(Exception):
+    """Không nhận thêm request: hàng đợi đầy hoặc chờ quá hạn."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def request_priority(request):
+    if request.user.is_staff:
+        return PRIORITY_STAFF
+    if request.user.is_authenticated:
+        return PRIORITY_USER
+    return PRIORITY_ANONYMOUS
+
+
+class AdmissionController:
+    """
+    Semaphore có hàng đợi ưu tiên: chỗ trống được nhường cho request ưu tiên cao nhất
+    (cùng độ ưu tiên thì đến trước được vào trước).
+    """
+
+    def __init__(self, limit=None, queue_size=None, timeout=None):
+        self._limit = limit
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._active = 0
+        self._waiters = []  # heap (priority, seq)
+        self._cancelled = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    # Mặc định đọc settings mỗi lần dùng (đổi được bằng override_settings khi chạy thử)
+    @property
+    def limit(self):
+        return self._limit if self._limit is not None else settings.RAG_MAX_CONCURRENT
+
+    @property
+    def queue_size(self):
+        return self._queue_size if self._queue_size is not None else settings.RAG_QUEUE_SIZE
+
+    @property
+    def timeout(self):
+        return self._timeout if self._timeout is not None else settings.RAG_QUEUE_TIMEOUT
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return len(self._waiters) - len(self._cancelled)
+
+    def _head(self):
+        while self._waiters and self._waiters[0] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._waiters))
+        return self._waiters[0] if self._waiters else None
+
+    @contextmanager
+    def admit(self, priority=PRIORITY_ANONYMOUS):
+        """
+        Chờ tới lượt chạy (hoặc raise Busy). Dùng: `with controller.admit(priority): ...`
+        """
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        started = time.monotonic()
+        with self._cond:
+            if self.limit > 0 and (self._active >= self.limit or self._head() is not None):
+                self._wait(priority, name, started)
+            self._active += 1
+            metrics.ADMISSION_ACTIVE.set(self._active)
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started, priority=name)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                metrics.ADMISSION_ACTIVE.set(self._active)
+                self._cond.notify_all()
+
+    def _wait(self, priority, name, started):
+        """Chờ trong hàng đợi (đang giữ self._cond) tới khi là request đầu hàng và có chỗ trống."""
+        if self.waiting >= self.queue_size:
+            metrics.ADMISSION_REJECTED.inc(reason='queue_full', priority=name)
+            raise Busy('queue_full', retry_after=max(1, round(self.timeout)))
+        entry = (priority, next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        metrics.ADMISSION_QUEUE.inc(priority=name)
+        try:
+            deadline = started + self.timeout
+            while self._active >= self.limit or self._head() != entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._cancelled.add(entry)
+                    # Request kế tiếp trong hàng có thể đã đủ điều kiện chạy
+                    self._cond.notify_all()
+                    metrics.ADMISSION_REJECTED.inc(reason='timeout', priority=name)
+                    raise Busy('timeout', retry_after=max(1, round(self.timeout)))
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiters)
+            # Còn chỗ trống: đánh thức request kế tiếp để nó tự kiểm tra
+            self._cond.notify_all()
+        finally:
+            metrics.ADMISSION_QUEUE.dec(priority=name)
+
+
+# Một controller cho mỗi process, dùng chung cho trang chat và API
+CONTROLLER = AdmissionController()
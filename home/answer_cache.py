@@ -0,0 +1,161 @@
+"""
+Cache câu trả lời và embedding câu hỏi (bảng CachedAnswer, dùng chung giữa các worker).
+
+- Embedding: câu hỏi đã có trong cache (cùng model) không phải encode lại.
+- Câu trả lời: chỉ dùng cho câu hỏi không kèm lịch sử hội thoại và không giới hạn tài liệu; khớp theo câu hỏi
+  đã chuẩn hóa, hoặc theo embedding gần nhất (cosine >= RAG_ANSWER_CACHE_SIMILARITY).
+  Câu trả lời hết hiệu lực khi tài liệu đã dùng làm context bị xóa / xử lý lại hoặc quá RAG_ANSWER_CACHE_TTL.
+"""
+import hashlib
+import logging
+import threading
+import unicodedata
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from home.embeddings import get_model
+from home.metrics import record_cache
+from home.models import CachedAnswer, Document, ProcessedDocument
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question):
+    """Chuẩn hóa câu hỏi để so khớp: NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối."""
+    return " ".join(unicodedata.normalize('NFC', question).lower().split()).rstrip(" ?!.")
+
+
+def question_key(question):
+    return hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+
+
+def encode_questions(questions, model_name):
+    """
+    Embeddings của các câu hỏi bằng model `model_name`: lấy từ cache nếu có, chỉ encode các câu còn thiếu.
+
+    Returns:
+        np.ndarray float32 (số câu hỏi x số chiều) theo thứ tự `questions`
+    """
+    keys = [question_key(question) for question in questions]
+    cached = dict(CachedAnswer.objects.filter(question_key__in=keys, embedding_model=model_name)
+                  .exclude(embedding=None).values_list('question_key', 'embedding'))
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    for key in keys:
+        record_cache('question_embedding', key in cached)
+    encoded = {}
+    if missing:
+        vectors = np.asarray(get_model(model_name).encode([questions[i] for i in missing]), dtype=np.float32)
+        encoded = dict(zip(missing, vectors))
+    rows = [encoded[i] if i in encoded else np.frombuffer(bytes(cached[key]), dtype=np.float32)
+            for i, key in enumerate(keys)]
+    return np.vstack(rows).astype(np.float32)
+
+
+def _fresh(entry):
+    """Câu trả lời còn hiệu lực: chưa quá TTL, mọi tài liệu trong chunk_refs còn nguyên version và cùng chunk_size."""
+    ttl = settings.RAG_ANSWER_CACHE_TTL
+    if ttl and entry.created_at < timezone.now() - timedelta(seconds=ttl):
+        return False
+    refs = entry.chunk_refs or []
+    if any(ref.get("chunk_size", settings.RAG_CHUNK_SIZE) != settings.RAG_CHUNK_SIZE for ref in refs):
+        return False
+    versions = dict(ProcessedDocument.objects.filter(id__in={ref["doc"] for ref in refs})
+                    .values_list('id', 'text_hash'))
+    return all(ref["doc"] in versions and (versions[ref["doc"]] or "").startswith(ref.get("version") or "")
+               for ref in refs)
+
+
+class AnswerCache:
+    """Tra câu trả lời đã cache; giữ ma trận embedding các câu hỏi đã trả lời để khớp gần đúng."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None  # (phiên bản bảng, model, ids, ma trận embedding đã chuẩn hóa)
+
+    def _matrix(self, model_name):
+        """Embeddings các câu hỏi đã có câu trả lời (load lại khi bảng thay đổi)."""
+        entries = CachedAnswer.objects.filter(embedding_model=model_name).exclude(answer_content='').exclude(
+            embedding=None)
+        version = tuple(entries.aggregate(n=Count('id'), last=Max('updated_at')).values())
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == version and state[1] == model_name:
+                return state[2], state[3]
+        ids, rows = [], []
+        for entry_id, embedding in entries.values_list('id', 'embedding'):
+            ids.append(entry_id)
+            rows.append(np.frombuffer(bytes(embedding), dtype=np.float32))
+        matrix = np.vstack(rows) if rows else np.zeros((0, 1), dtype=np.float32)
+        if len(matrix):
+            matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._state = (version, model_name, ids, matrix)
+        return ids, matrix
+
+    def lookup(self, question, embedding=None, model_name=None):
+        """
+        Câu trả lời đã cache còn hiệu lực cho câu hỏi (None nếu không có).
+
+        Args:
+            question: Câu hỏi của user
+            embedding: Embedding câu hỏi (để khớp gần đúng; None: chỉ khớp chính xác)
+            model_name: Model đã tạo `embedding`
+        """
+        entry = CachedAnswer.objects.filter(question_key=question_key(question)).exclude(answer_content='').first()
+        threshold = settings.RAG_ANSWER_CACHE_SIMILARITY
+        if entry is None and embedding is not None and 0 < threshold <= 1:
+            ids, matrix = self._matrix(model_name)
+            if ids and matrix.shape[1] == len(embedding):
+                query = np.asarray(embedding, dtype=np.float32)
+                scores = matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    entry = CachedAnswer.objects.filter(id=ids[best]).first()
+        if entry is not None and not _fresh(entry):
+            logger.info(f"Câu trả lời đã cache hết hiệu lực: {entry.question[:50]}")
+            entry.delete()
+            entry = None
+        record_cache('answer', entry is not None)
+        if entry is not None:
+            CachedAnswer.objects.filter(id=entry.id).update(hit_count=F('hit_count') + 1)
+        return entry
+
+
+def store(question, answer_content, chunk_refs, embedding=None, model_name="", document=None):
+    """Lưu (hoặc ghi đè) câu trả lời và embedding của câu hỏi vào cache."""
+    key = question_key(question)
+    fields = {
+        'question': question,
+        'answer_content': answer_content,
+        'chunk_refs': chunk_refs,
+        'embedding': None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes(),
+        'embedding_model': model_name if embedding is not None else "",
+        'document': document,
+        'created_at': timezone.now(),
+        'updated_at': timezone.now(),
+    }
+    # Không dùng update_or_create (đọc rồi ghi trong một transaction): SQLite báo "database is locked"
+    # khi nhiều thread trả lời trước cùng ghi
+    if CachedAnswer.objects.filter(question_key=key).update(**fields):
+        return
+    try:
+        CachedAnswer.objects.create(question_key=key, **fields)
+    except IntegrityError:
+        CachedAnswer.objects.filter(question_key=key).update(**fields)
+
+
+def invalidate_document(document_id):
+    """Bỏ các câu trả lời trước của tài liệu (khi tài liệu được xử lý lại) và đặt lại tiến độ trả lời trước."""
+    deleted, _ = CachedAnswer.objects.filter(document_id=document_id).delete()
+    Document.objects.filter(id=document_id).update(warm_status='', warm_done=0, warm_total=0)
+    if deleted:
+        logger.info(f"Bỏ {deleted} câu trả lời trước của tài liệu {document_id}")
+
+
+# Cache dùng chung trong process (ma trận embedding các câu hỏi đã trả lời)
+ANSWERS = AnswerCache()
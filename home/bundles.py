@@ -0,0 +1,299 @@
+"""
+Export / import corpus (tài liệu, văn bản đã trích xuất, embeddings) dạng bundle để chuyển giữa các môi trường
+(staging -> production, seed node mới) mà không phải copy cả DB hay encode lại.
+
+Cấu trúc thư mục bundle:
+    manifest.json         format, model embedding, chunk_size, số chiều, số tài liệu / vectors, sha256 từng file
+                          (ghi sau cùng: có manifest nghĩa là bundle đã ghi xong)
+    documents.jsonl.gz    mỗi dòng một tài liệu: thông tin Document, văn bản, text_hash, vị trí (offset, count)
+                          các vectors của tài liệu trong vectors.f32
+    vectors.f32           embeddings float32 (N x dim) của mọi chunks nối liền theo thứ tự documents.jsonl.gz
+                          (cùng định dạng vectors.f32 của index generation, import đọc bằng mmap)
+    files/<sha256>.pdf    (tùy chọn, --with-files) file PDF gốc
+
+Chunks không lưu riêng: chia lại từ văn bản theo chunk_size của manifest (import từ chối nếu khác RAG_CHUNK_SIZE).
+Import ghi DB theo từng lô bằng bulk insert và có thể ghi thẳng generation index từ vectors của bundle.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import connection, transaction
+
+from home.index_store import GenerationWriter, _sha256, publish
+from home.ingest import file_sha256
+from home.models import CHUNK_VERSION_LENGTH, Document, ProcessedDocument
+from home.rag import split_text_into_chunks
+from home.retrieval import active_embedding_model, build_generation, expected_manifest
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+MANIFEST_FILE = 'manifest.json'
+DOCUMENTS_FILE = 'documents.jsonl.gz'
+VECTORS_FILE = 'vectors.f32'
+FILES_DIR = 'files'
+
+
+class BundleError(Exception):
+    """Bundle không hợp lệ / không khớp cấu hình hiện tại."""
+
+
+def _document_entry(document, path, with_files):
+    """Thông tin Document ghi vào bundle (copy file PDF vào bundle nếu `with_files`)."""
+    entry = {
+        'description': document.description,
+        'file': document.document.name,
+        'content_hash': document.content_hash,
+        'extractor': document.extractor,
+        'warm_questions': document.warm_questions,
+        'uploaded_by': document.uploaded_by.username if document.uploaded_by else None,
+    }
+    source = document.document.path if document.document else None
+    if source and os.path.exists(source):
+        if not entry['content_hash']:
+            entry['content_hash'] = file_sha256(source)
+        if with_files:
+            name = f"{entry['content_hash']}.pdf"
+            shutil.copyfile(source, os.path.join(path, FILES_DIR, name))
+            entry['bundled_file'] = name
+    return entry
+
+
+def export_bundle(path, model=None, document_ids=None, with_files=False, progress=None):
+    """
+    Ghi các ProcessedDocument có embeddings của `model` ra bundle `path` (thư mục mới hoặc rỗng).
+
+    Args:
+        path: Thư mục bundle
+        model: Model embedding (mặc định model đang phục vụ)
+        document_ids: Danh sách Document id (None: toàn bộ)
+        with_files: Copy cả file PDF gốc vào bundle
+        progress: Hàm progress(số tài liệu, số vectors) gọi sau mỗi tài liệu
+
+    Returns:
+        manifest (dict)
+    """
+    model = model or active_embedding_model()
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        raise BundleError(f"{path} đã chứa một bundle")
+    os.makedirs(os.path.join(path, FILES_DIR) if with_files else path, exist_ok=True)
+
+    docs = ProcessedDocument.objects.exclude(embeddings__isnull=True).filter(embedding_model=model).select_related(
+        'document', 'document__uploaded_by').order_by('id')
+    if document_ids:
+        docs = docs.filter(document_id__in=document_ids)
+    dimension = None
+    n_docs = n_vectors = 0
+    with gzip.open(os.path.join(path, DOCUMENTS_FILE), 'wt', encoding='utf-8') as out, \
+            open(os.path.join(path, VECTORS_FILE), 'wb') as vector_file:
+        for doc in docs.iterator(chunk_size=50):
+            try:
+                vectors = np.ascontiguousarray(pickle.loads(doc.embeddings), dtype=np.float32)
+            except pickle.UnpicklingError as e:
+                logger.error(f"Bỏ qua doc {doc.id} khi export: {e}")
+                continue
+            if vectors.ndim != 2 or (dimension is not None and vectors.shape[1] != dimension):
+                logger.error(f"Bỏ qua doc {doc.id} khi export: embeddings {vectors.shape}, bundle {dimension} chiều")
+                continue
+            dimension = vectors.shape[1]
+            entry = {
+                'id': doc.id,
+                'file_name': doc.file_name,
+                'text_hash': doc.text_hash,
+                'text': doc.text_content,
+                'offset': n_vectors,
+                'count': len(vectors),
+                'document': _document_entry(doc.document, path, with_files) if doc.document else None,
+            }
+            out.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            vector_file.write(vectors.tobytes())
+            n_docs += 1
+            n_vectors += len(vectors)
+            if progress:
+                progress(n_docs, n_vectors)
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'embedding_model': model,
+        'chunk_size': settings.RAG_CHUNK_SIZE,
+        'dimension': dimension or 0,
+        'n_docs': n_docs,
+        'n_vectors': n_vectors,
+        'with_files': with_files,
+        'files': {
+            name: {'bytes': os.path.getsize(os.path.join(path, name)), 'sha256': _sha256(os.path.join(path, name))}
+            for name in (DOCUMENTS_FILE, VECTORS_FILE)
+        },
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_bundle(path, verify=True):
+    """
+    Đọc và kiểm tra manifest của bundle: format, chunk_size, kích thước (và sha256 nếu `verify`) từng file.
+    Raise BundleError nếu không hợp lệ.
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Không đọc được {MANIFEST_FILE} trong {path}: {e}")
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise BundleError(f"Bundle format {manifest.get('format')}, cần {BUNDLE_FORMAT}")
+    if manifest.get('chunk_size') != settings.RAG_CHUNK_SIZE:
+        raise BundleError(f"Bundle có chunk_size={manifest.get('chunk_size')}, "
+                          f"RAG_CHUNK_SIZE hiện tại là {settings.RAG_CHUNK_SIZE}")
+    if manifest['n_vectors'] * manifest['dimension'] * 4 != manifest['files'][VECTORS_FILE]['bytes']:
+        raise BundleError(f"{VECTORS_FILE}: kích thước không khớp n_vectors x dimension")
+    for name, info in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != info['bytes']:
+            raise BundleError(f"{name}: thiếu file hoặc sai kích thước")
+        if verify and _sha256(file_path) != info['sha256']:
+            raise BundleError(f"{name}: sai sha256")
+    return manifest
+
+
+def _bulk_create(model, objects):
+    """bulk_create nếu DB trả về id của các dòng vừa insert (SQLite, PostgreSQL, MariaDB), không thì save từng dòng."""
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(objects)
+    else:
+        for obj in objects:
+            obj.save()
+
+
+def import_bundle(path, verify=True, build_index=False, user=None, batch_size=200, progress=None):
+    """
+    Import bundle vào DB: tạo Document + ProcessedDocument (đã xử lý, không encode lại) theo lô bằng bulk insert.
+    Tài liệu đã có (trùng SHA-256 file hoặc trùng văn bản cùng model) được bỏ qua nên chạy lại an toàn.
+
+    Args:
+        path: Thư mục bundle
+        verify: Kiểm tra sha256 các file của bundle trước khi import
+        build_index: Build và publish generation index sau khi import. Nếu trước đó DB chưa có tài liệu nào
+            của model này và không giảm chiều (RAG_INDEX_DIMS=0), generation được ghi thẳng từ vectors của bundle
+            trong lúc import thay vì đọc lại embeddings từ DB
+        user: User ghi vào Document.uploaded_by (mặc định theo username trong bundle, nếu có)
+        batch_size: Số tài liệu mỗi transaction
+        progress: Hàm progress(số tài liệu đã import, số tài liệu bỏ qua) gọi sau mỗi lô
+
+    Returns:
+        dict {"imported", "skipped", "vectors", "generation"}
+    """
+    manifest = read_bundle(path, verify=verify)
+    model = manifest['embedding_model']
+    shape = (manifest['n_vectors'], manifest['dimension'])
+    vectors = (np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode='r', shape=shape)
+               if manifest['n_vectors'] else np.zeros((0, manifest['dimension']), dtype=np.float32))
+
+    existing = ProcessedDocument.objects.exclude(embeddings__isnull=True).filter(embedding_model=model)
+    writer = None
+    if build_index and not settings.RAG_INDEX_DIMS and not existing.exists() and manifest['n_vectors']:
+        writer = GenerationWriter(settings.RAG_INDEX_DIR, manifest['dimension'],
+                                  settings=dict(expected_manifest(), embedding_model=model, reduction=None),
+                                  section_size=settings.RAG_SECTION_SIZE)
+    known_texts = set(existing.values_list('text_hash', flat=True))
+    known_files = set(Document.objects.exclude(content_hash='').values_list('content_hash', flat=True))
+    users = {}
+    # File PDF đã copy vào MEDIA_ROOT cho lô chưa ghi xong: xóa nếu import lỗi trước khi lô được commit
+    copied = []
+    stats = {'imported': 0, 'skipped': 0, 'vectors': 0, 'generation': None}
+
+    def save(batch):
+        """Ghi một lô (entry, Document, chunks) trong một transaction."""
+        with transaction.atomic():
+            _bulk_create(Document, [document for _, document, _ in batch])
+            processed = [
+                ProcessedDocument(
+                    file_name=entry['file_name'],
+                    document=document,
+                    text_content=entry['text'],
+                    text_hash=entry['text_hash'],
+                    embeddings=pickle.dumps(np.array(vectors[entry['offset']:entry['offset'] + entry['count']])),
+                    embedding_model=model,
+                )
+                for entry, document, _ in batch
+            ]
+            _bulk_create(ProcessedDocument, processed)
+        copied.clear()
+        if writer is not None:
+            for (entry, document, chunks), doc in zip(batch, processed):
+                writer.add_document(doc.id, document.id, doc.text_hash[:CHUNK_VERSION_LENGTH],
+                                    vectors[entry['offset']:entry['offset'] + entry['count']], chunks)
+        stats['imported'] += len(batch)
+        stats['vectors'] += sum(entry['count'] for entry, _, _ in batch)
+        if progress:
+            progress(stats['imported'], stats['skipped'])
+
+    try:
+        batch = []
+        with gzip.open(os.path.join(path, DOCUMENTS_FILE), 'rt', encoding='utf-8') as lines:
+            for line in lines:
+                entry = json.loads(line)
+                info = entry['document'] or {}
+                if entry['text_hash'] in known_texts or info.get('content_hash') in known_files:
+                    stats['skipped'] += 1
+                    continue
+                if hashlib.sha1(entry['text'].encode('utf-8')).hexdigest() != entry['text_hash']:
+                    raise BundleError(f"Tài liệu {entry['id']}: văn bản không khớp text_hash")
+                chunks = split_text_into_chunks(entry['text'], chunk_size=manifest['chunk_size'])
+                if len(chunks) != entry['count']:
+                    raise BundleError(f"Tài liệu {entry['id']}: {entry['count']} vectors nhưng {len(chunks)} chunks")
+
+                username = info.get('uploaded_by')
+                if user is None and username and username not in users:
+                    users[username] = User.objects.filter(username=username).first()
+                document = Document(
+                    description=info.get('description') or entry['file_name'][:255],
+                    content_hash=info.get('content_hash') or '',
+                    extractor=info.get('extractor') or '',
+                    warm_questions=info.get('warm_questions') or '',
+                    uploaded_by=user or users.get(username),
+                    is_processed=True,
+                )
+                if info.get('bundled_file'):
+                    with open(os.path.join(path, FILES_DIR, info['bundled_file']), 'rb') as f:
+                        document.document.save(os.path.basename(info['file']), File(f), save=False)
+                    copied.append(document.document)
+                else:
+                    # File PDF không có trong bundle: giữ đường dẫn cũ (đồng bộ MEDIA_ROOT riêng)
+                    document.document.name = info.get('file') or ''
+                known_texts.add(entry['text_hash'])
+                if document.content_hash:
+                    known_files.add(document.content_hash)
+                batch.append((entry, document, chunks))
+                if len(batch) >= batch_size:
+                    save(batch)
+                    batch = []
+        if batch:
+            save(batch)
+    except Exception:
+        for file in copied:
+            file.storage.delete(file.name)
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None and not stats['imported']:
+        writer.abort()
+    elif writer is not None:
+        stats['generation'] = writer.finish()
+        publish(settings.RAG_INDEX_DIR, stats['generation'], expected=expected_manifest())
+    elif build_index and stats['imported']:
+        result = build_generation(model=model)
+        stats['generation'] = result[0] if result else None
+    return stats
@@ -0,0 +1,36 @@
+"""
+Load model embedding (SentenceTransformer) theo tên, dùng chung trong process.
+
+Model dùng để encode câu hỏi là model của index generation đang phục vụ (ghi trong manifest),
+nên khi publish generation được build bằng model mới, các worker chuyển model cùng lúc với index.
+"""
+import logging
+import threading
+
+from sentence_transformers import SentenceTransformer
+
+from home.metrics import span
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_models = {}
+
+
+def get_model(name):
+    """
+    Model embedding `name` (load một lần cho mỗi process).
+    Khi load model mới, các model khác được bỏ khỏi cache; request đang chạy vẫn giữ tham chiếu của nó.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(name)
+        if model is None:
+            logger.info(f"Load model embedding {name}")
+            with span('model_load'):
+                model = SentenceTransformer(name)
+            _models.clear()
+            _models[name] = model
+    return model
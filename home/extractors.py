@@ -0,0 +1,215 @@
+"""
+Các backend trích xuất văn bản PDF (PyPDF2, pdfminer.six, pypdfium2) với cùng một interface.
+
+Backend được chọn theo tài liệu (Document.extractor) hoặc theo chính sách RAG_PDF_EXTRACTOR
+(tên backend, hoặc "auto": backend tốt nhất đã cài). Khi đặt RAG_EXTRACT_PAGE_TIMEOUT, việc trích xuất
+chạy trong process con và trang nào quá hạn bị bỏ qua (văn bản rỗng) thay vì làm treo cả lần ingest.
+"""
+import logging
+import multiprocessing
+import sys
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Thứ tự ưu tiên khi RAG_PDF_EXTRACTOR = "auto"
+AUTO_ORDER = ('pypdfium2', 'pdfminer', 'pypdf2')
+# Số trang quá hạn liên tiếp tối đa trước khi coi cả file là lỗi (file không mở được cũng quá hạn mãi)
+MAX_CONSECUTIVE_TIMEOUTS = 3
+
+
+class ExtractionError(Exception):
+    """Không trích xuất được văn bản từ file PDF."""
+
+
+class Extractor:
+    """Backend trích xuất: `iter_pages(path, start)` sinh văn bản từng trang, bắt đầu từ trang `start`."""
+    name = None
+
+    def __init__(self):
+        # Version ghi vào cache văn bản: văn bản đã cache chỉ được dùng lại khi cùng backend và version
+        # ("+nfc": văn bản đã chuẩn hóa NFC, khác văn bản cache trước khi có bước này)
+        self.version = f"{self.name}-{self.library_version()}+nfc"
+
+    @classmethod
+    def available(cls):
+        try:
+            cls.library_version()
+        except ImportError:
+            return False
+        return True
+
+    @staticmethod
+    def library_version():
+        raise NotImplementedError
+
+    def iter_pages(self, path, start=0):
+        raise NotImplementedError
+
+    def pages(self, path, start=0):
+        # NFC: một số file/backend trả về dấu tiếng Việt dạng tổ hợp (chữ + dấu rời)
+        for text in self.iter_pages(path, start):
+            yield unicodedata.normalize('NFC', text or "")
+
+
+class PyPDF2Extractor(Extractor):
+    name = 'pypdf2'
+
+    @staticmethod
+    def library_version():
+        import PyPDF2
+        return PyPDF2.__version__
+
+    def iter_pages(self, path, start=0):
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(path)
+        for page in reader.pages[start:]:
+            yield page.extract_text()
+
+
+class PdfminerExtractor(Extractor):
+    name = 'pdfminer'
+
+    @staticmethod
+    def library_version():
+        import pdfminer
+        return pdfminer.__version__
+
+    def iter_pages(self, path, start=0):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        # page_numbers chỉ cần hỗ trợ `in`: range không tạo danh sách trang
+        for layout in extract_pages(path, page_numbers=range(start, sys.maxsize)):
+            yield "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+
+class PdfiumExtractor(Extractor):
+    name = 'pypdfium2'
+
+    @staticmethod
+    def library_version():
+        import pypdfium2
+        return pypdfium2.V_PYPDFIUM2
+
+    def iter_pages(self, path, start=0):
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            for i in range(start, len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    yield textpage.get_text_range().replace("\r\n", "\n")
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+
+BACKENDS = {cls.name: cls for cls in (PyPDF2Extractor, PdfminerExtractor, PdfiumExtractor)}
+_instances = {}
+
+
+def available_backends():
+    """Tên các backend đã cài đặt được."""
+    return [name for name, cls in BACKENDS.items() if cls.available()]
+
+
+def get_extractor(name=None):
+    """
+    Backend trích xuất theo tên (None/""/"auto": theo RAG_PDF_EXTRACTOR).
+    Raise ExtractionError nếu backend không tồn tại hoặc chưa cài.
+    """
+    if not name:
+        from django.conf import settings
+
+        name = settings.RAG_PDF_EXTRACTOR
+    if name == 'auto':
+        name = next((n for n in AUTO_ORDER if BACKENDS[n].available()), 'pypdf2')
+    extractor = _instances.get(name)
+    if extractor is None:
+        if name not in BACKENDS:
+            raise ExtractionError(f"Không có backend trích xuất '{name}' (có: {', '.join(BACKENDS)})")
+        if not BACKENDS[name].available():
+            raise ExtractionError(f"Backend trích xuất '{name}' chưa được cài đặt")
+        extractor = _instances[name] = BACKENDS[name]()
+    return extractor
+
+
+def extract_pages(path, backend=None, page_timeout=None):
+    """
+    Trích xuất văn bản từng trang của file PDF.
+
+    Args:
+        path: Đường dẫn file PDF
+        backend: Tên backend (None: theo chính sách RAG_PDF_EXTRACTOR)
+        page_timeout: Số giây tối đa cho mỗi trang (None: RAG_EXTRACT_PAGE_TIMEOUT, 0: không giới hạn)
+
+    Returns:
+        Danh sách văn bản từng trang (trang quá hạn là chuỗi rỗng)
+    """
+    extractor = get_extractor(backend)
+    if page_timeout is None:
+        from django.conf import settings
+
+        page_timeout = settings.RAG_EXTRACT_PAGE_TIMEOUT
+    if not page_timeout:
+        return list(extractor.pages(path))
+    return _extract_with_timeout(extractor, path, page_timeout)
+
+
+def _page_worker(name, path, start, conn):
+    """Chạy trong process con: gửi văn bản từng trang qua pipe."""
+    try:
+        for text in get_extractor(name).pages(path, start):
+            conn.send(('page', text))
+        conn.send(('done', None))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _extract_with_timeout(extractor, path, page_timeout):
+    """
+    Trích xuất trong process con; nếu một trang quá `page_timeout` giây thì dừng process đó,
+    bỏ qua trang và chạy process mới từ trang kế tiếp.
+    """
+    context = multiprocessing.get_context()
+    pages = []
+    timeouts = 0
+    while True:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_page_worker, args=(extractor.name, path, len(pages), sender), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            while True:
+                if not receiver.poll(page_timeout):
+                    logger.warning(f"Trang {len(pages) + 1} của {path} quá {page_timeout}s ({extractor.name}), bỏ qua")
+                    process.kill()
+                    timeouts += 1
+                    if timeouts >= MAX_CONSECUTIVE_TIMEOUTS:
+                        raise ExtractionError(f"{timeouts} trang liên tiếp của {path} quá hạn {page_timeout}s")
+                    pages.append("")
+                    break
+                try:
+                    kind, value = receiver.recv()
+                except EOFError:
+                    raise ExtractionError(f"Process trích xuất {path} dừng bất thường (trang {len(pages) + 1})")
+                if kind == 'page':
+                    pages.append(value)
+                    timeouts = 0
+                elif kind == 'done':
+                    return pages
+                else:
+                    raise ExtractionError(value)
+        finally:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+            receiver.close()
@@ -0,0 +1,62 @@
+"""
+Field lưu văn bản dài dạng nén: giá trị Python là str, cột DB là bytes.
+"""
+import zlib
+
+from django.db import models
+
+# Byte đầu của giá trị lưu trong DB cho biết cách nén (để đổi thuật toán sau này mà vẫn đọc được dữ liệu cũ)
+CODEC_ZLIB = b'Z'
+CODEC_NONE = b'N'
+# Văn bản ngắn hơn ngưỡng này (bytes UTF-8) lưu nguyên, nén không được lợi
+MIN_COMPRESS_SIZE = 256
+
+
+def compress_text(text, level=6):
+    data = text.encode('utf-8')
+    if len(data) < MIN_COMPRESS_SIZE:
+        return CODEC_NONE + data
+    return CODEC_ZLIB + zlib.compress(data, level)
+
+
+def decompress_text(value):
+    value = bytes(value)
+    if not value:
+        return ""
+    codec, data = value[:1], value[1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if codec == CODEC_NONE:
+        return data.decode('utf-8')
+    raise ValueError(f"Không nhận ra kiểu nén của văn bản: {codec!r}")
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Văn bản (str) lưu nén zlib trong cột binary. Đọc/ghi trong code như TextField;
+    không lọc/tìm kiếm được theo nội dung trong SQL.
+    """
+    description = "Văn bản nén"
+
+    def get_default(self):
+        default = super().get_default()
+        return "" if default == b"" else default
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return decompress_text(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress_text(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            value = compress_text(value)
+        return super().get_prep_value(value)
+
+    def value_to_string(self, obj):
+        # dumpdata/loaddata: ghi văn bản gốc thay vì base64 của bytes nén
+        return self.value_from_object(obj)
@@ -1,13 +1,44 @@
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from home.models import Document, Answer
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from home.uploads import NOT_PDF_MESSAGE, inspect_upload, pdf_page_count
 
 
 class DocumentForm(forms.ModelForm):
     class Meta:
         model = Document
-        fields = ('description', 'document', )
+        fields = ('description', 'document', 'warm_questions')
+
+    def clean_document(self):
+        """
+        Từ chối file không phải PDF, PDF hỏng/mã hóa/quá nhiều trang và file trùng nội dung với tài liệu đã có
+        (trước khi lưu và xử lý). SHA-256 tính lúc upload được lưu vào Document.content_hash.
+        """
+        document = self.cleaned_data.get('document')
+        if not isinstance(document, UploadedFile):
+            return document  # Sửa tài liệu cũ, không upload file mới
+
+        content_hash, is_pdf = inspect_upload(document)
+        if not is_pdf:
+            raise ValidationError(NOT_PDF_MESSAGE)
+        try:
+            pages = pdf_page_count(document)
+        except Exception as e:
+            raise ValidationError(f"Không đọc được file PDF: {e}")
+        if pages == 0:
+            raise ValidationError("File PDF không có trang nào.")
+        if settings.RAG_UPLOAD_MAX_PAGES and pages > settings.RAG_UPLOAD_MAX_PAGES:
+            raise ValidationError(f"File PDF có {pages} trang (tối đa {settings.RAG_UPLOAD_MAX_PAGES}).")
+
+        duplicate = Document.objects.filter(content_hash=content_hash).exclude(pk=self.instance.pk).first()
+        if duplicate is not None:
+            raise ValidationError(f"File đã được upload trước đó: {duplicate}")
+        self.instance.content_hash = content_hash
+        return document
 
 
 class AnswerForm(forms.ModelForm):
@@ -0,0 +1,404 @@
+"""
+Lưu index tìm kiếm ra đĩa theo từng generation để các worker mở read-only bằng mmap.
+
+Cấu trúc thư mục RAG_INDEX_DIR:
+    CURRENT                 tên generation đang dùng (ghi bằng os.replace nên đổi nguyên tử)
+    HISTORY                 các generation đã lần lượt được publish, mỗi dòng một tên; rollback ghi
+                            "rollback <tên>" (dùng cho rollback)
+    REEMBED.json            trạng thái job encode lại bằng model mới (manage.py reembed)
+    <generation>/
+        manifest.json       model embedding, chunk_size, số chiều, kích thước + sha256 từng file
+        index.faiss         IndexFlatL2 của toàn bộ vectors (đọc bằng IO_FLAG_MMAP_IFC)
+        vectors.f32         vectors float32 (N x dim), dùng cho tìm kiếm trong một tài liệu
+        chunks.bin          text các chunks (utf-8) nối liền
+        chunk_offsets.npy   vị trí byte bắt đầu/kết thúc của từng chunk (N + 1)
+        docs.json           id map: doc, document, version, offset, count của từng tài liệu
+        sections.npy        các section (offset, số chunks, vị trí tài liệu): mỗi tài liệu chia thành
+                            các đoạn section_size chunks liên tiếp
+        centroids.f32       vector trung bình của từng section (mức thô của tìm kiếm hai mức)
+        transform.bin       (tùy chọn) phép giảm chiều PCA / cắt chiều; vectors lưu trong generation đã giảm
+                            chiều, vector câu hỏi và tài liệu mới được áp dụng cùng phép biến đổi
+
+Generation đã ghi không bao giờ bị sửa; build mới tạo thư mục mới rồi đổi CURRENT.
+Khi mở, manifest phải khớp cấu hình hiện tại (chunk_size), nếu không sẽ bị từ chối; model embedding
+ghi trong manifest là model dùng để encode câu hỏi khi generation được phục vụ.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+POINTER_FILE = 'CURRENT'
+HISTORY_FILE = 'HISTORY'
+ROLLBACK_MARK = 'rollback'
+JOB_STATUS_FILE = 'REEMBED.json'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+DATA_FILES = ('index.faiss', 'vectors.f32', 'chunks.bin', 'chunk_offsets.npy', 'docs.json', 'sections.npy',
+              'centroids.f32')
+TRANSFORM_FILE = 'transform.bin'
+DEFAULT_SECTION_SIZE = 32
+REDUCTIONS = ('pca', 'truncate')
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class IndexManifestError(Exception):
+    """Generation thiếu/hỏng manifest hoặc không khớp cấu hình hiện tại."""
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise IndexManifestError(f"Không đọc được manifest của {path}: {e}") from e
+
+
+def check_manifest(path, expected=None):
+    """
+    Kiểm tra manifest: đúng định dạng, đủ file với kích thước đúng, khớp các giá trị `expected`.
+    Raise IndexManifestError nếu không hợp lệ. Trả về manifest.
+    """
+    manifest = read_manifest(path)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise IndexManifestError(f"{path}: định dạng {manifest.get('format')}, cần {FORMAT_VERSION}")
+    for key, value in (expected or {}).items():
+        if manifest.get(key) != value:
+            raise IndexManifestError(f"{path}: manifest {key}={manifest.get(key)!r}, cấu hình hiện tại {value!r}")
+    for name, info in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != info['bytes']:
+            raise IndexManifestError(f"{path}: file {name} thiếu hoặc sai kích thước")
+    return manifest
+
+
+def section_centroids(vectors, section_size):
+    """Vector trung bình của từng đoạn `section_size` vectors liên tiếp (đoạn cuối có thể ngắn hơn)."""
+    if len(vectors) == 0:
+        return np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    starts = np.arange(0, len(vectors), section_size)
+    counts = np.minimum(section_size, len(vectors) - starts)
+    sums = np.add.reduceat(np.asarray(vectors, dtype=np.float32), starts, axis=0)
+    return (sums / counts[:, None]).astype(np.float32)
+
+
+def train_transform(reduction, source_dimension, dims, sample=None):
+    """
+    Tạo phép giảm chiều faiss từ `source_dimension` xuống `dims`.
+
+    Args:
+        reduction: 'pca' (train trên `sample`) hoặc 'truncate' (giữ `dims` chiều đầu, cho model Matryoshka)
+        source_dimension: Số chiều của embeddings
+        dims: Số chiều sau khi giảm
+        sample: Vectors để train PCA (numpy array float32)
+    """
+    if reduction == 'pca':
+        transform = faiss.PCAMatrix(source_dimension, dims)
+        transform.train(np.ascontiguousarray(sample, dtype=np.float32))
+        return transform
+    if reduction == 'truncate':
+        return faiss.RemapDimensionsTransform(source_dimension, dims, False)
+    raise ValueError(f"Phép giảm chiều không hợp lệ: {reduction} (chọn một trong {REDUCTIONS})")
+
+
+def verify_generation(path):
+    """Kiểm tra đầy đủ (sha256 từng file). Trả về danh sách file lỗi."""
+    manifest = read_manifest(path)
+    return [name for name, info in manifest['files'].items()
+            if not os.path.exists(os.path.join(path, name)) or _sha256(os.path.join(path, name)) != info['sha256']]
+
+
+class Generation:
+    """Một generation index đã publish, mở read-only bằng mmap."""
+
+    def __init__(self, path, expected=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.manifest = check_manifest(path, expected)
+        with open(os.path.join(path, 'docs.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dimension = meta['dimension']
+        self.docs = meta['docs']
+        self.ntotal = meta['ntotal']
+        self.index = faiss.read_index(os.path.join(path, 'index.faiss'), MMAP_FLAGS)
+        if self.ntotal:
+            self.vectors = np.memmap(os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r',
+                                     shape=(self.ntotal, self.dimension))
+            self._chunks = np.memmap(os.path.join(path, 'chunks.bin'), dtype=np.uint8, mode='r')
+        else:
+            self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            self._chunks = np.zeros(0, dtype=np.uint8)
+        self._offsets = np.load(os.path.join(path, 'chunk_offsets.npy'), mmap_mode='r')
+        self.section_size = self.manifest.get('section_size', DEFAULT_SECTION_SIZE)
+        self.transform = None
+        if os.path.exists(os.path.join(path, TRANSFORM_FILE)):
+            self.transform = faiss.read_VectorTransform(os.path.join(path, TRANSFORM_FILE))
+        if os.path.exists(os.path.join(path, 'sections.npy')):
+            self.sections = np.load(os.path.join(path, 'sections.npy'))
+            self.centroids = (np.memmap(os.path.join(path, 'centroids.f32'), dtype=np.float32, mode='r',
+                                        shape=(len(self.sections), self.dimension))
+                              if len(self.sections) else np.zeros((0, self.dimension), dtype=np.float32))
+        else:
+            # Generation build trước khi có mức section: tính lại một lần khi mở
+            self.sections, self.centroids = self._compute_sections()
+
+    def _compute_sections(self):
+        sections, centroids = [], []
+        for position, entry in enumerate(self.docs):
+            vectors = self.vectors[entry['offset']:entry['offset'] + entry['count']]
+            centroids.append(section_centroids(vectors, self.section_size))
+            sections.extend((entry['offset'] + start, min(self.section_size, entry['count'] - start), position)
+                            for start in range(0, entry['count'], self.section_size))
+        if not sections:
+            return np.zeros((0, 3), dtype=np.int64), np.zeros((0, self.dimension), dtype=np.float32)
+        return np.array(sections, dtype=np.int64), np.concatenate(centroids)
+
+    def chunk_text(self, i):
+        return self._chunks[self._offsets[i]:self._offsets[i + 1]].tobytes().decode('utf-8')
+
+
+class GenerationWriter:
+    """
+    Ghi một generation mới vào thư mục tạm, finish() ghi manifest rồi đổi tên thành thư mục chính thức.
+    `settings` (model embedding, chunk_size...) được ghi vào manifest để kiểm tra khi mở.
+    Mỗi tài liệu được chia thành các section `section_size` chunks, lưu kèm vector trung bình.
+    Nếu có `transform`, vectors được giảm chiều trước khi ghi (dimension là số chiều sau khi giảm).
+    """
+
+    def __init__(self, index_dir, dimension, settings=None, section_size=DEFAULT_SECTION_SIZE, transform=None):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.source_dimension = dimension
+        self.transform = transform
+        if transform is not None:
+            if transform.d_in != dimension:
+                raise ValueError(f"Phép giảm chiều nhận {transform.d_in} chiều, embeddings {dimension} chiều")
+            dimension = transform.d_out
+        self.dimension = dimension
+        self.settings = settings or {}
+        self.section_size = section_size
+        # Tên theo thời gian (tới micro giây) để sắp xếp theo tên cũng là theo thứ tự build
+        self.name = datetime.now().strftime('%Y%m%d-%H%M%S-%f') + '-' + uuid.uuid4().hex[:4]
+        self.tmp_path = os.path.join(index_dir, f'.{self.name}.tmp')
+        os.makedirs(self.tmp_path)
+        self.index = faiss.IndexFlatL2(dimension)
+        self.docs = []
+        self.offsets = [0]
+        self.sections = []
+        self._vectors = open(os.path.join(self.tmp_path, 'vectors.f32'), 'wb')
+        self._chunks = open(os.path.join(self.tmp_path, 'chunks.bin'), 'wb')
+        self._centroids = open(os.path.join(self.tmp_path, 'centroids.f32'), 'wb')
+
+    def add_document(self, doc_id, document_id, version, vectors, chunks):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[1] != self.source_dimension:
+            raise ValueError(f"Doc {doc_id}: vectors {vectors.shape[1]} chiều, index {self.source_dimension} chiều")
+        if self.transform is not None and len(vectors):
+            vectors = np.ascontiguousarray(self.transform.apply(vectors))
+        if len(chunks) != len(vectors):
+            raise ValueError(f"Doc {doc_id}: {len(vectors)} vectors nhưng {len(chunks)} chunks")
+        offset = self.index.ntotal
+        self.sections.extend((offset + start, min(self.section_size, len(vectors) - start), len(self.docs))
+                             for start in range(0, len(vectors), self.section_size))
+        self._centroids.write(section_centroids(vectors, self.section_size).tobytes())
+        self.docs.append({
+            'doc': doc_id,
+            'document': document_id,
+            'version': version,
+            'offset': offset,
+            'count': len(chunks),
+        })
+        self.index.add(vectors)
+        self._vectors.write(vectors.tobytes())
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            self._chunks.write(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+
+    def finish(self):
+        self._vectors.close()
+        self._chunks.close()
+        self._centroids.close()
+        np.save(os.path.join(self.tmp_path, 'sections.npy'), np.array(self.sections, dtype=np.int64).reshape(-1, 3))
+        faiss.write_index(self.index, os.path.join(self.tmp_path, 'index.faiss'))
+        np.save(os.path.join(self.tmp_path, 'chunk_offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        with open(os.path.join(self.tmp_path, 'docs.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dimension': self.dimension, 'ntotal': self.index.ntotal, 'docs': self.docs}, f)
+        files = DATA_FILES
+        if self.transform is not None:
+            faiss.write_VectorTransform(self.transform, os.path.join(self.tmp_path, TRANSFORM_FILE))
+            files += (TRANSFORM_FILE,)
+
+        manifest = dict(self.settings)
+        manifest.update({
+            'format': FORMAT_VERSION,
+            'name': self.name,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'dimension': self.dimension,
+            'source_dimension': self.source_dimension,
+            'metric': 'L2',
+            'section_size': self.section_size,
+            'n_docs': len(self.docs),
+            'n_vectors': self.index.ntotal,
+            'files': {
+                name: {
+                    'bytes': os.path.getsize(os.path.join(self.tmp_path, name)),
+                    'sha256': _sha256(os.path.join(self.tmp_path, name)),
+                }
+                for name in files
+            },
+        })
+        with open(os.path.join(self.tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        path = os.path.join(self.index_dir, self.name)
+        os.rename(self.tmp_path, path)
+        return self.name
+
+    def abort(self):
+        self._vectors.close()
+        self._chunks.close()
+        self._centroids.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def current_generation(index_dir):
+    """Tên generation đang được publish (None nếu chưa có)."""
+    try:
+        with open(os.path.join(index_dir, POINTER_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(index_dir, name, expected=None, rollback=False):
+    """
+    Đổi CURRENT sang generation `name` (sau khi kiểm tra manifest). Các worker tự reload ở lần sync
+    tiếp theo; câu truy vấn đang chạy vẫn dùng generation cũ cho tới khi xong.
+    `rollback`: `name` là generation trước đó (previous_generation), HISTORY ghi lại là một lần rollback.
+    """
+    if not os.path.isdir(os.path.join(index_dir, name)):
+        raise FileNotFoundError(f"Không có generation {name} trong {index_dir}")
+    check_manifest(os.path.join(index_dir, name), expected)
+    tmp = os.path.join(index_dir, f'.{POINTER_FILE}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(index_dir, POINTER_FILE))
+    with open(os.path.join(index_dir, HISTORY_FILE), 'a', encoding='utf-8') as f:
+        f.write(f"{ROLLBACK_MARK} {name}\n" if rollback else f"{name}\n")
+    logger.info(f"{'Rollback' if rollback else 'Publish'} index generation {name}")
+
+
+def publish_history(index_dir):
+    """
+    Các generation đã publish còn hiệu lực, cũ → mới (generation cuối là generation đang dùng):
+    publish thêm generation vào cuối, rollback bỏ generation cuối (generation bị rollback).
+    """
+    try:
+        with open(os.path.join(index_dir, HISTORY_FILE), encoding='utf-8') as f:
+            lines = [line.split() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    history = []
+    for parts in lines:
+        if len(parts) == 2 and parts[0] == ROLLBACK_MARK:
+            if history:
+                history.pop()
+            if not history or history[-1] != parts[1]:
+                history.append(parts[1])
+        else:
+            history.append(parts[0])
+    return history
+
+
+def previous_generation(index_dir):
+    """
+    Generation được publish trước generation hiện tại và vẫn còn trên đĩa (dùng cho rollback).
+    Rollback nhiều lần liên tiếp lùi dần về các generation cũ hơn.
+    """
+    current = current_generation(index_dir)
+    available = set(list_generations(index_dir))
+    for name in reversed(publish_history(index_dir)):
+        if name != current and name in available:
+            return name
+    return None
+
+
+def write_job_status(index_dir, status):
+    """Ghi trạng thái job encode lại (ghi nguyên tử để worker đọc không gặp file dở dang)."""
+    os.makedirs(index_dir, exist_ok=True)
+    tmp = os.path.join(index_dir, f'.{JOB_STATUS_FILE}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp, os.path.join(index_dir, JOB_STATUS_FILE))
+
+
+def read_job_status(index_dir):
+    """Trạng thái job encode lại gần nhất (None nếu chưa chạy lần nào)."""
+    try:
+        with open(os.path.join(index_dir, JOB_STATUS_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_generations(index_dir):
+    """Danh sách generation (cũ → mới)."""
+    if not os.path.isdir(index_dir):
+        return []
+    return sorted(name for name in os.listdir(index_dir)
+                  if not name.startswith('.') and os.path.isdir(os.path.join(index_dir, name)))
+
+
+def prune_generations(index_dir, keep):
+    """
+    Xóa các generation cũ. Giữ lại generation đang dùng, `keep` generation gần nhất theo thứ tự rollback
+    (previous_generation) và `keep` generation mới nhất chưa từng được publish (build --no-publish).
+    HISTORY được rút gọn theo các generation giữ lại: mọi generation còn trong HISTORY đều rollback được.
+    """
+    current = current_generation(index_dir)
+    available = list_generations(index_dir)
+    history = publish_history(index_dir)
+    targets = []
+    for name in reversed(history):
+        if name != current and name in available and name not in targets:
+            targets.append(name)
+    unpublished = [name for name in available if name != current and name not in history]
+    kept = {current, *targets[:keep], *unpublished[max(len(unpublished) - keep, 0):]}
+
+    compacted = [name for name in history if name in kept]
+    if compacted != history:
+        tmp = os.path.join(index_dir, f'.{HISTORY_FILE}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(f"{name}\n" for name in compacted)
+        os.replace(tmp, os.path.join(index_dir, HISTORY_FILE))
+
+    removed = []
+    for name in available:
+        if name in kept:
+            continue
+        try:
+            shutil.rmtree(os.path.join(index_dir, name))
+            removed.append(name)
+        except OSError as e:
+            # Windows không xóa được file đang được mmap bởi worker khác
+            logger.warning(f"Không xóa được generation {name}: {e}")
+    return removed
@@ -0,0 +1,233 @@
+"""
+Các bước ingest dùng chung cho process_new_documents và manage.py import_pdfs:
+trích xuất văn bản (có cache theo hash file), chia chunks, encode theo batch gộp nhiều tài liệu
+và lưu ProcessedDocument.
+"""
+import hashlib
+import pickle
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from django.db import transaction
+
+from home.answer_cache import invalidate_document
+from home.extractors import extract_pages, get_extractor
+from home.metrics import record_cache, span
+from home.models import ExtractedText, ProcessedDocument
+from home.rag import split_text_into_chunks
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_hash(doc):
+    """SHA-256 nội dung file của Document (tính và lưu lại nếu chưa có)."""
+    if not doc.content_hash:
+        doc.content_hash = file_sha256(doc.document.path)
+        doc.save(update_fields=['content_hash'])
+    return doc.content_hash
+
+
+def cached_pages(content_hash, extractor=None):
+    """
+    Văn bản từng trang đã cache cho file `content_hash` với backend `extractor` (tên, None: theo chính sách)
+    ở version hiện tại (None nếu chưa có).
+    """
+    version = get_extractor(extractor).version
+    cached = ExtractedText.objects.filter(content_hash=content_hash, extractor=version).first()
+    record_cache('extracted_text', cached is not None)
+    return cached.pages if cached is not None else None
+
+
+def store_pages(content_hash, pages, extractor=None):
+    ExtractedText.store(content_hash, get_extractor(extractor).version, pages)
+
+
+def document_pages(doc):
+    """
+    Văn bản từng trang của Document (backend: Document.extractor hoặc theo chính sách):
+    đọc cache, nếu chưa có thì parse PDF rồi lưu cache.
+    """
+    content_hash = document_hash(doc)
+    pages = cached_pages(content_hash, doc.extractor)
+    if pages is None:
+        with span('extract'):
+            pages = extract_pages(doc.document.path, doc.extractor)
+        store_pages(content_hash, pages, doc.extractor)
+    return pages
+
+
+def split_pages(pages, chunk_size):
+    """
+    Ghép văn bản các trang và chia chunks.
+
+    Returns:
+        (text_content, chunks)
+    """
+    text_content = "".join(pages)
+    if not text_content:
+        return "", []
+    return text_content, split_text_into_chunks(text_content, chunk_size=chunk_size)
+
+
+def save_processed_document(doc, text_content, embeddings, embedding_model):
+    """Lưu kết quả xử lý của một Document (embeddings tạo bởi `embedding_model`) và đánh dấu đã xử lý."""
+    with transaction.atomic():
+        processed = ProcessedDocument.objects.create(
+            file_name=doc.description or doc.document.name,
+            text_content=text_content,
+            text_hash=hashlib.sha1(text_content.encode('utf-8')).hexdigest(),
+            embeddings=pickle.dumps(np.asarray(embeddings, dtype=np.float32)),
+            embedding_model=embedding_model,
+            document=doc,
+        )
+        # Câu trả lời trước của phiên bản cũ (nếu có) không còn đúng
+        invalidate_document(doc.id)
+        doc.is_processed = True
+        doc.save(update_fields=['is_processed'])
+    return processed
+
+
+def replace_processed_documents(results, embedding_model):
+    """
+    Thay ProcessedDocument cũ bằng kết quả xử lý lại, trong một transaction: tới lúc commit tài liệu vẫn tìm được
+    bằng bản cũ; tài liệu không có trong `results` (xử lý lại lỗi) giữ nguyên bản cũ.
+
+    Args:
+        results: Danh sách (Document, text_content, embeddings)
+        embedding_model: Model đã tạo embeddings
+
+    Returns:
+        Số bản ghi cũ đã xóa
+    """
+    deleted = 0
+    with transaction.atomic():
+        for doc, text_content, embeddings in results:
+            old_ids = list(ProcessedDocument.objects.filter(document=doc).values_list('id', flat=True))
+            save_processed_document(doc, text_content, embeddings, embedding_model)
+            deleted += ProcessedDocument.objects.filter(id__in=old_ids).delete()[0]
+    return deleted
+
+
+def _torch():
+    try:
+        import torch
+    except ImportError:
+        return None
+    return torch
+
+
+def configure_threads(threads):
+    """
+    Đặt số thread tính toán cho torch (encode) và faiss. threads <= 0: giữ mặc định của thư viện.
+    OMP_NUM_THREADS/MKL_NUM_THREADS chỉ có tác dụng nếu được đặt trước khi process khởi động.
+    Cấu hình chung cho cả process: chỉ gọi trong lệnh ingest; trong process web dùng encode_threads.
+    """
+    if threads <= 0:
+        return
+    torch = _torch()
+    if torch is not None:
+        torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+
+
+@contextmanager
+def encode_threads(threads):
+    """configure_threads trong khối with rồi trả lại số thread cũ (encode câu hỏi của web giữ cấu hình mặc định)."""
+    if threads <= 0:
+        yield
+        return
+    torch = _torch()
+    torch_threads = torch.get_num_threads() if torch is not None else None
+    faiss_threads = faiss.omp_get_max_threads()
+    configure_threads(threads)
+    try:
+        yield
+    finally:
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+        faiss.omp_set_num_threads(faiss_threads)
+
+
+def encode_bucketed(model, texts, batch_size=256, max_batch_chars=None):
+    """
+    Encode texts theo từng nhóm có độ dài gần nhau để giảm padding.
+
+    Texts được sắp xếp theo độ dài (dài trước) rồi cắt thành các batch: mỗi batch có tối đa
+    `max_batch_chars` ký tự tính theo chunk dài nhất (kích thước sau khi pad) và tối đa 4 x batch_size chunks,
+    nên nhóm chunks ngắn được encode với batch lớn hơn.
+
+    Args:
+        model: SentenceTransformer
+        texts: Danh sách chuỗi
+        batch_size: Số chunks mỗi batch với chunks dài nhất
+        max_batch_chars: Ngân sách ký tự mỗi batch (mặc định batch_size x độ dài lớn nhất)
+
+    Returns:
+        np.ndarray float32 (len(texts) x dim) theo đúng thứ tự đầu vào
+    """
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(-lengths, kind='stable')
+    budget = max_batch_chars or batch_size * max(int(lengths[order[0]]), 1)
+    max_count = batch_size * 4
+
+    vectors = None
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        count = max(1, min(max_count, budget // longest, len(order) - start))
+        batch_idx = order[start:start + count]
+        batch = np.asarray(model.encode([texts[i] for i in batch_idx], batch_size=count), dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+        vectors[batch_idx] = batch
+        start += count
+    return vectors
+
+
+class BatchEncoder:
+    """
+    Gom chunks của nhiều tài liệu để encode theo batch lớn thay vì từng tài liệu một.
+
+    add() nhận chunks của một tài liệu; khi số chunks đang chờ đạt pool_size thì encode một lượt
+    (encode_bucketed) và trả về các tài liệu đã có đủ embeddings: danh sách (key, payload, embeddings).
+    pool_size lớn hơn batch_size để các nhóm độ dài đủ đầy.
+    """
+
+    def __init__(self, model, batch_size=256, pool_size=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.pool_size = pool_size or batch_size * 8
+        self._pending = []  # (key, payload, chunks)
+        self._pending_chunks = 0
+        self.encoded_chunks = 0
+
+    def add(self, key, payload, chunks):
+        self._pending.append((key, payload, chunks))
+        self._pending_chunks += len(chunks)
+        if self._pending_chunks >= self.pool_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self._pending:
+            return []
+        pending, self._pending, self._pending_chunks = self._pending, [], 0
+        all_chunks = [chunk for _, _, chunks in pending for chunk in chunks]
+        vectors = encode_bucketed(self.model, all_chunks, batch_size=self.batch_size)
+        self.encoded_chunks += len(all_chunks)
+
+        done = []
+        offset = 0
+        for key, payload, chunks in pending:
+            done.append((key, payload, vectors[offset:offset + len(chunks)]))
+            offset += len(chunks)
+        return done
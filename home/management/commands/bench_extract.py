@@ -0,0 +1,160 @@
+import difflib
+import json
+import os
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.extractors import BACKENDS, available_backends, extract_pages
+from home.models import Document
+
+
+def suspicious_ratio(text):
+    """
+    Tỉ lệ ký tự nghi lỗi trích xuất: ký tự thay thế (U+FFFD), ký tự điều khiển, vùng private use
+    và dấu tổ hợp còn sót sau chuẩn hóa NFC (dấu tiếng Việt bị tách rời khỏi chữ).
+    """
+    if not text:
+        return 0.0
+    bad = 0
+    for char in text:
+        if char == '\ufffd' or (unicodedata.category(char) in ('Cc', 'Co', 'Mn') and char not in '\n\r\t'):
+            bad += 1
+    return bad / len(text)
+
+
+def word_jaccard(a, b):
+    words_a, words_b = set(a.lower().split()), set(b.lower().split())
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def word_similarity(text, reference):
+    """Độ giống theo thứ tự từ (0-1) so với văn bản chuẩn."""
+    return difflib.SequenceMatcher(None, text.split(), reference.split(), autojunk=False).ratio()
+
+
+class Command(BaseCommand):
+    help = (
+        "So sánh các backend trích xuất PDF trên tài liệu thật: tốc độ (trang/s), trang rỗng, "
+        "ký tự nghi lỗi (dấu tiếng Việt bị tách, U+FFFD...), độ trùng khớp giữa các backend "
+        "và (nếu có --reference-dir) độ giống với văn bản chuẩn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help="File PDF hoặc thư mục (mặc định: các tài liệu đã upload).")
+        parser.add_argument('--backend', action='append', choices=sorted(BACKENDS),
+                            help="Backend cần đo (lặp lại được). Mặc định: tất cả backend đã cài.")
+        parser.add_argument('--limit', type=int, default=20, help="Số file tối đa.")
+        parser.add_argument('--page-timeout', type=float, default=settings.RAG_EXTRACT_PAGE_TIMEOUT,
+                            help="Giới hạn giây mỗi trang (0: không giới hạn).")
+        parser.add_argument('--reference-dir',
+                            help="Thư mục văn bản chuẩn: <tên file PDF không đuôi>.txt cho từng file.")
+        parser.add_argument('--json', action='store_true', help="In kết quả dạng JSON.")
+
+    def handle(self, *args, **options):
+        backends = options['backend'] or available_backends()
+        missing = [name for name in backends if not BACKENDS[name].available()]
+        if missing:
+            raise CommandError(f"Backend chưa cài: {', '.join(missing)}")
+        files = self._files(options['paths'], options['limit'])
+        if not files:
+            raise CommandError("Không có file PDF nào để đo.")
+
+        # outputs[backend][file] = văn bản (None nếu lỗi)
+        outputs = {}
+        rows = []
+        for name in backends:
+            outputs[name] = {}
+            pages = empty = chars = failed = 0
+            bad = 0.0
+            elapsed = 0.0
+            for path in files:
+                start = time.perf_counter()
+                try:
+                    result = extract_pages(path, name, page_timeout=options['page_timeout'])
+                except Exception as e:
+                    self.stderr.write(f"[{name}] Lỗi trích xuất {path}: {e}")
+                    failed += 1
+                    outputs[name][path] = None
+                    continue
+                finally:
+                    elapsed += time.perf_counter() - start
+                text = "".join(result)
+                outputs[name][path] = text
+                pages += len(result)
+                empty += sum(1 for page in result if not page.strip())
+                chars += len(text)
+                bad += suspicious_ratio(text) * len(text)
+            rows.append({
+                'backend': name,
+                'files': len(files),
+                'failed': failed,
+                'pages': pages,
+                'pages_per_second': pages / elapsed if elapsed else 0.0,
+                'empty_page_ratio': empty / pages if pages else 0.0,
+                'chars_per_page': chars / pages if pages else 0.0,
+                'suspicious_char_ratio': bad / chars if chars else 0.0,
+            })
+
+        for row in rows:
+            row['agreement'] = self._agreement(row['backend'], outputs)
+            if options['reference_dir']:
+                row['reference_similarity'] = self._reference(outputs[row['backend']], options['reference_dir'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'files': files, 'results': rows}, indent=2))
+            return
+        self.stdout.write(f"{len(files)} file PDF")
+        for row in rows:
+            line = (
+                f"{row['backend']:<10} {row['pages_per_second']:8.1f} trang/s  lỗi={row['failed']:<3} "
+                f"trang rỗng={row['empty_page_ratio']:6.1%}  ký tự/trang={row['chars_per_page']:7.0f}  "
+                f"nghi lỗi={row['suspicious_char_ratio']:7.3%}"
+            )
+            if row['agreement'] is not None:
+                line += f"  khớp backend khác={row['agreement']:.3f}"
+            if row.get('reference_similarity') is not None:
+                line += f"  giống văn bản chuẩn={row['reference_similarity']:.3f}"
+            self.stdout.write(line)
+
+    def _files(self, paths, limit):
+        if not paths:
+            documents = Document.objects.exclude(document='').order_by('-uploaded_at')[:limit]
+            return [doc.document.path for doc in documents if os.path.exists(doc.document.path)]
+        found = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    found.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith('.pdf'))
+            elif os.path.isfile(path):
+                found.append(path)
+            else:
+                raise CommandError(f"Không tìm thấy: {path}")
+        return found[:limit]
+
+    def _agreement(self, name, outputs):
+        """Jaccard trung bình (theo từ, từng file) giữa văn bản của backend `name` và các backend khác."""
+        scores = []
+        for other, texts in outputs.items():
+            if other == name:
+                continue
+            for path, text in outputs[name].items():
+                if text is not None and texts.get(path) is not None:
+                    scores.append(word_jaccard(text, texts[path]))
+        return sum(scores) / len(scores) if scores else None
+
+    def _reference(self, texts, reference_dir):
+        scores = []
+        for path, text in texts.items():
+            reference_path = os.path.join(reference_dir, os.path.splitext(os.path.basename(path))[0] + '.txt')
+            if text is None or not os.path.exists(reference_path):
+                continue
+            with open(reference_path, encoding='utf-8') as f:
+                reference = unicodedata.normalize('NFC', f.read())
+            scores.append(word_similarity(text, reference))
+        return sum(scores) / len(scores) if scores else None
@@ -0,0 +1,226 @@
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from home.rag import extract_text_from_pdf, split_text_into_chunks
+
+STAGES = ('extract', 'split', 'encode', 'index', 'search')
+
+# Từ vựng dùng để sinh văn bản giả lập (ASCII để font PDF chuẩn hiển thị được)
+WORDS = (
+    "tai lieu huong dan quy trinh nhan vien hop dong bao hiem luong thuong "
+    "nghi phep dao tao an toan lao dong chinh sach cong ty khach hang "
+    "document policy employee contract insurance salary training safety"
+).split()
+
+
+def generate_text(n_chars, seed=0):
+    """Sinh văn bản ngẫu nhiên (có dấu chấm câu, xuống dòng) dài khoảng n_chars ký tự."""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < n_chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + ". "
+        if rng.random() < 0.1:
+            sentence += "\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:n_chars]
+
+
+def build_pdf(pages_text):
+    """
+    Tạo file PDF tối giản (font Helvetica chuẩn) với mỗi phần tử là nội dung một trang.
+
+    Returns:
+        Nội dung file PDF dạng bytes
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, điền sau khi biết danh sách trang
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for text in pages_text:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL\n"
+        for line in lines:
+            line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream += f"({line}) Tj T*\n"
+        stream += "ET"
+        data = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % ref for ref in page_refs)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+
+def measure(func, repeat, warmup=1):
+    """Chạy func (warmup + repeat lần), trả về danh sách thời gian (giây) của các lần đo."""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        'median_s': statistics.median(ordered),
+        'min_s': ordered[0],
+        'p95_s': p95,
+        'runs': len(ordered),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark các hàm nóng của pipeline RAG trên dữ liệu sinh ngẫu nhiên: "
+        "trích xuất PDF, chia chunk, encode embedding, build index và tìm kiếm FAISS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', choices=STAGES,
+                            help="Stage cần đo (lặp lại được). Mặc định: tất cả.")
+        parser.add_argument('--repeat', type=int, default=5, help="Số lần đo mỗi phép (sau 1 lần warmup).")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--pages', type=int, default=50, help="Số trang PDF giả lập cho stage extract.")
+        parser.add_argument('--text-mb', type=float, default=5.0, help="Dung lượng văn bản (MB) cho stage split.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--encode-chunks', type=int, default=256, help="Số chunks encode cho mỗi batch size.")
+        parser.add_argument('--batch-sizes', default='8,32,128', help="Các batch size encode, phân cách bằng dấu phẩy.")
+        parser.add_argument('--sizes', default='1000,100000,1000000',
+                            help="Số vectors trong index cho stage index/search.")
+        parser.add_argument('--dim', type=int, default=384, help="Số chiều vector (MiniLM: 384).")
+        parser.add_argument('--queries', type=int, default=100, help="Số câu truy vấn đo latency search.")
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--json', action='store_true', help="In kết quả dạng JSON.")
+
+    def handle(self, *args, **options):
+        stages = options['stage'] or list(STAGES)
+        if options['repeat'] < 1:
+            raise CommandError("--repeat phải >= 1")
+
+        results = []
+        for stage in stages:
+            bench = getattr(self, f'bench_{stage}')
+            results.extend(bench(options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for row in results:
+            self.stdout.write(
+                f"{row['stage']:<8} {row['case']:<24} median={row['median_s'] * 1000:10.2f} ms  "
+                f"p95={row['p95_s'] * 1000:10.2f} ms  {row['throughput']:12.1f} {row['unit']}"
+            )
+
+    def _row(self, stage, case, timings, amount, unit):
+        row = {'stage': stage, 'case': case, 'unit': unit}
+        row.update(summarize(timings))
+        row['throughput'] = amount / row['median_s'] if row['median_s'] else float('inf')
+        return row
+
+    def bench_extract(self, options):
+        pages = [generate_text(3000, seed=options['seed'] + i) for i in range(options['pages'])]
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            tmp.write(build_pdf(pages))
+            path = tmp.name
+        try:
+            if not extract_text_from_pdf(path):
+                raise CommandError("Không trích xuất được văn bản từ PDF giả lập.")
+            timings = measure(lambda: extract_text_from_pdf(path), options['repeat'])
+        finally:
+            os.remove(path)
+        return [self._row('extract', f"{options['pages']} pages", timings, options['pages'], 'pages/s')]
+
+    def bench_split(self, options):
+        n_chars = int(options['text_mb'] * 1024 * 1024)
+        text = generate_text(n_chars, seed=options['seed'])
+        timings = measure(lambda: split_text_into_chunks(text, chunk_size=options['chunk_size']), options['repeat'])
+        return [self._row('split', f"{options['text_mb']:g} MB", timings, n_chars / (1024 * 1024), 'MB/s')]
+
+    def bench_encode(self, options):
+        # Import muộn: load model chỉ khi thực sự đo stage này
+        from home.embeddings import get_model
+        from home.ingest import encode_bucketed
+        from home.retrieval import active_embedding_model
+
+        model = get_model(active_embedding_model())
+
+        text = generate_text(options['encode_chunks'] * options['chunk_size'], seed=options['seed'])
+        chunks = split_text_into_chunks(text, chunk_size=options['chunk_size'])
+        rows = []
+        for batch_size in [int(b) for b in options['batch_sizes'].split(',') if b]:
+            timings = measure(lambda: model.encode(chunks, batch_size=batch_size), options['repeat'])
+            rows.append(self._row('encode', f"batch={batch_size}", timings, len(chunks), 'chunks/s'))
+            timings = measure(lambda: encode_bucketed(model, chunks, batch_size=batch_size), options['repeat'])
+            rows.append(self._row('encode', f"bucketed batch={batch_size}", timings, len(chunks), 'chunks/s'))
+        return rows
+
+    def _vectors(self, n, options):
+        rng = np.random.default_rng(options['seed'])
+        return rng.standard_normal((n, options['dim']), dtype=np.float32)
+
+    def bench_index(self, options):
+        import faiss
+
+        rows = []
+        for n in [int(s) for s in options['sizes'].split(',') if s]:
+            vectors = self._vectors(n, options)
+
+            def build():
+                index = faiss.IndexFlatL2(options['dim'])
+                index.add(vectors)
+
+            timings = measure(build, options['repeat'])
+            rows.append(self._row('index', f"{n} vectors", timings, n, 'vectors/s'))
+        return rows
+
+    def bench_search(self, options):
+        import faiss
+
+        rows = []
+        queries = np.random.default_rng(options['seed'] + 1).standard_normal(
+            (options['queries'], options['dim']), dtype=np.float32)
+        for n in [int(s) for s in options['sizes'].split(',') if s]:
+            index = faiss.IndexFlatL2(options['dim'])
+            index.add(self._vectors(n, options))
+
+            # Đo từng câu truy vấn riêng lẻ (giống making_context: 1 câu hỏi / request)
+            latencies = []
+            for i in range(options['queries']):
+                query = queries[i:i + 1]
+                latencies.extend(measure(lambda: index.search(query, options['k']), 1, warmup=0 if i else 1))
+            rows.append(self._row('search', f"{n} vectors k={options['k']}", latencies, 1, 'queries/s'))
+            del index
+        return rows
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.index_store import REDUCTIONS, prune_generations
+from home.retrieval import build_generation, parse_partition, partition_index_dir
+
+
+class Command(BaseCommand):
+    help = (
+        "Build index generation mới từ ProcessedDocument, ghi ra RAG_INDEX_DIR và publish. "
+        "Các worker đang chạy tự mở generation mới (mmap) ở request tiếp theo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-publish', action='store_true', help="Chỉ ghi generation, không đổi CURRENT.")
+        parser.add_argument('--keep', type=int, default=3, help="Số generation cũ giữ lại (ngoài generation đang dùng).")
+        parser.add_argument('--dims', type=int, default=settings.RAG_INDEX_DIMS,
+                            help="Giảm vectors xuống số chiều này (0: giữ nguyên).")
+        parser.add_argument('--reduction', choices=REDUCTIONS, default=settings.RAG_INDEX_REDUCTION,
+                            help="Phép giảm chiều khi dùng --dims.")
+        parser.add_argument('--partition', metavar='I/N',
+                            help="Chỉ build phần I (đếm từ 0) trong N phần của corpus, cho manage.py retrieval_shard.")
+
+    def handle(self, *args, **options):
+        partition = None
+        if options['partition']:
+            try:
+                partition = parse_partition(options['partition'])
+            except ValueError as e:
+                raise CommandError(str(e))
+        result = build_generation(publish_now=not options['no_publish'], dims=options['dims'],
+                                  reduction=options['reduction'], partition=partition)
+        if result is None:
+            raise CommandError("Không có tài liệu đã xử lý để build index.")
+        name, n_docs, n_vectors = result
+        self.stdout.write(self.style.SUCCESS(f"Generation {name}: {n_docs} tài liệu, {n_vectors} vectors"))
+        if not options['no_publish']:
+            for removed in prune_generations(partition_index_dir(partition), options['keep']):
+                self.stdout.write(f"Đã xóa generation cũ {removed}")
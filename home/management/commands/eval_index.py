@@ -0,0 +1,114 @@
+import json
+import pickle
+import time
+
+import faiss
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.index_store import REDUCTIONS, train_transform
+from home.models import Answer, ProcessedDocument
+from home.recall import recall_at_k
+from home.retrieval import active_embedding_model
+
+
+def mean_recall(truth, found):
+    """recall_at_k trung bình trên các câu truy vấn (mỗi dòng: id vectors tìm được, -1 nếu thiếu)."""
+    return float(np.mean([recall_at_k(found=f[f >= 0].tolist(), truth=t[t >= 0].tolist())
+                          for t, f in zip(truth, found)]))
+
+
+class Command(BaseCommand):
+    help = (
+        "Đánh giá giảm chiều vectors (PCA / cắt chiều) trên dữ liệu thật: recall@k so với tìm kiếm chính xác "
+        "trên vectors đầy đủ, bộ nhớ index và thời gian tìm kiếm cho từng số chiều."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dims', default=str(settings.RAG_INDEX_DIMS or '64,128,192'),
+                            help="Các số chiều cần đánh giá, phân cách bằng dấu phẩy.")
+        parser.add_argument('--reduction', choices=REDUCTIONS, default=settings.RAG_INDEX_REDUCTION)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Số câu truy vấn (lấy từ lịch sử câu hỏi; thiếu thì dùng chunks ngẫu nhiên).")
+        parser.add_argument('--train-size', type=int, default=settings.RAG_PCA_TRAIN_SIZE)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help="In kết quả dạng JSON.")
+
+    def handle(self, *args, **options):
+        model = active_embedding_model()
+        vectors = self._load_vectors(model)
+        if vectors is None:
+            raise CommandError(f"Không có embeddings của model {model} để đánh giá.")
+        rng = np.random.default_rng(options['seed'])
+        queries, source = self._queries(model, vectors, options['queries'], rng)
+        k = min(options['k'], len(vectors))
+        dimension = vectors.shape[1]
+
+        exact = faiss.IndexFlatL2(dimension)
+        exact.add(vectors)
+        start = time.perf_counter()
+        _, truth = exact.search(queries, k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        rows = [self._row('full', dimension, 1.0, vectors.nbytes, exact_ms)]
+        del exact
+
+        sample = vectors[rng.choice(len(vectors), min(options['train_size'], len(vectors)), replace=False)]
+        for dims in [int(d) for d in options['dims'].split(',') if d]:
+            if not 0 < dims < dimension:
+                self.stderr.write(f"Bỏ qua dims={dims} (embeddings có {dimension} chiều)")
+                continue
+            transform = train_transform(options['reduction'], dimension, dims, sample)
+            reduced = np.ascontiguousarray(transform.apply(vectors))
+            index = faiss.IndexFlatL2(dims)
+            index.add(reduced)
+            reduced_queries = np.ascontiguousarray(transform.apply(queries))
+            start = time.perf_counter()
+            _, found = index.search(reduced_queries, k)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            rows.append(self._row(options['reduction'], dims, mean_recall(truth, found), reduced.nbytes, elapsed_ms))
+            del index, reduced
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'model': model, 'vectors': len(vectors), 'queries': len(queries), 'query_source': source,
+                'k': k, 'results': rows,
+            }, indent=2))
+            return
+        self.stdout.write(f"Model {model}: {len(vectors)} vectors, {len(queries)} truy vấn ({source}), recall@{k}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['reduction']:<9} dims={row['dims']:<5} recall={row['recall']:.3f}  "
+                f"index={row['index_mb']:10.1f} MB  search={row['search_ms_per_query']:8.3f} ms/truy vấn"
+            )
+
+    def _row(self, reduction, dims, recall, nbytes, ms_per_query):
+        return {
+            'reduction': reduction,
+            'dims': dims,
+            'recall': recall,
+            'index_mb': nbytes / (1024 * 1024),
+            'search_ms_per_query': ms_per_query,
+        }
+
+    def _load_vectors(self, model):
+        parts = []
+        docs = ProcessedDocument.objects.filter(embedding_model=model).exclude(embeddings__isnull=True).only(
+            'id', 'embeddings')
+        for doc in docs.iterator(chunk_size=50):
+            vectors = pickle.loads(doc.embeddings)
+            if isinstance(vectors, np.ndarray) and vectors.ndim == 2 and len(vectors):
+                parts.append(np.asarray(vectors, dtype=np.float32))
+        return np.ascontiguousarray(np.concatenate(parts)) if parts else None
+
+    def _queries(self, model, vectors, n, rng):
+        """Câu truy vấn: câu hỏi gần đây trong lịch sử (encode bằng model hiện tại), nếu không có thì chunks ngẫu nhiên."""
+        questions = list(Answer.objects.order_by('-ask_at').values_list('ask_content', flat=True)[:n])
+        if questions:
+            # Import muộn: chỉ load model khi có câu hỏi cần encode
+            from home.embeddings import get_model
+
+            return np.ascontiguousarray(get_model(model).encode(questions), dtype=np.float32), 'lịch sử câu hỏi'
+        picked = rng.choice(len(vectors), min(n, len(vectors)), replace=False)
+        return np.ascontiguousarray(vectors[picked]), 'chunks ngẫu nhiên'
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home.bundles import BundleError, export_bundle
+
+
+class Command(BaseCommand):
+    help = (
+        "Export tài liệu đã xử lý (văn bản + embeddings) ra bundle di chuyển được (vectors float32 + manifest "
+        "JSONL) để import ở môi trường khác bằng manage.py import_corpus mà không phải encode lại."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Thư mục bundle (mới hoặc rỗng).")
+        parser.add_argument('document_ids', nargs='*', type=int, help="Id Document (mặc định: tất cả).")
+        parser.add_argument('--model', help="Chỉ export embeddings của model này (mặc định: model đang phục vụ).")
+        parser.add_argument('--with-files', action='store_true', help="Copy cả file PDF gốc vào bundle.")
+
+    def handle(self, *args, **options):
+        def progress(docs, vectors):
+            if docs % 100 == 0:
+                self.stdout.write(f"{docs} tài liệu, {vectors} vectors")
+
+        try:
+            manifest = export_bundle(options['path'], model=options['model'],
+                                     document_ids=options['document_ids'] or None,
+                                     with_files=options['with_files'], progress=progress)
+        except BundleError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong: {manifest['n_docs']} tài liệu, {manifest['n_vectors']} vectors x {manifest['dimension']} chiều "
+            f"(model {manifest['embedding_model']}) -> {options['path']}"))
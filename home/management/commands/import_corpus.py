@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from home.bundles import BundleError, import_bundle
+
+
+class Command(BaseCommand):
+    help = (
+        "Import bundle tạo bởi manage.py export_corpus: tạo Document + ProcessedDocument bằng bulk insert, "
+        "không trích xuất PDF hay encode lại. Tài liệu đã có được bỏ qua nên chạy lại an toàn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Thư mục bundle.")
+        parser.add_argument('--build-index', action='store_true',
+                            help="Build và publish generation index sau khi import (node mới: ghi thẳng từ vectors "
+                                 "của bundle).")
+        parser.add_argument('--no-verify', action='store_true', help="Không kiểm tra sha256 các file của bundle.")
+        parser.add_argument('--user', help="Username ghi vào Document.uploaded_by (mặc định: theo bundle).")
+        parser.add_argument('--batch-size', type=int, default=200, help="Số tài liệu mỗi transaction.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Không có user {options['user']}")
+
+        def progress(imported, skipped):
+            self.stdout.write(f"{imported} tài liệu đã import, {skipped} bỏ qua (đã có)")
+
+        try:
+            stats = import_bundle(options['path'], verify=not options['no_verify'],
+                                  build_index=options['build_index'], user=user,
+                                  batch_size=options['batch_size'], progress=progress)
+        except BundleError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong: {stats['imported']} tài liệu ({stats['vectors']} vectors) đã import, {stats['skipped']} bỏ qua"))
+        if stats['generation']:
+            self.stdout.write(f"Generation {stats['generation']} đã publish")
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from home.ingest import (
+    BatchEncoder, cached_pages, configure_threads, document_hash, file_sha256, save_processed_document, split_pages,
+    store_pages,
+)
+from home.extractors import BACKENDS, extract_pages, get_extractor
+from home.retrieval import active_embedding_model
+from home.models import Document
+
+
+class Checkpoint:
+    """
+    Trạng thái import lưu ra file JSON (ghi nguyên tử) để chạy lại tiếp tục từ chỗ dừng.
+    files: {đường dẫn tương đối: {"document": id, "status": registered|done|empty|failed|duplicate}}
+    (duplicate: nội dung trùng Document `document` đã có, file không được import)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f)
+        os.replace(tmp, self.path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import toàn bộ PDF trong một thư mục: đăng ký Document, trích xuất văn bản song song bằng "
+        "process pool, encode embeddings theo batch lớn. Có checkpoint để chạy lại tiếp tục từ chỗ dừng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--recursive', action='store_true', help="Tìm PDF trong cả thư mục con.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Số process trích xuất PDF.")
+        parser.add_argument('--batch-size', type=int, default=settings.RAG_ENCODE_BATCH_SIZE,
+                            help="Số chunks mỗi batch encode (với chunks dài nhất).")
+        parser.add_argument('--threads', type=int, default=settings.RAG_ENCODE_THREADS,
+                            help="Số thread torch/faiss khi encode (0: mặc định).")
+        parser.add_argument('--checkpoint', help="File checkpoint (mặc định trong MEDIA_ROOT/import_checkpoints/).")
+        parser.add_argument('--user', help="Username ghi vào Document.uploaded_by.")
+        parser.add_argument('--extractor', choices=sorted(BACKENDS),
+                            help="Backend trích xuất PDF cho các file mới (mặc định: RAG_PDF_EXTRACTOR).")
+        parser.add_argument('--retry-failed', action='store_true', help="Xử lý lại các file đã lỗi ở lần chạy trước.")
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError(f"Thư mục không tồn tại: {directory}")
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Không có user {options['user']}")
+
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            settings.MEDIA_ROOT, 'import_checkpoints', hashlib.sha1(directory.encode()).hexdigest()[:16] + '.json')
+        checkpoint = Checkpoint(checkpoint_path)
+
+        files = self._find_pdfs(directory, options['recursive'])
+        if options['extractor']:
+            get_extractor(options['extractor'])  # Báo lỗi sớm nếu backend chưa cài
+        documents = self._register(directory, files, checkpoint, user, options['retry_failed'], options['extractor'])
+        self.stdout.write(f"{len(files)} PDF, {len(documents)} cần xử lý (checkpoint: {checkpoint_path})")
+        if documents:
+            self._ingest(documents, checkpoint, options)
+
+    def _find_pdfs(self, directory, recursive):
+        found = []
+        for root, dirs, names in os.walk(directory):
+            found.extend(os.path.relpath(os.path.join(root, name), directory)
+                         for name in names if name.lower().endswith('.pdf'))
+            if not recursive:
+                break
+        return sorted(found)
+
+    def _register(self, directory, files, checkpoint, user, retry_failed, extractor=None):
+        """
+        Tạo Document cho các file chưa đăng ký; trả về danh sách (relpath, Document) cần xử lý.
+        File trùng nội dung với Document đã có (upload qua web, thư mục khác, file khác trong thư mục) bị bỏ qua.
+        """
+        existing = Document.objects.in_bulk([entry['document'] for entry in checkpoint.files.values()])
+        known = dict(Document.objects.exclude(content_hash='').values_list('content_hash', 'id'))
+        pending = []
+        for relpath in files:
+            entry = checkpoint.files.get(relpath)
+            doc = existing.get(entry['document']) if entry else None
+            if doc is None:
+                source = os.path.join(directory, relpath)
+                content_hash = file_sha256(source)
+                if content_hash in known:
+                    self.stderr.write(f"Bỏ qua {relpath}: trùng nội dung với tài liệu {known[content_hash]}")
+                    checkpoint.files[relpath] = {'document': known[content_hash], 'status': 'duplicate'}
+                    checkpoint.save()
+                    continue
+                doc = Document(description=os.path.splitext(os.path.basename(relpath))[0][:255], uploaded_by=user,
+                               content_hash=content_hash, extractor=extractor or '')
+                with open(source, 'rb') as f:
+                    doc.document.save(os.path.basename(relpath), File(f), save=True)
+                known[content_hash] = doc.id
+                entry = checkpoint.files[relpath] = {'document': doc.id, 'status': 'registered'}
+                checkpoint.save()
+            if (doc.is_processed or entry['status'] in ('empty', 'duplicate')
+                    or (entry['status'] == 'failed' and not retry_failed)):
+                continue
+            pending.append((relpath, doc))
+        return pending
+
+    def _ingest(self, documents, checkpoint, options):
+        # Import muộn: chỉ load model khi thực sự có tài liệu cần encode
+        from home.embeddings import get_model
+
+        configure_threads(options['threads'])
+        model_name = active_embedding_model()
+        encoder = BatchEncoder(get_model(model_name), batch_size=options['batch_size'])
+        total = len(documents)
+        done = 0
+        started = time.monotonic()
+
+        def finish(results):
+            nonlocal done
+            for relpath, (doc, text_content), embeddings in results:
+                try:
+                    save_processed_document(doc, text_content, embeddings, model_name)
+                except Exception as e:
+                    self.stderr.write(f"Lỗi lưu {relpath}: {e}")
+                    checkpoint.files[relpath]['status'] = 'failed'
+                    continue
+                checkpoint.files[relpath]['status'] = 'done'
+                done += 1
+            if results:
+                checkpoint.save()
+                self._progress(done, total, encoder.encoded_chunks, started)
+
+        def handle(relpath, doc, pages):
+            text_content, chunks = split_pages(pages, settings.RAG_CHUNK_SIZE)
+            if not chunks:
+                self.stderr.write(f"Không trích xuất được văn bản từ {relpath}")
+                checkpoint.files[relpath]['status'] = 'empty'
+                checkpoint.save()
+                return
+            finish(encoder.add(relpath, (doc, text_content), chunks))
+
+        # initializer=django.setup: cần khi process con được spawn (Windows/macOS) thay vì fork
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            # Giới hạn số tác vụ đang chờ để không giữ văn bản của hàng nghìn file trong bộ nhớ
+            window = options['workers'] * 4
+            queue = iter(documents)
+            futures = {}
+
+            def submit_next():
+                for relpath, doc in queue:
+                    # Chọn backend ở process cha (Document.extractor hoặc theo chính sách);
+                    # file đã có văn bản trong cache: không cần parse lại
+                    backend = get_extractor(doc.extractor).name
+                    pages = cached_pages(document_hash(doc), backend)
+                    if pages is not None:
+                        handle(relpath, doc, pages)
+                        continue
+                    futures[pool.submit(extract_pages, doc.document.path, backend)] = (relpath, doc)
+                    return
+
+            for _ in range(window):
+                submit_next()
+            while futures:
+                future = next(as_completed(futures))
+                relpath, doc = futures.pop(future)
+                submit_next()
+                try:
+                    pages = future.result()
+                except Exception as e:
+                    self.stderr.write(f"Lỗi trích xuất {relpath}: {e}")
+                    checkpoint.files[relpath]['status'] = 'failed'
+                    checkpoint.save()
+                    continue
+                store_pages(doc.content_hash, pages, doc.extractor)
+                handle(relpath, doc, pages)
+            finish(encoder.flush())
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong {done}/{total} tài liệu, {encoder.encoded_chunks} chunks trong {elapsed:.1f}s"))
+
+    def _progress(self, done, total, chunks, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = done / elapsed
+        eta = (total - done) / rate if rate else float('inf')
+        self.stdout.write(
+            f"[{done}/{total}] {rate:.2f} tài liệu/s, {chunks / elapsed:.1f} chunks/s, ETA {eta / 60:.1f} phút")
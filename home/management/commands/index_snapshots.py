@@ -0,0 +1,104 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.index_store import (
+    IndexManifestError, current_generation, list_generations, previous_generation, prune_generations, publish,
+    read_manifest, verify_generation,
+)
+from home.retrieval import expected_manifest, parse_partition, partition_index_dir, partition_index_dirs
+
+
+class Command(BaseCommand):
+    help = (
+        "Quản lý các generation index trên đĩa: list, publish <tên>, rollback, verify [tên], prune. "
+        "list / verify / prune chạy trên RAG_INDEX_DIR và mọi thư mục phần corpus (build_index --partition)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('list', 'publish', 'rollback', 'verify', 'prune'))
+        parser.add_argument('name', nargs='?', help="Tên generation (publish / verify).")
+        parser.add_argument('--keep', type=int, default=3,
+                            help="prune: số generation rollback được giữ lại (ngoài generation đang dùng).")
+        parser.add_argument('--partition', metavar='I/N',
+                            help="Chỉ thư mục generation của phần I trong N phần corpus (retrieval_shard).")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if options['partition']:
+            try:
+                index_dirs = [partition_index_dir(parse_partition(options['partition']))]
+            except ValueError as e:
+                raise CommandError(str(e))
+        elif action in ('list', 'verify', 'prune'):
+            index_dirs = [settings.RAG_INDEX_DIR] + [path for _, path in partition_index_dirs()]
+        else:
+            index_dirs = [settings.RAG_INDEX_DIR]
+
+        if len(index_dirs) == 1:
+            return self._run(action, index_dirs[0], options)
+        failed = []
+        for index_dir in index_dirs:
+            self.stdout.write(f"[{index_dir}]")
+            try:
+                self._run(action, index_dir, options, many=True)
+            except CommandError as e:
+                self.stderr.write(str(e))
+                failed.append(index_dir)
+        if failed:
+            raise CommandError(f"Lỗi ở {len(failed)}/{len(index_dirs)} thư mục index: {', '.join(failed)}")
+
+    def _run(self, action, index_dir, options, many=False):
+        """Chạy `action` trên một thư mục generation. `many`: đang chạy trên nhiều thư mục."""
+        name = options['name']
+
+        if action == 'list':
+            current = current_generation(index_dir)
+            for generation in list_generations(index_dir):
+                try:
+                    manifest = read_manifest(os.path.join(index_dir, generation))
+                    info = (f"{manifest['n_docs']} tài liệu, {manifest['n_vectors']} vectors, "
+                            f"model={manifest.get('embedding_model')}, chunk_size={manifest.get('chunk_size')}, "
+                            f"dims={manifest.get('dimension')}"
+                            + (f" ({manifest['reduction']} từ {manifest.get('source_dimension')})"
+                               if manifest.get('reduction') else ""))
+                except (IndexManifestError, KeyError) as e:
+                    info = f"manifest lỗi: {e}"
+                marker = '*' if generation == current else ' '
+                self.stdout.write(f"{marker} {generation}  {info}")
+            return
+
+        if action == 'verify':
+            name = name or current_generation(index_dir)
+            if many and (not name or not os.path.isdir(os.path.join(index_dir, name))):
+                self.stdout.write("Không có generation cần kiểm tra.")
+                return
+            if not name:
+                raise CommandError("Chưa có generation nào được publish.")
+            try:
+                broken = verify_generation(os.path.join(index_dir, name))
+            except IndexManifestError as e:
+                raise CommandError(str(e))
+            if broken:
+                raise CommandError(f"Generation {name} hỏng: {', '.join(broken)}")
+            self.stdout.write(self.style.SUCCESS(f"Generation {name} hợp lệ."))
+            return
+
+        if action == 'prune':
+            for removed in prune_generations(index_dir, options['keep']):
+                self.stdout.write(f"Đã xóa generation cũ {removed}")
+            return
+
+        if action == 'rollback':
+            name = previous_generation(index_dir)
+            if not name:
+                raise CommandError("Không có generation trước đó để rollback.")
+        elif not name:
+            raise CommandError("Cần tên generation để publish.")
+
+        try:
+            publish(index_dir, name, expected=expected_manifest(), rollback=action == 'rollback')
+        except (FileNotFoundError, IndexManifestError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Đã publish generation {name}."))
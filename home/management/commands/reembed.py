@@ -0,0 +1,175 @@
+import os
+import pickle
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from home.index_store import (
+    Generation, current_generation, prune_generations, publish, read_job_status, write_job_status,
+)
+from home.ingest import BatchEncoder, configure_threads
+from home.models import ProcessedDocument
+from home.rag import split_text_into_chunks
+from home.retrieval import active_embedding_model, build_generation, expected_manifest
+
+
+class Command(BaseCommand):
+    help = (
+        "Encode lại toàn bộ tài liệu bằng model embedding mới trong khi index hiện tại vẫn phục vụ, "
+        "build generation mới rồi publish: các worker chuyển sang model mới cùng lúc với index. "
+        "Chạy lại cùng lệnh sẽ tiếp tục từ chỗ dừng (tài liệu đã encode bằng model mới được bỏ qua)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', nargs='?', help="Tên model SentenceTransformer mới.")
+        parser.add_argument('--batch-size', type=int, default=settings.RAG_ENCODE_BATCH_SIZE,
+                            help="Số chunks mỗi batch encode (với chunks dài nhất).")
+        parser.add_argument('--threads', type=int, default=settings.RAG_ENCODE_THREADS,
+                            help="Số thread torch/faiss khi encode (0: mặc định).")
+        parser.add_argument('--no-publish', action='store_true', help="Chỉ build generation mới, không đổi CURRENT.")
+        parser.add_argument('--keep', type=int, default=3, help="Số generation cũ giữ lại (ngoài generation đang dùng).")
+        parser.add_argument('--status', action='store_true', help="In trạng thái job gần nhất rồi thoát.")
+
+    def handle(self, *args, **options):
+        index_dir = settings.RAG_INDEX_DIR
+        if options['status']:
+            status = read_job_status(index_dir)
+            if status is None:
+                self.stdout.write("Chưa có job encode lại nào.")
+            for key, value in (status or {}).items():
+                self.stdout.write(f"{key}: {value}")
+            return
+        if not options['model']:
+            raise CommandError("Cần tên model mới (hoặc --status).")
+
+        # Import muộn: load model chỉ khi thực sự encode
+        from home.embeddings import get_model
+
+        self.index_dir = index_dir
+        self.new_model = options['model']
+        old_model = active_embedding_model(index_dir)
+        self.status = {
+            'model': self.new_model,
+            'from_model': old_model,
+            'phase': 'start',
+            'progress': 0.0,
+            'started_at': timezone.now().isoformat(),
+        }
+        try:
+            if old_model != self.new_model:
+                self._ensure_snapshot(old_model)
+
+            configure_threads(options['threads'])
+            self.encoder = BatchEncoder(get_model(self.new_model), batch_size=options['batch_size'])
+            self._reencode('encode')
+
+            self._set_phase('build')
+            result = build_generation(index_dir, publish_now=False, model=self.new_model)
+            if result is None:
+                raise CommandError("Không có tài liệu đã xử lý để build index.")
+            name, n_docs, n_vectors = result
+            self.status['generation'] = name
+            self.stdout.write(f"Generation {name}: {n_docs} tài liệu, {n_vectors} vectors (model {self.new_model})")
+
+            if options['no_publish']:
+                self._set_phase('built')
+                self.stdout.write("Chưa publish; dùng: manage.py index_snapshots publish " + name)
+                return
+            self._set_phase('publish')
+            publish(index_dir, name, expected=expected_manifest())
+            self.stdout.write(self.style.SUCCESS(f"Đã publish {name}: các worker chuyển sang model {self.new_model}"))
+            for removed in prune_generations(index_dir, options['keep']):
+                self.stdout.write(f"Đã xóa generation cũ {removed}")
+
+            # Tài liệu upload trong lúc build vẫn được encode bằng model cũ: encode lại để tìm được với index mới
+            self._reencode('catchup')
+            self._set_phase('done')
+        except BaseException as e:
+            self.status['error'] = str(e)
+            self._set_phase('failed')
+            raise
+
+    def _set_phase(self, phase):
+        self.status['phase'] = phase
+        self.status['updated_at'] = timezone.now().isoformat()
+        write_job_status(self.index_dir, self.status)
+
+    def _ensure_snapshot(self, old_model):
+        """
+        Trước khi ghi đè embeddings trong DB, đảm bảo generation đang phục vụ chứa mọi tài liệu của model cũ:
+        tài liệu chỉ nằm trong bộ nhớ worker (chưa build) sẽ không tìm được trong lúc encode lại.
+        """
+        if ProcessedDocument.objects.filter(embedding_model=self.new_model).exists():
+            return  # Job đang chạy tiếp: generation đang phục vụ đã là bản chụp trước khi encode lại
+        docs = dict(ProcessedDocument.objects.filter(embedding_model=old_model).exclude(
+            embeddings__isnull=True).values_list('id', 'text_hash'))
+        name = current_generation(self.index_dir)
+        covered = {}
+        if name is not None:
+            generation = Generation(os.path.join(self.index_dir, name))
+            covered = {entry['doc']: entry['version'] for entry in generation.docs}
+        if all(doc_id in covered and (text_hash or "").startswith(covered[doc_id])
+               for doc_id, text_hash in docs.items()):
+            return
+        self._set_phase('snapshot')
+        result = build_generation(self.index_dir, model=old_model)
+        if result:
+            self.stdout.write(
+                f"Đã publish generation {result[0]} (model {old_model}) làm bản phục vụ trong lúc encode lại")
+
+    def _reencode(self, phase):
+        """Encode lại (theo batch gộp nhiều tài liệu) mọi tài liệu chưa có embeddings của model mới."""
+        self._set_phase(phase)
+        pending = ProcessedDocument.objects.exclude(embeddings__isnull=True).exclude(embedding_model=self.new_model)
+        done_total = ProcessedDocument.objects.filter(embedding_model=self.new_model).count()
+        seen = set()
+        done = 0
+        chunks_before = self.encoder.encoded_chunks
+        started = time.monotonic()
+
+        def save(results):
+            nonlocal done
+            for doc, _, vectors in results:
+                # Bỏ qua nếu tài liệu đã được xử lý lại trong lúc encode (text_hash đổi)
+                ProcessedDocument.objects.filter(id=doc.id, text_hash=doc.text_hash).update(
+                    embeddings=pickle.dumps(vectors), embedding_model=self.new_model)
+                done += 1
+            if results:
+                self._progress(phase, done, done_total, chunks_before, started)
+
+        # Lặp cho tới khi không còn tài liệu mới (tài liệu upload trong lúc chạy được encode ở vòng sau)
+        while True:
+            ids = [doc_id for doc_id in pending.order_by('id').values_list('id', flat=True) if doc_id not in seen]
+            if not ids:
+                break
+            seen.update(ids)
+            self.total = done_total + len(seen)
+            for start in range(0, len(ids), 200):
+                docs = ProcessedDocument.objects.filter(id__in=ids[start:start + 200]).only(
+                    'id', 'text_content', 'text_hash').order_by('id')
+                for doc in docs:
+                    chunks = split_text_into_chunks(doc.text_content, chunk_size=settings.RAG_CHUNK_SIZE)
+                    if not chunks:
+                        done += 1  # Tài liệu không có chunk nào: không có gì để encode
+                        continue
+                    save(self.encoder.add(doc, None, chunks))
+            save(self.encoder.flush())
+
+    def _progress(self, phase, done, done_before, chunks_before, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        chunks = self.encoder.encoded_chunks - chunks_before
+        remaining = max(self.total - done_before - done, 0)
+        rate = done / elapsed
+        self.status.update({
+            'done': done_before + done,
+            'total': self.total,
+            'progress': round((done_before + done) / self.total, 4) if self.total else 1.0,
+            'chunks_per_second': round(chunks / elapsed, 1),
+            'eta_seconds': round(remaining / rate) if rate else None,
+        })
+        self._set_phase(phase)
+        self.stdout.write(
+            f"[{phase}] {done_before + done}/{self.total} tài liệu, {rate:.2f} tài liệu/s, "
+            f"{chunks / elapsed:.1f} chunks/s, ETA {remaining / rate / 60 if rate else 0:.1f} phút")
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.extractors import BACKENDS, get_extractor
+from home.ingest import BatchEncoder, configure_threads, document_pages, replace_processed_documents, split_pages
+from home.models import Document
+from home.retrieval import active_embedding_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Xử lý lại tài liệu (sau khi đổi RAG_CHUNK_SIZE): chia chunks và tạo embeddings lại rồi thay "
+        "ProcessedDocument cũ trong một transaction (tài liệu lỗi giữ bản cũ). Văn bản đọc từ cache trích xuất "
+        "nên không phải parse lại PDF (trừ khi đổi --extractor). "
+        "Đổi model embedding không cần xử lý lại: dùng manage.py reembed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int, help="Id Document (mặc định: tất cả).")
+        parser.add_argument('--extractor', choices=sorted(BACKENDS) + ['default'],
+                            help="Đổi backend trích xuất PDF của các tài liệu này (default: theo RAG_PDF_EXTRACTOR) "
+                                 "rồi trích xuất lại.")
+
+    def handle(self, *args, **options):
+        # Import muộn: load model embedding khi thực sự chạy
+        from home.embeddings import get_model
+
+        documents = Document.objects.all()
+        if options['document_ids']:
+            documents = documents.filter(id__in=options['document_ids'])
+        if options['extractor']:
+            extractor = '' if options['extractor'] == 'default' else options['extractor']
+            get_extractor(extractor)  # Báo lỗi sớm nếu backend chưa cài
+            documents.update(extractor=extractor)
+
+        configure_threads(settings.RAG_ENCODE_THREADS)
+        model_name = active_embedding_model()
+        encoder = BatchEncoder(get_model(model_name), batch_size=settings.RAG_ENCODE_BATCH_SIZE)
+        # Tạo đủ bản mới trước khi đụng tới bản cũ: trong lúc chạy tài liệu vẫn tìm được
+        results = []
+        count = 0
+        for doc in documents:
+            count += 1
+            try:
+                text_content, chunks = split_pages(document_pages(doc), settings.RAG_CHUNK_SIZE)
+            except Exception as e:
+                self.stderr.write(f"{doc}: lỗi trích xuất ({e}), giữ bản cũ")
+                continue
+            if not chunks:
+                self.stderr.write(f"{doc}: không trích xuất được văn bản, giữ bản cũ")
+                continue
+            results.extend(encoder.add(doc, text_content, chunks))
+        results.extend(encoder.flush())
+
+        deleted = replace_processed_documents(results, model_name)
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong: {len(results)}/{count} tài liệu đã xử lý lại ({deleted} bản ghi cũ đã thay)"))
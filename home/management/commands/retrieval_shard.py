@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.retrieval import VectorStore, parse_partition, partition_index_dir
+from home.shards import ShardServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Chạy process shard tìm kiếm: giữ một phần corpus (--partition I/N, build bằng "
+        "manage.py build_index --partition I/N) và trả lời POST /search từ web (RAG_SHARD_URLS)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partition', metavar='I/N', default='0/1',
+                            help="Phần corpus của shard: tài liệu có id %% N == I (mặc định 0/1: toàn bộ).")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--index-dir', help="Thư mục generation (mặc định thư mục của partition).")
+
+    def handle(self, *args, **options):
+        try:
+            partition = parse_partition(options['partition'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        partition = None if partition == (0, 1) else partition
+        index_dir = options['index_dir'] or partition_index_dir(partition)
+        store = VectorStore(index_dir=index_dir, partition=partition)
+        # Load index trước khi nhận request đầu tiên
+        store.sync()
+
+        server = ShardServer((options['host'], options['port']), store, token=settings.RAG_SHARD_TOKEN)
+        self.stdout.write(self.style.SUCCESS(
+            f"Shard {server.partition}: {len(store)} vectors, generation={store.generation_name}, "
+            f"model={store.embedding_model}, lắng nghe http://{options['host']}:{options['port']}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from home.models import Document
+
+
+class Command(BaseCommand):
+    help = (
+        "Trả lời trước các câu hỏi dự đoán của tài liệu (tiêu đề, mục hỏi đáp, câu hỏi admin nhập) và lưu vào "
+        "cache câu trả lời. Chạy ngay trong process này (job nền sau upload bật bằng RAG_WARM_CACHE)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int, help="Id Document (mặc định: tất cả đã xử lý).")
+
+    def handle(self, *args, **options):
+        # Import muộn: load model embedding khi thực sự chạy
+        from home.warming import warm_document
+
+        documents = Document.objects.filter(is_processed=True)
+        if options['document_ids']:
+            documents = documents.filter(id__in=options['document_ids'])
+        answered = total = 0
+        for document in documents:
+            try:
+                done, count = warm_document(document.id)
+            except Exception as e:
+                Document.objects.filter(id=document.id).update(warm_status='failed')
+                self.stderr.write(f"{document}: lỗi {e}")
+                continue
+            answered += done
+            total += count
+            self.stdout.write(f"{document}: {done}/{count} câu hỏi")
+        self.stdout.write(self.style.SUCCESS(f"Xong: {answered}/{total} câu hỏi đã có câu trả lời trước"))
@@ -0,0 +1,216 @@
+"""
+Đo thời gian từng stage của request chat và xuất metrics dạng Prometheus.
+
+- span(stage): context manager đo thời gian một stage (db_load, embed, index_search,
+  web_search, prompt_build, llm, render...). Thời gian được ghi vào histogram và vào
+  dict timings của request hiện tại (nếu đã gọi start_request()).
+- Counter / Gauge / Histogram: metrics đơn giản, thread-safe, lưu trong process.
+  Mỗi worker có registry riêng (Prometheus scrape từng worker hoặc cộng dồn phía server).
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_timings = contextvars.ContextVar('rag_timings', default=None)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} cần labels {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def _samples(self, key, state):
+        lines = []
+        for bound, count in zip(self.buckets, state['counts']):
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} đã được đăng ký")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, func):
+        """Đăng ký hàm được gọi ngay trước mỗi lần scrape (để cập nhật gauges tính theo DB...)."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram('rag_stage_duration_seconds', "Thời gian từng stage của pipeline RAG.", ('stage',))
+REQUEST_SECONDS = Histogram('rag_request_duration_seconds', "Tổng thời gian xử lý một câu hỏi.", ('status',))
+QUESTIONS = Counter('rag_questions_total', "Số câu hỏi đã xử lý.", ('status',))
+CACHE_REQUESTS = Counter('rag_cache_requests_total', "Số lần tra cache theo kết quả hit/miss.", ('cache', 'result'))
+LLM_FALLBACKS = Counter('rag_llm_fallbacks_total', "Số câu trả lời dự phòng (LLM quá hạn hoặc lỗi).", ('reason',))
+LLM_LATE_ANSWERS = Counter('rag_llm_late_answers_total', "Kết quả LLM về sau hạn chờ của request.", ('result',))
+ADMISSION_ACTIVE = Gauge('rag_admission_active', "Số request đang chạy pipeline RAG trong process.")
+ADMISSION_QUEUE = Gauge('rag_admission_queue_depth', "Số request đang chờ chạy pipeline RAG.", ('priority',))
+ADMISSION_WAIT_SECONDS = Histogram('rag_admission_wait_seconds', "Thời gian chờ trong hàng đợi trước khi được chạy.",
+                                   ('priority',), buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+ADMISSION_REJECTED = Counter('rag_admission_rejected_total', "Số request bị từ chối vì hệ thống bận.",
+                             ('reason', 'priority'))
+CONTEXT_KEPT_RATIO = Histogram('rag_context_kept_ratio', "Tỉ lệ ký tự context còn lại sau khi nén (so với các chunks).",
+                               buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+RATIO_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0)
+RECALL_SAMPLES = Counter('rag_recall_samples_total', "Số câu hỏi được lấy mẫu để đo recall (ok / dropped / error).",
+                         ('result',))
+RECALL_AT_K = Histogram('rag_recall_at_k', "Recall@k của tìm kiếm nhanh so với tìm kiếm chính xác (từng mẫu).",
+                        buckets=RATIO_BUCKETS)
+RANK_OVERLAP = Histogram('rag_rank_overlap', "Độ trùng thứ hạng giữa tìm kiếm nhanh và chính xác (từng mẫu).",
+                         buckets=RATIO_BUCKETS)
+RECALL_WINDOW = Gauge('rag_recall_window', "Recall@k trung bình trên các mẫu gần nhất.")
+RANK_OVERLAP_WINDOW = Gauge('rag_rank_overlap_window', "Độ trùng thứ hạng trung bình trên các mẫu gần nhất.")
+RECALL_ALERT = Gauge('rag_recall_alert', "1 nếu recall trung bình thấp hơn RAG_RECALL_ALERT_THRESHOLD.")
+SHARD_SECONDS = Histogram('rag_shard_request_seconds', "Thời gian gọi tìm kiếm trên từng process shard.", ('shard',))
+SHARD_FAILURES = Counter('rag_shard_failures_total', "Số lần shard không trả lời kịp hoặc lỗi (kết quả thiếu phần đó).",
+                         ('shard', 'reason'))
+INDEX_VECTORS = Gauge('rag_index_vectors', "Số vectors trong index tìm kiếm gần nhất.")
+INGEST_QUEUE = Gauge('rag_ingest_queue_depth', "Số tài liệu đang chờ xử lý (is_processed=False).")
+REEMBED_PROGRESS = Gauge('rag_reembed_progress_ratio', "Tiến độ job encode lại tài liệu bằng model mới (0-1).",
+                         ('model',))
+REEMBED_THROUGHPUT = Gauge('rag_reembed_chunks_per_second', "Tốc độ encode của job encode lại tài liệu.", ('model',))
+
+
+def start_request():
+    """Bắt đầu ghi timings cho request hiện tại. Trả về dict {stage: milliseconds}."""
+    timings = {}
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+@contextmanager
+def span(stage):
+    """Đo thời gian một stage, ghi vào histogram và timings của request hiện tại."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + elapsed * 1000, 2)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render_prometheus():
+    return REGISTRY.render()
@@ -0,0 +1,121 @@
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.urls import resolve, Resolver404
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """execute_wrapper đếm số câu SQL và tổng thời gian chạy SQL trong một request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.total_time += elapsed
+            self.queries.append((elapsed, sql))
+
+    def slowest(self, limit=20):
+        ordered = sorted(self.queries, key=lambda q: q[0], reverse=True)[:limit]
+        return [{'ms': round(elapsed * 1000, 3), 'sql': sql[:1000]} for elapsed, sql in ordered]
+
+
+class ProfilingMiddleware:
+    """
+    Profile request theo yêu cầu (cProfile + số lượng/thời gian SQL) và lưu vào RequestProfile.
+
+    Chỉ áp dụng cho các view có tên trong settings.PROFILE_VIEWS. Một request được profile khi:
+    - User staff gửi header "X-Profile: 1" hoặc query "?_profile=1", hoặc
+    - Được chọn ngẫu nhiên theo tỉ lệ settings.PROFILE_SAMPLE_RATE (0.0 - 1.0).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if not trigger:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+
+        try:
+            profile = self._save(request, response, trigger, profiler, recorder, duration)
+            response['X-Profile-Id'] = str(profile.id)
+        except Exception as e:
+            logger.error(f"Lỗi lưu profile cho {request.path}: {e}")
+        return response
+
+    def _view_name(self, request):
+        try:
+            return resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+
+    def _trigger(self, request):
+        view_name = self._view_name(request)
+        if view_name not in settings.PROFILE_VIEWS:
+            return None
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            if request.headers.get('X-Profile') == '1':
+                return 'header'
+            if request.GET.get('_profile') == '1':
+                return 'query'
+        if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return 'sample'
+        return None
+
+    def _save(self, request, response, trigger, profiler, recorder, duration):
+        from home.models import RequestProfile
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(60)
+        profiler.create_stats()
+
+        user = getattr(request, 'user', None)
+        profile = RequestProfile.objects.create(
+            path=request.path[:255],
+            view_name=self._view_name(request) or '',
+            method=request.method,
+            user=user if user is not None and user.is_authenticated else None,
+            status_code=response.status_code,
+            trigger=trigger,
+            duration_ms=round(duration * 1000, 2),
+            sql_count=recorder.count,
+            sql_time_ms=round(recorder.total_time * 1000, 2),
+            sql_queries=recorder.slowest(),
+            stats_text=stream.getvalue(),
+            profile_data=marshal.dumps(profiler.stats),
+        )
+        logger.info(
+            f"Profile {profile.id}: {request.method} {request.path} {profile.duration_ms} ms, "
+            f"{profile.sql_count} SQL ({profile.sql_time_ms} ms)"
+        )
+        return profile
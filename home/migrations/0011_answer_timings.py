@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_answer_context'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='timings',
+            field=models.JSONField(blank=True, help_text='Thời gian từng stage (ms): db_load, embed, index_search, llm...', null=True),
+        ),
+    ]
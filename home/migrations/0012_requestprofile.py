@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_answer_timings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Đường dẫn request', max_length=255)),
+                ('view_name', models.CharField(blank=True, help_text='Tên URL của view', max_length=100)),
+                ('method', models.CharField(help_text='HTTP method', max_length=10)),
+                ('status_code', models.PositiveSmallIntegerField(help_text='HTTP status trả về', null=True)),
+                ('trigger', models.CharField(help_text='Lý do profile: header, query hoặc sample', max_length=20)),
+                ('duration_ms', models.FloatField(help_text='Tổng thời gian request (ms)')),
+                ('sql_count', models.PositiveIntegerField(default=0, help_text='Số câu SQL')),
+                ('sql_time_ms', models.FloatField(default=0, help_text='Tổng thời gian SQL (ms)')),
+                ('sql_queries', models.JSONField(blank=True, help_text='Các câu SQL chậm nhất', null=True)),
+                ('stats_text', models.TextField(blank=True, help_text='Kết quả pstats (sắp xếp theo cumulative)')),
+                ('profile_data', models.BinaryField(blank=True, help_text='Dữ liệu cProfile (định dạng .prof)', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Thời gian profile')),
+                ('user', models.ForeignKey(blank=True, help_text='User gửi request', null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Profile request',
+                'verbose_name_plural': 'Profile request',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
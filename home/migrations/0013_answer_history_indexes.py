@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_requestprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='answer',
+            options={'ordering': ['-ask_at', '-id'], 'verbose_name': 'Câu hỏi & Trả lời', 'verbose_name_plural': 'Câu hỏi & Trả lời'},
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['uploaded_by', '-ask_at', '-id'], name='answer_user_askat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['-ask_at'], name='answer_askat_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_answer_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='chunk_refs',
+            field=models.JSONField(blank=True, help_text='Chunks đã dùng làm context: [{doc, chunk, score, version}]', null=True),
+        ),
+        migrations.AddField(
+            model_name='processeddocument',
+            name='text_hash',
+            field=models.CharField(blank=True, help_text='SHA-1 của text_content (version của chunks)', max_length=40),
+        ),
+    ]
@@ -0,0 +1,92 @@
+import hashlib
+
+from django.db import migrations
+
+# Giá trị tại thời điểm viết migration (views.CHUNK_SIZE, models.CHUNK_VERSION_LENGTH)
+CHUNK_SIZE = 1000
+CHUNK_VERSION_LENGTH = 16
+
+
+def split_text_into_chunks(text, chunk_size=CHUNK_SIZE):
+    chunks = []
+    for i in range(0, len(text), chunk_size):
+        chunk = text[i:i + chunk_size]
+        if chunk.strip():
+            chunks.append(chunk)
+    return chunks
+
+
+def parse_context(context, chunk_map):
+    """
+    Tách context (" ".join(chunks)) thành danh sách tham chiếu chunk.
+    Trả về None nếu có đoạn không khớp chunk nào hiện có.
+    """
+    refs = []
+    pos = 0
+    while pos < len(context):
+        match = None
+        # Chunk đầy đủ dài đúng CHUNK_SIZE; chunk cuối của tài liệu có thể ngắn hơn
+        candidate = context[pos:pos + CHUNK_SIZE]
+        if candidate in chunk_map:
+            match = candidate
+        else:
+            for end in range(min(len(context), pos + CHUNK_SIZE), pos, -1):
+                if (end == len(context) or context[end] == " ") and context[pos:end] in chunk_map:
+                    match = context[pos:end]
+                    break
+        if match is None:
+            return None
+        doc_id, chunk_index, version = chunk_map[match]
+        refs.append({"doc": doc_id, "chunk": chunk_index, "score": None, "version": version})
+        pos += len(match) + 1  # bỏ qua dấu cách nối giữa các chunks
+    return refs
+
+
+def forwards(apps, schema_editor):
+    ProcessedDocument = apps.get_model('home', 'ProcessedDocument')
+    Answer = apps.get_model('home', 'Answer')
+
+    chunk_map = {}
+    for doc in ProcessedDocument.objects.all().iterator():
+        doc.text_hash = hashlib.sha1(doc.text_content.encode('utf-8')).hexdigest()
+        doc.save(update_fields=['text_hash'])
+        version = doc.text_hash[:CHUNK_VERSION_LENGTH]
+        for index, chunk in enumerate(split_text_into_chunks(doc.text_content)):
+            chunk_map.setdefault(chunk, (doc.id, index, version))
+
+    answers = Answer.objects.exclude(context__isnull=True).exclude(context="").only('id', 'context')
+    for answer in answers.iterator():
+        refs = parse_context(answer.context, chunk_map)
+        if refs is None:
+            # Không khớp (tài liệu đã xóa / xử lý lại): giữ nguyên context dạng text
+            continue
+        Answer.objects.filter(id=answer.id).update(chunk_refs=refs, context=None)
+
+
+def backwards(apps, schema_editor):
+    ProcessedDocument = apps.get_model('home', 'ProcessedDocument')
+    Answer = apps.get_model('home', 'Answer')
+
+    doc_chunks = {}
+    answers = Answer.objects.filter(context__isnull=True).exclude(chunk_refs__isnull=True)
+    for answer in answers.iterator():
+        texts = []
+        for ref in answer.chunk_refs:
+            if ref["doc"] not in doc_chunks:
+                doc = ProcessedDocument.objects.filter(id=ref["doc"]).first()
+                doc_chunks[ref["doc"]] = split_text_into_chunks(doc.text_content) if doc else []
+            chunks = doc_chunks[ref["doc"]]
+            if 0 <= ref["chunk"] < len(chunks):
+                texts.append(chunks[ref["chunk"]])
+        Answer.objects.filter(id=answer.id).update(context=" ".join(texts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_answer_chunk_refs'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_convert_answer_context_to_chunk_refs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 nội dung file PDF', max_length=64)),
+                ('extractor', models.CharField(help_text='Version bộ trích xuất', max_length=50)),
+                ('page_count', models.PositiveIntegerField(default=0, help_text='Số trang')),
+                ('text_length', models.PositiveIntegerField(default=0, help_text='Tổng số ký tự')),
+                ('data', models.BinaryField(help_text='Văn bản từng trang (JSON nén zlib)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Thời gian trích xuất')),
+            ],
+            options={
+                'verbose_name': 'Cache văn bản trích xuất',
+                'verbose_name_plural': 'Cache văn bản trích xuất',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 nội dung file', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='extractedtext',
+            constraint=models.UniqueConstraint(fields=('content_hash', 'extractor'), name='extractedtext_hash_extractor_uniq'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def tag_existing_embeddings(apps, schema_editor):
+    # Embeddings đã có được tạo bởi model đang cấu hình (trước đây cố định all-MiniLM-L6-v2)
+    ProcessedDocument = apps.get_model('home', 'ProcessedDocument')
+    ProcessedDocument.objects.filter(embedding_model='').exclude(embeddings__isnull=True).update(
+        embedding_model=settings.RAG_EMBEDDING_MODEL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0016_extracted_text_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processeddocument',
+            name='embedding_model',
+            field=models.CharField(blank=True, db_index=True, help_text='Model đã tạo embeddings', max_length=100),
+        ),
+        migrations.RunPython(tag_existing_embeddings, migrations.RunPython.noop),
+    ]
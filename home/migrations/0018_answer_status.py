@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_processeddocument_embedding_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='status',
+            field=models.CharField(choices=[('complete', 'Đầy đủ'), ('pending', 'Dự phòng, đang chờ câu trả lời đầy đủ'), ('degraded', 'Dự phòng (mô hình AI không trả lời)')], default='complete', help_text='Câu trả lời đầy đủ hay dự phòng (trích từ tài liệu khi LLM chậm/lỗi)', max_length=10),
+        ),
+    ]
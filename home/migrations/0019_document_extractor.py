@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_answer_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extractor',
+            field=models.CharField(blank=True, choices=[('pypdf2', 'pypdf2'), ('pdfminer', 'pdfminer'), ('pypdfium2', 'pypdfium2')], help_text='Backend trích xuất PDF (để trống: theo RAG_PDF_EXTRACTOR)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.6 on 2026-10-19 00:10
+
+from django.db import migrations, models
+
+import home.fields
+
+BATCH_SIZE = 100
+
+
+def compress_text(apps, schema_editor):
+    ProcessedDocument = apps.get_model('home', 'ProcessedDocument')
+    batch = []
+    for doc in ProcessedDocument.objects.only('id', 'text_content').iterator(chunk_size=BATCH_SIZE):
+        doc.text_data = doc.text_content
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            ProcessedDocument.objects.bulk_update(batch, ['text_data'])
+            batch = []
+    ProcessedDocument.objects.bulk_update(batch, ['text_data'])
+
+
+def decompress_text(apps, schema_editor):
+    ProcessedDocument = apps.get_model('home', 'ProcessedDocument')
+    batch = []
+    for doc in ProcessedDocument.objects.only('id', 'text_data').iterator(chunk_size=BATCH_SIZE):
+        doc.text_content = doc.text_data
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            ProcessedDocument.objects.bulk_update(batch, ['text_content'])
+            batch = []
+    ProcessedDocument.objects.bulk_update(batch, ['text_content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0019_document_extractor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processeddocument',
+            name='text_data',
+            field=home.fields.CompressedTextField(null=True),
+        ),
+        # Cho phép NULL trước khi xóa để migrate ngược thêm lại được cột rồi mới chép dữ liệu vào
+        migrations.AlterField(
+            model_name='processeddocument',
+            name='text_content',
+            field=models.TextField(null=True, help_text='Nội dung văn bản đã trích xuất'),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+        migrations.RemoveField(
+            model_name='processeddocument',
+            name='text_content',
+        ),
+        migrations.RenameField(
+            model_name='processeddocument',
+            old_name='text_data',
+            new_name='text_content',
+        ),
+        migrations.AlterField(
+            model_name='processeddocument',
+            name='text_content',
+            field=home.fields.CompressedTextField(help_text='Nội dung văn bản đã trích xuất (lưu nén zlib)'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_compress_text_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='warm_done',
+            field=models.PositiveIntegerField(default=0, help_text='Số câu hỏi đã trả lời trước'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='warm_questions',
+            field=models.TextField(blank=True, help_text='Câu hỏi được trả lời trước sau khi xử lý (mỗi dòng một câu), ngoài các câu tự sinh từ tiêu đề / mục hỏi đáp'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='warm_status',
+            field=models.CharField(blank=True, choices=[('queued', 'Đang chờ'), ('running', 'Đang chạy'), ('done', 'Xong'), ('failed', 'Lỗi')], help_text='Trạng thái job trả lời trước (home.warming)', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='warm_total',
+            field=models.PositiveIntegerField(default=0, help_text='Số câu hỏi cần trả lời trước'),
+        ),
+        migrations.CreateModel(
+            name='CachedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField(help_text='Câu hỏi')),
+                ('question_key', models.CharField(help_text='SHA-256 của câu hỏi đã chuẩn hóa', max_length=64, unique=True)),
+                ('embedding_model', models.CharField(blank=True, help_text='Model đã tạo embedding', max_length=100)),
+                ('embedding', models.BinaryField(blank=True, help_text='Embedding câu hỏi (float32)', null=True)),
+                ('answer_content', models.TextField(blank=True, help_text='Câu trả lời (để trống: chỉ cache embedding)')),
+                ('chunk_refs', models.JSONField(blank=True, help_text='Chunks đã dùng làm context', null=True)),
+                ('hit_count', models.PositiveIntegerField(default=0, help_text='Số lần được dùng')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Thời gian tạo câu trả lời')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, help_text='Tài liệu sinh ra câu hỏi (job trả lời trước)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cached_answers', to='home.document')),
+            ],
+            options={
+                'verbose_name': 'Câu trả lời đã cache',
+                'verbose_name_plural': 'Câu trả lời đã cache',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
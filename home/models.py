@@ -1,6 +1,68 @@
+import json
+import logging
+import zlib
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 
+from home.extractors import BACKENDS
+from home.fields import CompressedTextField
+
+logger = logging.getLogger(__name__)
+
+# Số ký tự đầu của ProcessedDocument.text_hash dùng làm version trong Answer.chunk_refs
+CHUNK_VERSION_LENGTH = 16
+
+
+def load_chunk_texts(chunk_refs):
+    """
+    Lấy lại text của các chunks từ tham chiếu {"doc", "chunk", "version"}.
+    Bỏ qua chunk của tài liệu đã bị xóa, đã xử lý lại (version khác) hoặc được chia với chunk_size khác
+    RAG_CHUNK_SIZE hiện tại (tham chiếu cũ không có "chunk_size" được coi như cùng chunk_size).
+    Tham chiếu có "sentences" (context đã nén) chỉ lấy các câu ở những vị trí đó.
+    
+    Args:
+        chunk_refs: Danh sách tham chiếu chunk (Answer.chunk_refs)
+        
+    Returns:
+        Danh sách text chunks theo thứ tự trong chunk_refs
+    """
+    from home.rag import join_sentences, split_sentences, split_text_into_chunks
+
+    doc_ids = {ref["doc"] for ref in chunk_refs}
+    docs = ProcessedDocument.objects.filter(id__in=doc_ids).only('id', 'text_content', 'text_hash').in_bulk()
+    doc_chunks = {}
+    texts = []
+    for ref in chunk_refs:
+        doc = docs.get(ref["doc"])
+        if doc is None:
+            logger.warning(f"Chunk tham chiếu tài liệu đã xóa: {ref}")
+            continue
+        if ref.get("version") and doc.text_hash and not doc.text_hash.startswith(ref["version"]):
+            logger.warning(f"Chunk tham chiếu phiên bản cũ của tài liệu {doc.id}: {ref}")
+            continue
+        if ref.get("chunk_size", settings.RAG_CHUNK_SIZE) != settings.RAG_CHUNK_SIZE:
+            logger.warning(f"Chunk tham chiếu chunk_size={ref['chunk_size']}, hiện tại {settings.RAG_CHUNK_SIZE}: {ref}")
+            continue
+        if doc.id not in doc_chunks:
+            doc_chunks[doc.id] = split_text_into_chunks(doc.text_content, chunk_size=settings.RAG_CHUNK_SIZE)
+        chunks = doc_chunks[doc.id]
+        if 0 <= ref["chunk"] < len(chunks):
+            text = chunks[ref["chunk"]]
+            if ref.get("sentences") is not None:
+                text = join_sentences(split_sentences(text), ref["sentences"])
+            texts.append(text)
+    return texts
+
+
+WARM_STATUS_CHOICES = [
+    ('queued', 'Đang chờ'),
+    ('running', 'Đang chạy'),
+    ('done', 'Xong'),
+    ('failed', 'Lỗi'),
+]
+
 
 class Document(models.Model):
     """
@@ -11,6 +73,16 @@ class Document(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian upload")
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, help_text="User upload")
     is_processed = models.BooleanField(default=False, help_text="Đã xử lý (trích xuất, embedding)?")
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 nội dung file")
+    extractor = models.CharField(max_length=20, blank=True, choices=[(name, name) for name in BACKENDS],
+                                 help_text="Backend trích xuất PDF (để trống: theo RAG_PDF_EXTRACTOR)")
+    warm_questions = models.TextField(blank=True,
+                                      help_text="Câu hỏi được trả lời trước sau khi xử lý (mỗi dòng một câu), "
+                                                "ngoài các câu tự sinh từ tiêu đề / mục hỏi đáp")
+    warm_status = models.CharField(max_length=10, blank=True, choices=WARM_STATUS_CHOICES,
+                                   help_text="Trạng thái job trả lời trước (home.warming)")
+    warm_done = models.PositiveIntegerField(default=0, help_text="Số câu hỏi đã trả lời trước")
+    warm_total = models.PositiveIntegerField(default=0, help_text="Số câu hỏi cần trả lời trước")
 
     def __str__(self):
         return self.description or self.document.name
@@ -25,19 +97,45 @@ class Answer(models.Model):
     """
     Model lưu trữ lịch sử Q&A của user.
     """
+    STATUS_COMPLETE = 'complete'
+    STATUS_PENDING = 'pending'
+    STATUS_DEGRADED = 'degraded'
+    STATUS_CHOICES = [
+        (STATUS_COMPLETE, 'Đầy đủ'),
+        (STATUS_PENDING, 'Dự phòng, đang chờ câu trả lời đầy đủ'),
+        (STATUS_DEGRADED, 'Dự phòng (mô hình AI không trả lời)'),
+    ]
+
     ask_content = models.TextField(help_text="Nội dung câu hỏi")
     ask_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian hỏi")
     answer_content = models.TextField(help_text="Nội dung câu trả lời")
     answer_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian trả lời")
     context = models.TextField(blank=True, null=True, help_text="Context (chunks liên quan) được dùng để tạo câu trả lời")
+    chunk_refs = models.JSONField(blank=True, null=True, help_text="Chunks đã dùng làm context: [{doc, chunk, score, version}]")
+    timings = models.JSONField(blank=True, null=True, help_text="Thời gian từng stage (ms): db_load, embed, index_search, llm...")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_COMPLETE,
+                              help_text="Câu trả lời đầy đủ hay dự phòng (trích từ tài liệu khi LLM chậm/lỗi)")
     uploaded_file = models.FileField(upload_to='', blank=True, null=True, help_text="File được tham chiếu (optional)")
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, help_text="User đặt câu hỏi")
 
     def __str__(self):
         return f"Q: {self.ask_content[:50]}... | {self.ask_at.strftime('%Y-%m-%d %H:%M')}"
 
+    def get_context(self):
+        """Context đã dùng để trả lời: lấy trực tiếp (dữ liệu cũ) hoặc ghép lại từ chunk_refs."""
+        if self.context:
+            return self.context
+        if not self.chunk_refs:
+            return ""
+        return " ".join(load_chunk_texts(self.chunk_refs))
+
     class Meta:
-        ordering = ['-ask_at']
+        ordering = ['-ask_at', '-id']
+        indexes = [
+            # Lịch sử theo user (keyset pagination trên (ask_at, id))
+            models.Index(fields=['uploaded_by', '-ask_at', '-id'], name='answer_user_askat_idx'),
+            models.Index(fields=['-ask_at'], name='answer_askat_idx'),
+        ]
         verbose_name = "Câu hỏi & Trả lời"
         verbose_name_plural = "Câu hỏi & Trả lời"
 
@@ -45,13 +143,15 @@ class Answer(models.Model):
 class ProcessedDocument(models.Model):
     """
     Model lưu trữ thông tin đã xử lý của Document:
-    - Văn bản trích xuất từ PDF
+    - Văn bản trích xuất từ PDF (nén)
     - Embeddings (pickle serialized numpy array) cho FAISS search
     """
     file_name = models.CharField(max_length=255, help_text="Tên file gốc")
     document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, help_text="Liên kết tài liệu gốc")
-    text_content = models.TextField(help_text="Nội dung văn bản đã trích xuất")
+    text_content = CompressedTextField(help_text="Nội dung văn bản đã trích xuất (lưu nén zlib)")
+    text_hash = models.CharField(max_length=40, blank=True, help_text="SHA-1 của text_content (version của chunks)")
     embeddings = models.BinaryField(null=True, blank=True, help_text="Embeddings (pickle numpy array)")
+    embedding_model = models.CharField(max_length=100, blank=True, db_index=True, help_text="Model đã tạo embeddings")
     uploaded_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian xử lý")
 
     def __str__(self):
@@ -62,3 +162,96 @@ class ProcessedDocument(models.Model):
         verbose_name = "Tài liệu đã xử lý"
         verbose_name_plural = "Tài liệu đã xử lý"
 
+
+class ExtractedText(models.Model):
+    """
+    Cache văn bản trích xuất (từng trang) của file PDF, theo SHA-256 nội dung file và version bộ trích xuất.
+    Xử lý lại tài liệu (đổi chunk_size, đổi model embedding, upload lại cùng file) đọc cache thay vì parse PDF.
+    """
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 nội dung file PDF")
+    extractor = models.CharField(max_length=50, help_text="Version bộ trích xuất")
+    page_count = models.PositiveIntegerField(default=0, help_text="Số trang")
+    text_length = models.PositiveIntegerField(default=0, help_text="Tổng số ký tự")
+    data = models.BinaryField(help_text="Văn bản từng trang (JSON nén zlib)")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian trích xuất")
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.extractor}, {self.page_count} trang)"
+
+    @property
+    def pages(self):
+        return json.loads(zlib.decompress(bytes(self.data)).decode('utf-8'))
+
+    @classmethod
+    def store(cls, content_hash, extractor, pages):
+        """Lưu (hoặc ghi đè) cache cho file `content_hash`."""
+        data = zlib.compress(json.dumps(pages, ensure_ascii=False).encode('utf-8'), 6)
+        obj, _ = cls.objects.update_or_create(
+            content_hash=content_hash,
+            extractor=extractor,
+            defaults={'page_count': len(pages), 'text_length': sum(len(page) for page in pages), 'data': data},
+        )
+        return obj
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'extractor'], name='extractedtext_hash_extractor_uniq'),
+        ]
+        verbose_name = "Cache văn bản trích xuất"
+        verbose_name_plural = "Cache văn bản trích xuất"
+
+
+class CachedAnswer(models.Model):
+    """
+    Cache câu trả lời và embedding của câu hỏi (không kèm lịch sử hội thoại), theo câu hỏi đã chuẩn hóa.
+    Được điền trước bởi job trả lời trước (home.warming) cho các câu hỏi dự đoán từ từng tài liệu.
+    Câu trả lời hết hiệu lực khi một tài liệu trong chunk_refs bị xóa / xử lý lại (version khác)
+    hoặc quá RAG_ANSWER_CACHE_TTL; embedding chỉ phụ thuộc model.
+    """
+    question = models.TextField(help_text="Câu hỏi")
+    question_key = models.CharField(max_length=64, unique=True, help_text="SHA-256 của câu hỏi đã chuẩn hóa")
+    embedding_model = models.CharField(max_length=100, blank=True, help_text="Model đã tạo embedding")
+    embedding = models.BinaryField(null=True, blank=True, help_text="Embedding câu hỏi (float32)")
+    answer_content = models.TextField(blank=True, help_text="Câu trả lời (để trống: chỉ cache embedding)")
+    chunk_refs = models.JSONField(blank=True, null=True, help_text="Chunks đã dùng làm context")
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='cached_answers', help_text="Tài liệu sinh ra câu hỏi (job trả lời trước)")
+    hit_count = models.PositiveIntegerField(default=0, help_text="Số lần được dùng")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian tạo câu trả lời")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.question[:80]
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Câu trả lời đã cache"
+        verbose_name_plural = "Câu trả lời đã cache"
+
+
+class RequestProfile(models.Model):
+    """
+    Model lưu kết quả profile một request (cProfile + SQL), tạo bởi ProfilingMiddleware.
+    """
+    path = models.CharField(max_length=255, help_text="Đường dẫn request")
+    view_name = models.CharField(max_length=100, blank=True, help_text="Tên URL của view")
+    method = models.CharField(max_length=10, help_text="HTTP method")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, help_text="User gửi request")
+    status_code = models.PositiveSmallIntegerField(null=True, help_text="HTTP status trả về")
+    trigger = models.CharField(max_length=20, help_text="Lý do profile: header, query hoặc sample")
+    duration_ms = models.FloatField(help_text="Tổng thời gian request (ms)")
+    sql_count = models.PositiveIntegerField(default=0, help_text="Số câu SQL")
+    sql_time_ms = models.FloatField(default=0, help_text="Tổng thời gian SQL (ms)")
+    sql_queries = models.JSONField(blank=True, null=True, help_text="Các câu SQL chậm nhất")
+    stats_text = models.TextField(blank=True, help_text="Kết quả pstats (sắp xếp theo cumulative)")
+    profile_data = models.BinaryField(null=True, blank=True, help_text="Dữ liệu cProfile (định dạng .prof)")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Thời gian profile")
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Profile request"
+        verbose_name_plural = "Profile request"
@@ -1,10 +1,18 @@
-import PyPDF2
 import faiss
 import google.generativeai as genai
 import os
+import re
+import time
+import threading
+import contextvars
 import googleapiclient.discovery
 import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from dotenv import load_dotenv, find_dotenv
+from home.extractors import extract_pages
+from home.metrics import STAGE_SECONDS, span
 
 # Load environment variables
 load_dotenv(find_dotenv())
@@ -26,17 +34,19 @@ except Exception as e:
     model = genai.GenerativeModel("gemini-pro")
 
 
+def extract_pages_from_pdf(pdf_file, backend=None):
+    """
+    Trích xuất văn bản từng trang của file PDF bằng backend `backend` (None: theo RAG_PDF_EXTRACTOR).
+    Raise exception nếu không đọc được file.
+    """
+    return extract_pages(pdf_file, backend)
+
+
 # Hàm trích xuất nội dung từ file PDF
 def extract_text_from_pdf(pdf_file):
     """Trích xuất văn bản từ file PDF."""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        extracted_text = ""
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text:
-                extracted_text += text
-        return extracted_text
+        return "".join(extract_pages_from_pdf(pdf_file))
     except Exception as e:
         logger.error(f"Lỗi trích xuất PDF: {e}")
         return ""
@@ -146,42 +156,36 @@ def search_web(query):
         return []
 
 
-# Hàm trả lời câu hỏi dựa trên lịch sử hội thoại và context
-def asking(question, context=None, history=None):
+# Hàm tạo prompt cho Gemini từ câu hỏi, context, lịch sử và kết quả tìm kiếm web
+def build_prompt(question, context=None, history=None, search_results=None):
     """
-    Tạo câu trả lời bằng Gemini dựa trên context, lịch sử và kết quả tìm kiếm web.
+    Ghép prompt gửi Gemini.
     
     Args:
         question: Câu hỏi của user
         context: Văn bản context liên quan từ documents
         history: Lịch sử hội thoại trước đó
+        search_results: Kết quả từ search_web
         
     Returns:
-        Câu trả lời từ mô hình AI
+        Chuỗi prompt
     """
-    if not GEMINI_API_KEY:
-        logger.error("Gemini API key not configured. Cannot generate response.")
-        return "Lỗi: Chưa cấu hình API key Gemini. Vui lòng kiểm tra file .env."
-    
-    try:
-        history_text = ""
-        if history:
-            for q, a in history:
-                history_text += f"Q: {q}\nA: {a}\n"
-        
-        # Thử tìm kiếm web (nếu API key hợp lệ)
-        search_results = search_web(question)
-        search_result_text = ""
-        if search_results:
-            search_result_text = "\n".join([
-                f"- {item.get('title', '')}: {item.get('snippet', '')}" 
-                for item in search_results[:3]  # Top 3 results
-            ])
-        
-        # Nếu không có context (không có document), chủ yếu dùng search + general knowledge
-        if not context or context.strip() == "":
-            logger.warning("No document context available. Using web search + general knowledge.")
-            prompt = f"""
+    history_text = ""
+    if history:
+        for q, a in history:
+            history_text += f"Q: {q}\nA: {a}\n"
+
+    search_result_text = ""
+    if search_results:
+        search_result_text = "\n".join([
+            f"- {item.get('title', '')}: {item.get('snippet', '')}" 
+            for item in search_results[:3]  # Top 3 results
+        ])
+
+    # Nếu không có context (không có document), chủ yếu dùng search + general knowledge
+    if not context or context.strip() == "":
+        logger.warning("No document context available. Using web search + general knowledge.")
+        prompt = f"""
 You are a helpful Vietnamese assistant answering questions based on general knowledge and web search results.
 
 Conversation History:
@@ -193,9 +197,9 @@ Web Search Results:
 User Question: {question}
 
 Please provide a helpful answer in Vietnamese. If you don't have enough information, be honest about it."""
-        else:
-            # Có context từ document - ưu tiên context
-            prompt = f"""
+    else:
+        # Có context từ document - ưu tiên context
+        prompt = f"""
 You are a helpful Vietnamese assistant. Answer questions based on the provided context first.
 The context contains trusted information from uploaded documents and is your primary source.
 If context doesn't have enough info, supplement with web search results or general knowledge.
@@ -214,12 +218,291 @@ Web Search Results (supplementary):
 User Question: {question}
 
 Answer in Vietnamese:"""
+    return prompt
+
 
-        # Gửi câu hỏi đến mô hình
-        ai_response = model.generate_content(prompt).text
-        logger.info(f"Generated response for question: {question[:50]}...")
-        return ai_response
+def generate_answer(question, context=None, history=None, on_first_token=None):
+    """
+    Gọi Gemini (stream) để tạo câu trả lời. Raise exception nếu lỗi.
+
+    Args:
+        question: Câu hỏi của user
+        context: Văn bản context liên quan từ documents
+        history: Lịch sử hội thoại trước đó
+        on_first_token: Hàm gọi khi nhận được phần văn bản đầu tiên (None: bỏ qua)
+
+    Returns:
+        Câu trả lời từ mô hình AI
+    """
+    # Thử tìm kiếm web (nếu API key hợp lệ)
+    with span('web_search'):
+        search_results = search_web(question)
+
+    with span('prompt_build'):
+        prompt = build_prompt(question, context, history, search_results)
+
+    # Gửi câu hỏi đến mô hình, nhận câu trả lời theo từng phần
+    parts = []
+    started = time.perf_counter()
+    with span('llm'):
+        # google-generativeai 0.3.0 không nhận request_options (timeout): hạn chờ do AnswerJob.wait giới hạn
+        response = model.generate_content(prompt, stream=True)
+        for chunk in response:
+            if chunk.text and not parts:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage='llm_first_token')
+                if on_first_token:
+                    on_first_token()
+            parts.append(chunk.text)
+    logger.info(f"Generated response for question: {question[:50]}...")
+    return "".join(parts)
+
+
+# Hàm trả lời câu hỏi dựa trên lịch sử hội thoại và context
+def asking(question, context=None, history=None):
+    """
+    Tạo câu trả lời bằng Gemini dựa trên context, lịch sử và kết quả tìm kiếm web.
+    
+    Args:
+        question: Câu hỏi của user
+        context: Văn bản context liên quan từ documents
+        history: Lịch sử hội thoại trước đó
         
+    Returns:
+        Câu trả lời từ mô hình AI
+    """
+    if not GEMINI_API_KEY:
+        logger.error("Gemini API key not configured. Cannot generate response.")
+        return "Lỗi: Chưa cấu hình API key Gemini. Vui lòng kiểm tra file .env."
+    
+    try:
+        return generate_answer(question, context, history)
     except Exception as e:
         logger.error(f"Lỗi khi gọi Gemini API: {e}")
         return f"Lỗi: Không thể tạo câu trả lời. {str(e)}"
+
+
+_llm_pool = None
+_llm_pool_lock = threading.Lock()
+
+
+def _pool():
+    global _llm_pool
+    with _llm_pool_lock:
+        if _llm_pool is None:
+            _llm_pool = ThreadPoolExecutor(max_workers=settings.RAG_LLM_WORKERS, thread_name_prefix='llm')
+    return _llm_pool
+
+
+class AnswerJob:
+    """
+    Câu trả lời đang được Gemini tạo trong thread nền.
+    Request chỉ chờ tới hạn (wait); nếu quá hạn, câu trả lời vẫn tiếp tục được tạo và giao cho callback (then).
+    """
+
+    def __init__(self, question, context=None, history=None):
+        self.question = question
+        self.context = context
+        self.history = list(history or [])
+        self.text = None
+        self.error = None
+        self.first_token = threading.Event()
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._future = None
+
+    def start(self):
+        if not GEMINI_API_KEY:
+            logger.error("Gemini API key not configured. Cannot generate response.")
+            self._finish(error=RuntimeError("Chưa cấu hình API key Gemini"))
+            return self
+        # Chạy trong context của request để các stage (web_search, llm) vẫn được ghi vào timings
+        self._future = _pool().submit(contextvars.copy_context().run, self._run)
+        return self
+
+    def _run(self):
+        try:
+            text = generate_answer(self.question, self.context, self.history, on_first_token=self.first_token.set)
+        except Exception as e:
+            logger.error(f"Lỗi khi gọi Gemini API: {e}")
+            self._finish(error=e)
+        else:
+            self._finish(text=text)
+
+    def _finish(self, text=None, error=None):
+        with self._lock:
+            self.text, self.error = text, error
+            callbacks, self._callbacks = self._callbacks, None
+            self.first_token.set()
+            self.finished.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Lỗi xử lý câu trả lời trễ: {e}")
+
+    @property
+    def ok(self):
+        return self.finished.is_set() and self.error is None and bool(self.text)
+
+    def wait(self, first_token_deadline, timeout):
+        """
+        Chờ tới khi có câu trả lời đầy đủ, tối đa `first_token_deadline` giây cho phần văn bản đầu tiên
+        và `timeout` giây tổng cộng (tính từ lúc gọi).
+
+        Returns:
+            True nếu đã xong (thành công hoặc lỗi), False nếu quá hạn
+        """
+        started = time.monotonic()
+        if not self.first_token.wait(first_token_deadline):
+            return False
+        return self.finished.wait(max(timeout - (time.monotonic() - started), 0))
+
+    def then(self, callback):
+        """Gọi callback(job) khi job xong (ngay lập tức nếu đã xong)."""
+        with self._lock:
+            if self._callbacks is not None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """Hủy job nếu chưa bắt đầu chạy (không còn ai nhận câu trả lời)."""
+        if self._future is not None and self._future.cancel():
+            self._finish(error=RuntimeError("Đã hủy"))
+
+
+def start_answer(question, context=None, history=None):
+    """Bắt đầu tạo câu trả lời trong thread nền. Trả về AnswerJob."""
+    return AnswerJob(question, context, history).start()
+
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\n+')
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(text):
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 1}
+
+
+def split_sentences(text):
+    """Tách đoạn văn bản thành các câu (theo dấu kết thúc câu và xuống dòng)."""
+    return [sentence.strip() for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+
+def join_sentences(sentences, indices):
+    """Ghép các câu ở vị trí `indices` theo thứ tự gốc; chỗ bị lược bỏ giữa hai câu được đánh dấu "…"."""
+    parts = []
+    previous = None
+    for i in sorted(indices):
+        if not 0 <= i < len(sentences):
+            continue
+        if previous is not None and i > previous + 1:
+            parts.append("…")
+        parts.append(sentences[i])
+        previous = i
+    return " ".join(parts)
+
+
+def compress_hits(question, hits, embedding_model, budget=None, neighbours=None):
+    """
+    Nén context trước khi gửi LLM: tách các chunks thành câu, encode câu hỏi cùng mọi câu trong một batch,
+    giữ các câu gần câu hỏi nhất (cosine) kèm `neighbours` câu liền kề cho tới khi đủ `budget` ký tự.
+
+    Args:
+        question: Câu hỏi của user
+        hits: Kết quả retrieve_chunks (theo thứ tự liên quan giảm dần)
+        embedding_model: Mô hình embedding (model đã encode câu hỏi khi tìm kiếm)
+        budget: Số ký tự context tối đa (mặc định settings.RAG_CONTEXT_BUDGET; 0: không nén)
+        neighbours: Số câu liền kề giữ cùng mỗi câu được chọn (mặc định settings.RAG_CONTEXT_NEIGHBOURS)
+
+    Returns:
+        Danh sách hit cùng thứ tự, "text" chỉ còn các câu được giữ và "sentences" là vị trí các câu đó;
+        hit không còn câu nào bị bỏ. Trả nguyên `hits` nếu context đã không vượt budget.
+    """
+    budget = settings.RAG_CONTEXT_BUDGET if budget is None else budget
+    neighbours = settings.RAG_CONTEXT_NEIGHBOURS if neighbours is None else neighbours
+    if not budget or sum(len(hit["text"]) for hit in hits) <= budget:
+        return hits
+
+    passages = [split_sentences(hit["text"]) for hit in hits]
+    positions = [(rank, i) for rank, sentences in enumerate(passages) for i in range(len(sentences))]
+    if not positions:
+        return hits
+    vectors = np.asarray(embedding_model.encode([question] + [passages[rank][i] for rank, i in positions]),
+                         dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    scores = vectors[1:] @ vectors[0]
+
+    selected = [set() for _ in passages]
+    used = 0
+    # Câu điểm cao trước; cùng điểm thì chunk xếp hạng cao hơn trước
+    for position in np.argsort(-scores, kind='stable'):
+        rank, i = positions[position]
+        sentences = passages[rank]
+        window = [j for j in range(i - neighbours, i + neighbours + 1)
+                  if 0 <= j < len(sentences) and j not in selected[rank]]
+        if used + sum(len(sentences[j]) + 1 for j in window) > budget:
+            # Không đủ chỗ cho cả câu liền kề: chỉ lấy câu được chọn (nếu vừa)
+            window = [i] if i not in selected[rank] and used + len(sentences[i]) + 1 <= budget else []
+        if not window and not used:
+            window = [i]  # Luôn giữ ít nhất câu liên quan nhất
+        selected[rank].update(window)
+        used += sum(len(sentences[j]) + 1 for j in window)
+
+    compressed = []
+    for hit, sentences, indices in zip(hits, passages, selected):
+        if indices:
+            compressed.append(dict(hit, text=join_sentences(sentences, indices), sentences=sorted(indices)))
+    return compressed
+
+
+def extractive_answer(question, hits, max_sentences=3, unavailable=False):
+    """
+    Câu trả lời dự phòng tạo cục bộ từ các chunks đã tìm được (không gọi LLM):
+    chọn các câu có nhiều từ chung với câu hỏi nhất, trích đoạn chứa chúng và in đậm các câu đó.
+
+    Args:
+        question: Câu hỏi của user
+        hits: Kết quả retrieve_chunks (theo thứ tự liên quan giảm dần)
+        max_sentences: Số câu được chọn tối đa
+        unavailable: True nếu mô hình AI lỗi (không có câu trả lời đầy đủ sau đó)
+
+    Returns:
+        Câu trả lời dạng markdown
+    """
+    if unavailable:
+        notice = "_Mô hình AI hiện không khả dụng. Dưới đây là các đoạn liên quan nhất trích từ tài liệu._"
+    else:
+        notice = ("_Mô hình AI đang phản hồi chậm. Dưới đây là các đoạn liên quan nhất trích từ tài liệu; "
+                  "câu trả lời đầy đủ sẽ được cập nhật khi có._")
+
+    query = _words(question)
+    passages = [split_sentences(hit["text"]) for hit in hits]
+    scored = []
+    for rank, sentences in enumerate(passages):
+        for i, sentence in enumerate(sentences):
+            words = _words(sentence)
+            if not words:
+                continue
+            overlap = len(query & words)
+            # Ưu tiên câu chứa nhiều từ của câu hỏi, câu ngắn và chunk xếp hạng cao hơn
+            scored.append((overlap / (len(words) ** 0.5) + 0.01 / (rank + 1), overlap, rank, i))
+
+    picked = sorted((s for s in scored if s[1] > 0), reverse=True)[:max_sentences]
+    if not picked:
+        # Không câu nào trùng từ với câu hỏi: dùng câu đầu của các chunks xếp hạng cao nhất
+        picked = [(0, 0, rank, 0) for rank, sentences in enumerate(passages) if sentences][:max_sentences]
+    if not picked:
+        return notice + "\n\nKhông tìm thấy đoạn tài liệu nào liên quan đến câu hỏi. Vui lòng thử lại sau."
+
+    selected = {}
+    for _, _, rank, i in picked:
+        selected.setdefault(rank, set()).add(i)
+    quotes = []
+    for rank in sorted(selected):
+        sentences = passages[rank]
+        first, last = max(min(selected[rank]) - 1, 0), min(max(selected[rank]) + 1, len(sentences) - 1)
+        quotes.append("> " + " ".join(
+            f"**{sentences[i]}**" if i in selected[rank] else sentences[i] for i in range(first, last + 1)))
+    return notice + "\n\n" + "\n\n".join(quotes)
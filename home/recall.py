@@ -0,0 +1,131 @@
+"""
+Theo dõi chất lượng tìm kiếm trên request thật: với tỉ lệ RAG_RECALL_SAMPLE_RATE câu hỏi, chạy thêm tìm kiếm
+chính xác (brute-force) trong thread nền và so với kết quả của đường tìm kiếm nhanh (hai mức, index xấp xỉ...).
+
+Kết quả ghi vào /metrics: recall@k và độ trùng thứ hạng của từng mẫu, trung bình trượt trên RAG_RECALL_WINDOW
+mẫu gần nhất và cờ cảnh báo khi recall trung bình thấp hơn RAG_RECALL_ALERT_THRESHOLD.
+Request không chờ tìm kiếm chính xác; khi thread nền đang bận, mẫu mới bị bỏ qua.
+"""
+import logging
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from home import metrics
+
+logger = logging.getLogger(__name__)
+
+# Số mẫu tối đa đang chờ/chạy trong thread nền (vượt quá thì bỏ mẫu)
+MAX_PENDING = 2
+# Số mẫu tối thiểu trong cửa sổ trước khi xét cảnh báo
+MIN_ALERT_SAMPLES = 20
+
+
+def _ids(hits):
+    return [(hit["doc"], hit["chunk"]) for hit in hits]
+
+
+def recall_at_k(found, truth):
+    """Tỉ lệ kết quả đúng (tìm kiếm chính xác) có trong kết quả tìm được."""
+    if not truth:
+        return 1.0
+    return len(set(found) & set(truth)) / len(truth)
+
+
+def rank_overlap(found, truth):
+    """
+    Độ trùng thứ hạng (average overlap): trung bình theo độ sâu d của tỉ lệ trùng giữa top-d hai danh sách.
+    Bằng 1 khi cùng kết quả, cùng thứ tự; giảm khi kết quả đúng bị đẩy xuống dưới.
+    """
+    depth = max(len(found), len(truth))
+    if not depth:
+        return 1.0
+    return sum(len(set(found[:d]) & set(truth[:d])) / d for d in range(1, depth + 1)) / depth
+
+
+class RecallMonitor:
+    """Lấy mẫu câu hỏi, chạy tìm kiếm chính xác trong nền và ghi recall@k vào metrics."""
+
+    def __init__(self, sample_rate=None, window=None, threshold=None):
+        self._sample_rate = sample_rate
+        self._threshold = threshold
+        self._window = deque(maxlen=window or settings.RAG_RECALL_WINDOW)
+        self._pending = 0
+        self._alerting = False
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate if self._sample_rate is not None else settings.RAG_RECALL_SAMPLE_RATE
+
+    @property
+    def threshold(self):
+        return self._threshold if self._threshold is not None else settings.RAG_RECALL_ALERT_THRESHOLD
+
+    def maybe_sample(self, store, query_vectors, k, doc_ids, results):
+        """
+        Gọi sau tìm kiếm nhanh: với xác suất sample_rate, đưa câu hỏi (vectors + kết quả) vào thread nền.
+        Không bao giờ chặn hay raise trong request.
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if self._pending >= MAX_PENDING:
+                metrics.RECALL_SAMPLES.inc(result='dropped')
+                return
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recall')
+        try:
+            found = [_ids(hits) for hits in results]
+            self._executor.submit(self._run, store, query_vectors, k, doc_ids, found)
+        except Exception as e:
+            # Ví dụ: executor đã shutdown khi process đang thoát
+            with self._lock:
+                self._pending -= 1
+            metrics.RECALL_SAMPLES.inc(result='error')
+            logger.warning(f"Không lấy mẫu đo recall được: {e}")
+
+    def _run(self, store, query_vectors, k, doc_ids, found):
+        try:
+            with metrics.span('shadow_exact_search'):
+                truth = store.exact_search(query_vectors, k=k, doc_ids=doc_ids)
+            for fast, exact in zip(found, truth):
+                self.record(fast, _ids(exact))
+        except Exception as e:
+            metrics.RECALL_SAMPLES.inc(result='error')
+            logger.error(f"Lỗi tìm kiếm chính xác để đo recall: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def record(self, found, truth):
+        """Ghi một mẫu: danh sách (doc, chunk) của tìm kiếm nhanh và của tìm kiếm chính xác."""
+        recall = recall_at_k(found, truth)
+        overlap = rank_overlap(found, truth)
+        metrics.RECALL_SAMPLES.inc(result='ok')
+        metrics.RECALL_AT_K.observe(recall)
+        metrics.RANK_OVERLAP.observe(overlap)
+        with self._lock:
+            self._window.append((recall, overlap))
+            mean_recall = sum(r for r, _ in self._window) / len(self._window)
+            mean_overlap = sum(o for _, o in self._window) / len(self._window)
+            enough = len(self._window) >= min(MIN_ALERT_SAMPLES, self._window.maxlen)
+            alerting = enough and mean_recall < self.threshold
+            changed, self._alerting = alerting != self._alerting, alerting
+        metrics.RECALL_WINDOW.set(mean_recall)
+        metrics.RANK_OVERLAP_WINDOW.set(mean_overlap)
+        metrics.RECALL_ALERT.set(1 if alerting else 0)
+        if changed and alerting:
+            logger.error(f"Recall tìm kiếm giảm: trung bình {mean_recall:.3f} trên {len(self._window)} mẫu gần nhất "
+                         f"(ngưỡng {self.threshold})")
+        elif changed:
+            logger.info(f"Recall tìm kiếm đã hồi phục: {mean_recall:.3f}")
+
+
+# Monitor dùng chung trong process
+MONITOR = RecallMonitor()
@@ -0,0 +1,591 @@
+"""
+Vector store cho việc tìm chunks liên quan.
+
+Dữ liệu gồm hai phần:
+- Generation đã publish trên đĩa (home.index_store), mở bằng mmap nên các worker dùng chung
+  page cache thay vì mỗi worker giữ một bản vectors.
+- Shard trong bộ nhớ cho các tài liệu mới / xử lý lại sau lần build generation gần nhất.
+
+Mỗi ProcessedDocument là một shard. Tìm kiếm giới hạn trong một tập tài liệu chỉ chạy trên
+các shard được chọn; tìm kiếm toàn bộ dùng index của generation (loại trừ tài liệu đã xóa
+bằng IDSelector) cộng index gộp của các shard trong bộ nhớ. Store được đồng bộ với DB theo
+(id, text_hash, embedding_model) nên chỉ tài liệu mới / đã xử lý lại mới phải load lại embeddings.
+
+Với corpus lớn, tìm kiếm toàn bộ đi theo hai mức: mỗi tài liệu được chia thành các section
+(RAG_SECTION_SIZE chunks liên tiếp) có vector trung bình; câu hỏi chọn RAG_COARSE_TOP_M section gần nhất
+rồi chỉ tìm chính xác trong chunks của các section đó.
+
+Generation có thể lưu vectors đã giảm chiều (PCA / cắt chiều, RAG_INDEX_DIMS); khi đó vector câu hỏi và
+shard trong bộ nhớ được áp dụng cùng phép biến đổi của generation trước khi tìm.
+
+Model embedding của store là model của generation đang mở (manifest); shard trong bộ nhớ chỉ gồm
+tài liệu có embeddings của cùng model. Nhờ vậy có thể encode lại toàn bộ tài liệu bằng model mới
+(manage.py reembed) trong khi generation cũ vẫn phục vụ, rồi chuyển sang model mới khi publish.
+
+Khi corpus lớn hơn RAM một máy, tài liệu được chia thành `count` phần theo id ProcessedDocument
+(id % count == index). Mỗi phần có thư mục generation riêng (partition_index_dir) và được phục vụ bởi
+một process riêng (manage.py retrieval_shard); web chỉ gửi vector câu hỏi và gộp kết quả (home.shards).
+"""
+import heapq
+import logging
+import os
+import pickle
+import threading
+import time
+
+import faiss
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+
+from home import metrics
+from home.index_store import (
+    Generation, GenerationWriter, IndexManifestError, current_generation, publish, read_manifest, section_centroids,
+    train_transform,
+)
+from home.metrics import span
+from home.models import ProcessedDocument, CHUNK_VERSION_LENGTH
+from home.rag import split_text_into_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentShard:
+    """Vectors và chunks của một ProcessedDocument, giữ trong bộ nhớ."""
+
+    def __init__(self, doc_id, document_id, version, vectors, chunks, model=None):
+        if len(chunks) != len(vectors):
+            logger.warning(f"Doc {doc_id}: {len(vectors)} embeddings nhưng {len(chunks)} chunks. Cắt theo số nhỏ hơn.")
+            size = min(len(chunks), len(vectors))
+            vectors, chunks = vectors[:size], chunks[:size]
+        self.doc_id = doc_id
+        self.document_id = document_id
+        self.version = version
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.chunks = chunks
+        self.model = model
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def chunk(self, i):
+        return self.chunks[i]
+
+    def hit(self, chunk_index, distance):
+        return {
+            "doc": self.doc_id,
+            "chunk": int(chunk_index),
+            "score": float(distance),
+            "version": self.version,
+            "text": self.chunk(chunk_index),
+        }
+
+    @classmethod
+    def from_processed_document(cls, doc, transform=None):
+        """Load shard từ DB; `transform`: phép giảm chiều của generation đang phục vụ (nếu có)."""
+        embeddings = pickle.loads(doc.embeddings)
+        if not isinstance(embeddings, np.ndarray) or embeddings.ndim != 2:
+            raise ValueError(f"Embeddings của doc {doc.id} không phải numpy array 2 chiều")
+        if transform is not None:
+            if embeddings.shape[1] != transform.d_in:
+                raise ValueError(f"Embeddings của doc {doc.id} có {embeddings.shape[1]} chiều, cần {transform.d_in}")
+            if len(embeddings):
+                embeddings = transform.apply(np.ascontiguousarray(embeddings, dtype=np.float32))
+        chunks = split_text_into_chunks(doc.text_content, chunk_size=settings.RAG_CHUNK_SIZE)
+        return cls(doc.id, doc.document_id, doc.text_hash[:CHUNK_VERSION_LENGTH], embeddings, chunks,
+                   model=doc.embedding_model)
+
+
+class SnapshotShard(DocumentShard):
+    """Shard nằm trong một generation trên đĩa: vectors và chunks đọc qua mmap, không copy."""
+
+    def __init__(self, generation, entry):
+        self.generation = generation
+        self.offset = entry['offset']
+        self.doc_id = entry['doc']
+        self.document_id = entry['document']
+        self.version = entry['version']
+        self.vectors = generation.vectors[self.offset:self.offset + entry['count']]
+        self.model = generation.manifest.get('embedding_model')
+
+    def chunk(self, i):
+        return self.generation.chunk_text(self.offset + i)
+
+
+def parse_partition(value):
+    """'i/n' -> (i, n): phần thứ i (đếm từ 0) trong n phần của corpus."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Partition không hợp lệ: {value!r} (dạng i/n, ví dụ 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Partition không hợp lệ: {value!r} (cần 0 <= i < n)")
+    return index, count
+
+
+def in_partition(doc_id, partition):
+    return partition is None or doc_id % partition[1] == partition[0]
+
+
+def partition_index_dir(partition, index_dir=None):
+    """Thư mục generation của một phần corpus (cạnh RAG_INDEX_DIR, không lẫn với các generation của cả corpus)."""
+    index_dir = (index_dir or settings.RAG_INDEX_DIR).rstrip(os.sep)
+    if partition is None:
+        return index_dir
+    return f"{index_dir}-part-{partition[0]}-of-{partition[1]}"
+
+
+def partition_index_dirs(index_dir=None):
+    """Các thư mục generation theo phần corpus đang có trên đĩa (build_index --partition): [(partition, thư mục)]."""
+    index_dir = (index_dir or settings.RAG_INDEX_DIR).rstrip(os.sep)
+    parent, prefix = os.path.split(index_dir)
+    parent, prefix = parent or os.curdir, prefix + '-part-'
+    if not os.path.isdir(parent):
+        return []
+    found = []
+    for name in os.listdir(parent):
+        if not name.startswith(prefix):
+            continue
+        try:
+            partition = parse_partition(name[len(prefix):].replace('-of-', '/', 1))
+        except ValueError:
+            continue
+        path = os.path.join(parent, name)
+        if os.path.basename(partition_index_dir(partition, index_dir)) == name and os.path.isdir(path):
+            found.append((partition, path))
+    return sorted(found)
+
+
+def expected_manifest():
+    """
+    Các giá trị manifest của generation phải khớp với cấu hình hiện tại.
+    Model embedding không nằm ở đây: generation quyết định model dùng để encode câu hỏi.
+    """
+    return {
+        'chunk_size': settings.RAG_CHUNK_SIZE,
+    }
+
+
+def active_embedding_model(index_dir=None):
+    """
+    Model embedding đang phục vụ: model của generation được publish, hoặc RAG_EMBEDDING_MODEL nếu chưa có.
+    Tài liệu mới được encode bằng model này để tìm được cùng với generation hiện tại.
+    """
+    index_dir = index_dir or settings.RAG_INDEX_DIR
+    name = current_generation(index_dir)
+    if name is not None:
+        try:
+            return read_manifest(os.path.join(index_dir, name)).get('embedding_model') or settings.RAG_EMBEDDING_MODEL
+        except IndexManifestError as e:
+            logger.error(f"Không đọc được model embedding của generation {name}: {e}")
+    return settings.RAG_EMBEDDING_MODEL
+
+
+def _merge_hits(rows, k):
+    """Gộp nhiều danh sách hit (đã sắp xếp) thành top-k theo score tăng dần."""
+    return heapq.nsmallest(k, (hit for row in rows for hit in row), key=lambda hit: hit["score"])
+
+
+def _coarse_level(centroids, shards, owners, starts, counts, allowed=None):
+    """
+    Mức thô của một nhóm shard: centroids (số section x số chiều), shard sở hữu, vị trí bắt đầu và số chunks
+    của từng section trong shard. `allowed`: mask các section còn hợp lệ (None: tất cả).
+    """
+    return (
+        centroids,
+        shards,
+        np.asarray(owners, dtype=np.int64),
+        np.asarray(starts, dtype=np.int64),
+        np.asarray(counts, dtype=np.int64),
+        allowed,
+    )
+
+
+def _search_sections(query_vectors, k, levels, top_m):
+    """
+    Tìm hai mức: chọn top_m section có centroid gần câu hỏi nhất (gộp mọi mức thô),
+    rồi tìm chính xác top-k chunks chỉ trong các section đó.
+    """
+    candidates = [[] for _ in range(len(query_vectors))]
+    for level in levels:
+        centroids, _, _, _, _, allowed = level
+        if len(centroids) == 0:
+            continue
+        # Lấy dư số section bị loại (tài liệu đã xóa) để vẫn đủ top_m section hợp lệ
+        excluded = 0 if allowed is None else int(len(allowed) - allowed.sum())
+        distances, indices = faiss.knn(query_vectors, np.ascontiguousarray(centroids),
+                                       min(len(centroids), top_m + excluded))
+        for row, row_distances, row_indices in zip(candidates, distances, indices):
+            row.extend((float(d), int(i), level) for d, i in zip(row_distances, row_indices)
+                       if i >= 0 and (allowed is None or allowed[i]))
+
+    results = []
+    for query, row in zip(query_vectors, candidates):
+        chosen = heapq.nsmallest(top_m, row, key=lambda candidate: candidate[0])
+        if not chosen:
+            results.append([])
+            continue
+        parts, owners = [], []
+        for _, i, (_, shards, section_owners, starts, counts, _) in chosen:
+            shard, start, count = shards[section_owners[i]], int(starts[i]), int(counts[i])
+            parts.append(shard.vectors[start:start + count])
+            owners.append((shard, start))
+        vectors = np.ascontiguousarray(np.concatenate(parts), dtype=np.float32)
+        offsets = np.cumsum([0] + [len(part) for part in parts])
+        distances, indices = faiss.knn(query[None, :], vectors, min(k, len(vectors)))
+        hits = []
+        for distance, i in zip(distances[0], indices[0]):
+            if i < 0:
+                continue
+            position = int(np.searchsorted(offsets, i, side='right')) - 1
+            shard, start = owners[position]
+            hits.append(shard.hit(start + i - offsets[position], distance))
+        results.append(hits)
+    return results
+
+
+def _search_flat(index, shards, offsets, query_vectors, k, params=None):
+    """Tìm trên index gộp của nhiều shard liên tiếp, đổi id toàn cục về (shard, chunk)."""
+    if index.ntotal == 0:
+        return [[] for _ in range(len(query_vectors))]
+    distances, indices = index.search(query_vectors, min(k, index.ntotal), params=params)
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        hits = []
+        for distance, i in zip(row_distances, row_indices):
+            if i < 0:
+                continue
+            position = int(np.searchsorted(offsets, i, side='right')) - 1
+            hits.append(shards[position].hit(i - offsets[position], distance))
+        results.append(hits)
+    return results
+
+
+class VectorStore:
+    """Tập các shard (generation trên đĩa + shard trong bộ nhớ), đồng bộ với bảng ProcessedDocument."""
+
+    def __init__(self, index_dir=None, partition=None):
+        self.index_dir = index_dir
+        self.partition = partition  # (index, count): chỉ phục vụ một phần corpus (None: toàn bộ)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._shards = {}
+        self._ntotal = 0
+        self._known = {}  # {doc id: text_hash} tại lần sync gần nhất
+        # (generation, shards theo thứ tự trong generation, offsets, SearchParameters loại tài liệu không còn hợp lệ,
+        #  mức thô của generation)
+        self._base = None
+        self._delta = None  # (trạng thái shards, index gộp, shards trong bộ nhớ, offsets, mức thô)
+        self._pointer_checked_at = 0.0
+        self._refused = None  # generation bị từ chối do manifest không khớp
+
+    def __len__(self):
+        return self._ntotal
+
+    @property
+    def generation_name(self):
+        return self._generation.name if self._generation else None
+
+    @property
+    def embedding_model(self):
+        """Model embedding của index đang phục vụ (dùng để encode câu hỏi)."""
+        if self._generation is not None:
+            return self._generation.manifest.get('embedding_model') or settings.RAG_EMBEDDING_MODEL
+        return settings.RAG_EMBEDDING_MODEL
+
+    def _check_generation(self):
+        """Mở generation mới nếu CURRENT đã đổi (kiểm tra tối đa mỗi RAG_INDEX_RELOAD_INTERVAL giây)."""
+        index_dir = self.index_dir or partition_index_dir(self.partition)
+        now = time.monotonic()
+        if self._generation and now - self._pointer_checked_at < settings.RAG_INDEX_RELOAD_INTERVAL:
+            return False
+        self._pointer_checked_at = now
+        name = current_generation(index_dir)
+        if name is None or name == self.generation_name or name == self._refused:
+            return False
+        try:
+            expected = expected_manifest()
+            if self.partition is not None:
+                expected['partition'] = list(self.partition)
+            generation = Generation(os.path.join(index_dir, name), expected=expected)
+        except IndexManifestError as e:
+            # Giữ generation đang dùng (hoặc load từ DB) thay vì phục vụ index không tương thích
+            self._refused = name
+            logger.error(f"Từ chối index generation {name}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Không mở được index generation {name}: {e}")
+            return False
+        self._generation = generation
+        logger.info(f"Đã mở index generation {name} ({generation.ntotal} vectors, mmap)")
+        return True
+
+    def sync(self):
+        """
+        Đồng bộ với DB: mở generation mới nếu có, dùng shard của generation cho tài liệu không đổi,
+        load shard trong bộ nhớ cho tài liệu mới / xử lý lại, bỏ tài liệu đã xóa.
+        Trạng thái mới được dựng riêng rồi gán một lần, nên các câu truy vấn đang chạy
+        vẫn dùng trọn vẹn trạng thái cũ.
+        """
+        with span('db_load'):
+            current = {
+                doc_id: (text_hash, model)
+                for doc_id, text_hash, model in ProcessedDocument.objects.exclude(embeddings__isnull=True).values_list(
+                    'id', 'text_hash', 'embedding_model')
+                if in_partition(doc_id, self.partition)
+            }
+
+        with self._lock:
+            reloaded = self._check_generation()
+            model = self.embedding_model
+            transform = self._generation.transform if self._generation is not None else None
+
+            def valid(doc_id, version):
+                return doc_id in current and (current[doc_id][0] or "").startswith(version)
+
+            changed = reloaded or current != self._known
+            metrics.record_cache('vector_store', hit=not changed)
+            if not changed:
+                return
+
+            with span('index_build'):
+                shards = {}
+                base = None
+                if self._generation is not None:
+                    generation_shards = [SnapshotShard(self._generation, entry) for entry in self._generation.docs]
+                    excluded = [np.arange(shard.offset, shard.offset + len(shard), dtype=np.int64)
+                                for shard in generation_shards if not valid(shard.doc_id, shard.version)]
+                    params = None
+                    if excluded:
+                        batch = faiss.IDSelectorBatch(np.concatenate(excluded))
+                        selector = faiss.IDSelectorNot(batch)
+                        params = faiss.SearchParameters(sel=selector)
+                        params.referenced_objects = [batch, selector]  # giữ selector sống cùng params
+                    offsets = np.array([shard.offset for shard in generation_shards], dtype=np.int64)
+                    sections = self._generation.sections
+                    shard_valid = np.array([valid(shard.doc_id, shard.version) for shard in generation_shards],
+                                           dtype=bool)
+                    coarse = _coarse_level(
+                        self._generation.centroids, generation_shards, sections[:, 2],
+                        sections[:, 0] - offsets[sections[:, 2]] if len(sections) else [], sections[:, 1],
+                        allowed=shard_valid[sections[:, 2]] if excluded else None,
+                    )
+                    base = (self._generation, generation_shards, offsets, params, coarse)
+                    shards.update((shard.doc_id, shard) for shard in generation_shards
+                                  if valid(shard.doc_id, shard.version))
+
+                # Tài liệu chưa có trong generation: giữ shard trong bộ nhớ còn hợp lệ, load phần còn thiếu
+                # (chỉ tài liệu có embeddings của cùng model với generation). Khi đổi generation, shard trong
+                # bộ nhớ được load lại để áp dụng phép giảm chiều của generation mới.
+                for doc_id, shard in ({} if reloaded else self._shards).items():
+                    if (doc_id not in shards and not isinstance(shard, SnapshotShard) and valid(doc_id, shard.version)
+                            and shard.model == model == current[doc_id][1]):
+                        shards[doc_id] = shard
+                to_load = [doc_id for doc_id, (_, doc_model) in current.items()
+                           if doc_id not in shards and doc_model == model]
+                docs = ProcessedDocument.objects.filter(id__in=to_load).only(
+                    'id', 'document_id', 'text_content', 'text_hash', 'embeddings', 'embedding_model')
+                for doc in docs:
+                    try:
+                        shards[doc.id] = DocumentShard.from_processed_document(doc, transform)
+                    except (pickle.UnpicklingError, ValueError) as e:
+                        logger.error(f"Không load được embeddings của doc {doc.id}: {e}")
+
+                self._delta = None
+                self._base = base
+                self._shards = shards
+                self._ntotal = sum(len(shard) for shard in shards.values())
+                self._known = current
+            logger.info(
+                f"Vector store: {len(shards)} tài liệu, generation={self.generation_name}, model={model}, "
+                f"load {len(to_load)} tài liệu từ DB"
+            )
+        metrics.INDEX_VECTORS.set(len(self))
+
+    def shard_ids_for_documents(self, document_ids):
+        """Đổi danh sách Document id sang id các shard (ProcessedDocument) tương ứng."""
+        document_ids = set(document_ids)
+        return [doc_id for doc_id, shard in self._shards.items() if shard.document_id in document_ids]
+
+    def _delta_index(self, shards):
+        """
+        Index gộp và mức thô (section) của các shard trong bộ nhớ của trạng thái `shards`
+        (xây lại khi trạng thái đổi). Trả về (index, shards, offsets, mức thô).
+        """
+        delta = self._delta
+        if delta is None or delta[0] is not shards:
+            memory_shards = [shard for shard in shards.values() if not isinstance(shard, SnapshotShard)]
+            dimension = next(iter(shards.values())).vectors.shape[1]
+            index = faiss.IndexFlatL2(dimension)
+            offsets = []
+            section_size = settings.RAG_SECTION_SIZE
+            centroids = [np.zeros((0, dimension), dtype=np.float32)]
+            owners, starts, counts = [], [], []
+            for position, shard in enumerate(memory_shards):
+                offsets.append(index.ntotal)
+                index.add(shard.vectors)
+                centroids.append(section_centroids(shard.vectors, section_size))
+                for start in range(0, len(shard), section_size):
+                    owners.append(position)
+                    starts.append(start)
+                    counts.append(min(section_size, len(shard) - start))
+            coarse = _coarse_level(np.concatenate(centroids), memory_shards, owners, starts, counts)
+            delta = (shards, index, memory_shards, np.array(offsets, dtype=np.int64), coarse)
+            self._delta = delta
+        return delta[1:]
+
+    def search(self, query_vectors, k=5, doc_ids=None):
+        """
+        Tìm top-k chunks gần nhất cho mỗi vector câu hỏi.
+
+        Args:
+            query_vectors: numpy array (số câu hỏi x số chiều)
+            k: Số chunks cần lấy cho mỗi câu hỏi
+            doc_ids: Danh sách id ProcessedDocument để giới hạn tìm kiếm (None: toàn bộ)
+
+        Returns:
+            Danh sách (mỗi câu hỏi một list) các hit {"doc", "chunk", "score", "version", "text"}
+        """
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        shards, base = self._shards, self._base
+        if not shards:
+            return [[] for _ in range(len(query_vectors))]
+        if base is not None and base[0].transform is not None:
+            query_vectors = np.ascontiguousarray(base[0].transform.apply(query_vectors))
+
+        if doc_ids is None:
+            delta_index, memory_shards, delta_offsets, delta_coarse = self._delta_index(shards)
+            top_m = settings.RAG_COARSE_TOP_M
+            if top_m > 0 and self._ntotal >= settings.RAG_COARSE_MIN_VECTORS:
+                levels = [delta_coarse] + ([base[4]] if base is not None else [])
+                with span('coarse_search'):
+                    return _search_sections(query_vectors, k, levels, top_m)
+
+            rows = [_search_flat(delta_index, memory_shards, delta_offsets, query_vectors, k)]
+            if base is not None and base[0].ntotal:
+                generation, generation_shards, offsets, params, _ = base
+                rows.append(_search_flat(generation.index, generation_shards, offsets, query_vectors, k,
+                                         params=params))
+            return [_merge_hits(per_query, k) for per_query in zip(*rows)]
+
+        # Chỉ tìm trên vectors của các shard được chọn (slice mmap hoặc mảng trong bộ nhớ) rồi gộp top-k
+        return _search_exact(query_vectors, k, [shards[doc_id] for doc_id in doc_ids if doc_id in shards])
+
+    def exact_search(self, query_vectors, k=5, doc_ids=None):
+        """
+        Như search nhưng luôn tìm chính xác (brute-force trên vectors từng shard, không qua mức thô hay index).
+        Chậm hơn nhiều: dùng làm chuẩn để đo recall của tìm kiếm nhanh (home.recall).
+        """
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        shards, base = self._shards, self._base
+        if base is not None and base[0].transform is not None:
+            query_vectors = np.ascontiguousarray(base[0].transform.apply(query_vectors))
+        selected = shards.values() if doc_ids is None else [shards[doc_id] for doc_id in doc_ids if doc_id in shards]
+        return _search_exact(query_vectors, k, list(selected))
+
+
+def _search_exact(query_vectors, k, shards):
+    """Tìm chính xác top-k trên vectors của từng shard (slice mmap hoặc mảng trong bộ nhớ) rồi gộp."""
+    rows = []
+    for shard in shards:
+        if len(shard) == 0:
+            continue
+        distances, indices = faiss.knn(query_vectors, np.ascontiguousarray(shard.vectors), min(k, len(shard)))
+        rows.append([
+            [shard.hit(i, d) for d, i in zip(row_distances, row_indices) if i >= 0]
+            for row_distances, row_indices in zip(distances, indices)
+        ])
+    if not rows:
+        return [[] for _ in range(len(query_vectors))]
+    return [_merge_hits(per_query, k) for per_query in zip(*rows)]
+
+
+def _training_sample(docs, size, seed=0):
+    """Lấy ngẫu nhiên đều `size` vectors trong embeddings của `docs` (giữ `size` khóa ngẫu nhiên nhỏ nhất)."""
+    rng = np.random.default_rng(seed)
+    keys, parts, count = [], [], 0
+    for doc in docs.iterator(chunk_size=50):
+        try:
+            vectors = np.asarray(pickle.loads(doc.embeddings), dtype=np.float32)
+        except pickle.UnpicklingError:
+            continue
+        if vectors.ndim != 2 or not len(vectors):
+            continue
+        keys.append(rng.random(len(vectors)))
+        parts.append(vectors)
+        count += len(vectors)
+        if count > 2 * size:
+            merged_keys, merged = np.concatenate(keys), np.concatenate(parts)
+            keep = np.argpartition(merged_keys, size)[:size]
+            keys, parts, count = [merged_keys[keep]], [merged[keep]], size
+    if not parts:
+        return None
+    merged_keys, merged = np.concatenate(keys), np.concatenate(parts)
+    if len(merged) > size:
+        merged = merged[np.argpartition(merged_keys, size)[:size]]
+    return merged
+
+
+def build_generation(index_dir=None, publish_now=True, model=None, dims=None, reduction=None, partition=None):
+    """
+    Ghi toàn bộ ProcessedDocument có embeddings của `model` thành một generation index mới trên đĩa.
+    
+    Args:
+        index_dir: Thư mục index (mặc định settings.RAG_INDEX_DIR, hoặc thư mục của `partition`)
+        publish_now: Đổi CURRENT sang generation mới ngay sau khi ghi xong
+        model: Model embedding (mặc định model đang phục vụ), ghi vào manifest
+        dims: Số chiều sau khi giảm (mặc định settings.RAG_INDEX_DIMS; 0: giữ nguyên)
+        reduction: 'pca' hoặc 'truncate' (mặc định settings.RAG_INDEX_REDUCTION)
+        partition: (index, count) để chỉ ghi một phần corpus (None: toàn bộ)
+        
+    Returns:
+        (tên generation, số tài liệu, số vectors) hoặc None nếu không có tài liệu nào
+    """
+    index_dir = index_dir or partition_index_dir(partition)
+    model = model or active_embedding_model(index_dir)
+    dims = settings.RAG_INDEX_DIMS if dims is None else dims
+    reduction = reduction or settings.RAG_INDEX_REDUCTION
+    manifest = dict(expected_manifest(), embedding_model=model, reduction=reduction if dims else None)
+    writer = None
+    transform = None
+    try:
+        docs = ProcessedDocument.objects.exclude(embeddings__isnull=True).filter(embedding_model=model).only(
+            'id', 'document_id', 'text_content', 'text_hash', 'embeddings', 'embedding_model').order_by('id')
+        if dims:
+            # PCA train trên mẫu của toàn bộ corpus (cả khi chỉ build một phần) để mọi phần dùng cùng một phép
+            # giảm chiều và khoảng cách trả về từ các process shard so sánh được với nhau
+            sample = _training_sample(docs.only('id', 'embeddings'), settings.RAG_PCA_TRAIN_SIZE)
+            if sample is not None and dims < sample.shape[1]:
+                with span('train_transform'):
+                    transform = train_transform(reduction, sample.shape[1], dims, sample)
+                logger.info(f"Giảm chiều {reduction}: {sample.shape[1]} -> {dims} (train trên {len(sample)} vectors)")
+            else:
+                manifest['reduction'] = None
+        if partition is not None:
+            docs = docs.annotate(part=F('id') % partition[1]).filter(part=partition[0])
+            manifest['partition'] = list(partition)
+        for doc in docs.iterator(chunk_size=50):
+            try:
+                shard = DocumentShard.from_processed_document(doc)
+            except (pickle.UnpicklingError, ValueError) as e:
+                logger.error(f"Bỏ qua doc {doc.id} khi build index: {e}")
+                continue
+            if writer is None:
+                writer = GenerationWriter(index_dir, shard.vectors.shape[1], settings=manifest,
+                                          section_size=settings.RAG_SECTION_SIZE, transform=transform)
+            writer.add_document(shard.doc_id, shard.document_id, shard.version, shard.vectors, shard.chunks)
+        if writer is None:
+            return None
+        n_docs, n_vectors = len(writer.docs), writer.index.ntotal
+        name = writer.finish()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    if publish_now:
+        publish(index_dir, name, expected=expected_manifest())
+    return name, n_docs, n_vectors
+
+
+# Store dùng chung trong process (mỗi worker một bản; vectors của generation dùng chung qua mmap)
+STORE = VectorStore()
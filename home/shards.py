@@ -0,0 +1,258 @@
+"""
+Tìm kiếm phân tán (scatter-gather) trên nhiều process shard.
+
+Mỗi process shard (manage.py retrieval_shard --partition i/n) giữ một phần corpus trong VectorStore riêng
+và nhận vector câu hỏi qua HTTP (POST /search). Web (coordinator) encode câu hỏi một lần, gửi song song tới
+mọi shard trong RAG_SHARD_URLS, chờ tối đa RAG_SHARD_TIMEOUT giây rồi gộp top-k theo score (khoảng cách L2).
+Shard chậm hoặc lỗi bị bỏ qua (thiếu kết quả của phần corpus đó) thay vì làm chậm cả câu hỏi.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from home import metrics
+from home.recall import MONITOR as RECALL
+from home.retrieval import _merge_hits, active_embedding_model
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class ShardUnavailable(Exception):
+    """Không shard nào trả lời kịp (hoặc shard trả lỗi)."""
+
+
+def encode_vectors(vectors):
+    """Vectors float32 -> dict JSON (shape + bytes base64), gọn hơn nhiều so với list số thực."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return {'shape': list(vectors.shape), 'data': base64.b64encode(vectors.tobytes()).decode('ascii')}
+
+
+def decode_vectors(payload):
+    shape = tuple(int(n) for n in payload['shape'])
+    if len(shape) != 2:
+        raise ValueError(f"Vectors phải có 2 chiều, nhận {shape}")
+    return np.frombuffer(base64.b64decode(payload['data']), dtype=np.float32).reshape(shape)
+
+
+# ---------------------------------------------------------------- Process shard
+
+class ShardServer(ThreadingHTTPServer):
+    """HTTP server phục vụ tìm kiếm trên một VectorStore (một phần corpus)."""
+
+    daemon_threads = True
+
+    def __init__(self, address, store, token=''):
+        super().__init__(address, ShardRequestHandler)
+        self.store = store
+        self.token = token
+
+    @property
+    def partition(self):
+        index, count = self.store.partition or (0, 1)
+        return f"{index}/{count}"
+
+    def status(self):
+        return {
+            'partition': self.partition,
+            'vectors': len(self.store),
+            'generation': self.store.generation_name,
+            'model': self.store.embedding_model,
+        }
+
+    def search(self, query_vectors, k, document_ids=None, model=None):
+        """
+        Tìm top-k trong phần corpus của shard. Trả về (HTTP status, payload).
+        `matched`: số tài liệu của shard thuộc `document_ids` (None nếu tìm toàn bộ).
+        """
+        self.store.sync()
+        if model and model != self.store.embedding_model:
+            return 409, {'error': f"Shard dùng model {self.store.embedding_model}, câu hỏi encode bằng {model}",
+                         'model': self.store.embedding_model}
+        shard_ids = None
+        if document_ids:
+            shard_ids = self.store.shard_ids_for_documents(document_ids)
+            if not shard_ids:
+                return 200, dict(self.status(), results=[[] for _ in query_vectors], matched=0)
+        results = self.store.search(query_vectors, k=k, doc_ids=shard_ids)
+        RECALL.maybe_sample(self.store, query_vectors, k, shard_ids, results)
+        return 200, dict(self.status(), results=results, matched=len(shard_ids) if shard_ids else None)
+
+
+class ShardRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'RAGShard/1'
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._send(404, {'error': "Không tìm thấy"})
+        self._send(200, self.server.status())
+
+    def do_POST(self):
+        if self.path != '/search':
+            return self._send(404, {'error': "Không tìm thấy"})
+        token = self.server.token
+        if token and self.headers.get('Authorization') != f"Bearer {token}":
+            return self._send(401, {'error': "Sai token"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY_SIZE:
+                return self._send(413, {'error': "Request quá lớn"})
+            body = json.loads(self.rfile.read(length))
+            query_vectors = decode_vectors(body['vectors'])
+            k = int(body.get('k', 5))
+            document_ids = [int(i) for i in body.get('document_ids') or []]
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send(400, {'error': f"Request không hợp lệ: {e}"})
+        try:
+            status, payload = self.server.search(query_vectors, k, document_ids, body.get('model'))
+        except Exception as e:
+            logger.exception(f"Lỗi tìm kiếm trên shard {self.server.partition}")
+            status, payload = 500, {'error': str(e)}
+        finally:
+            # Mỗi request chạy trong một thread riêng: không giữ kết nối DB sau khi xong
+            close_old_connections()
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+# ---------------------------------------------------------------- Coordinator (trong process web)
+
+class ShardCoordinator:
+    """
+    Gửi vector câu hỏi song song tới các process shard và gộp kết quả.
+    Mặc định đọc RAG_SHARD_URLS / RAG_SHARD_TIMEOUT / RAG_SHARD_TOKEN mỗi lần dùng.
+    """
+
+    def __init__(self, urls=None, timeout=None, token=None):
+        self._urls = urls
+        self._timeout = timeout
+        self._token = token
+        self._model = None  # model embedding do shard báo về gần nhất
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self):
+        return self._urls if self._urls is not None else settings.RAG_SHARD_URLS
+
+    @property
+    def timeout(self):
+        return self._timeout if self._timeout is not None else settings.RAG_SHARD_TIMEOUT
+
+    @property
+    def token(self):
+        return self._token if self._token is not None else settings.RAG_SHARD_TOKEN
+
+    @property
+    def embedding_model(self):
+        """Model để encode câu hỏi: model các shard đang phục vụ (nếu đã biết), hoặc model của RAG_INDEX_DIR."""
+        return self._model or active_embedding_model()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(8, 8 * len(self.urls)),
+                                                    thread_name_prefix='rag-shard')
+            return self._executor
+
+    def _call(self, url, body, timeout):
+        request = urllib.request.Request(url.rstrip('/') + '/search', data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        if self.token:
+            request.add_header('Authorization', f"Bearer {self.token}")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                payload = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read())
+            except ValueError:
+                error = {}
+            if e.code == 409 and error.get('model'):
+                # Index vừa đổi model: các câu hỏi sau được encode bằng model mới
+                self._model = error['model']
+                raise ShardUnavailable('model')
+            raise ShardUnavailable(f"http_{e.code}")
+        finally:
+            metrics.SHARD_SECONDS.observe(time.perf_counter() - start, shard=url)
+        if payload.get('model'):
+            self._model = payload['model']
+        return payload
+
+    def search(self, query_vectors, k=5, document_ids=None):
+        """
+        Tìm top-k chunks trên tất cả shard.
+
+        Args:
+            query_vectors: numpy array (số câu hỏi x số chiều), encode bằng self.embedding_model
+            k: Số chunks cần lấy cho mỗi câu hỏi
+            document_ids: Danh sách Document id để giới hạn tìm kiếm (None: toàn bộ)
+
+        Returns:
+            (kết quả như VectorStore.search, tổng số tài liệu khớp `document_ids` trên các shard đã trả lời
+            hoặc None nếu tìm toàn bộ). Raise ShardUnavailable nếu không shard nào trả lời.
+        """
+        urls = self.urls
+        body = json.dumps({
+            'vectors': encode_vectors(query_vectors),
+            'k': k,
+            'document_ids': list(document_ids) if document_ids else None,
+            'model': self.embedding_model,
+        }).encode('utf-8')
+        timeout = self.timeout
+        futures = {self._pool().submit(self._call, url, body, timeout): url for url in urls}
+        done, pending = wait(futures, timeout=timeout)
+
+        rows, matched, failed = [], None, []
+        for future in pending:
+            future.cancel()
+            failed.append((futures[future], 'timeout'))
+        for future in done:
+            try:
+                payload = future.result()
+            except ShardUnavailable as e:
+                failed.append((futures[future], str(e)))
+                continue
+            except Exception as e:
+                reason = 'timeout' if 'timed out' in str(e) else 'error'
+                logger.debug(f"Shard {futures[future]} lỗi: {e}")
+                failed.append((futures[future], reason))
+                continue
+            rows.append(payload['results'])
+            if payload.get('matched') is not None:
+                matched = (matched or 0) + payload['matched']
+
+        for url, reason in failed:
+            metrics.SHARD_FAILURES.inc(shard=url, reason=reason)
+        if failed:
+            logger.warning(f"Thiếu kết quả của {len(failed)}/{len(urls)} shard: "
+                           + ", ".join(f"{url} ({reason})" for url, reason in failed))
+        if not rows:
+            raise ShardUnavailable("Không shard nào trả lời")
+        return [_merge_hits(per_query, k) for per_query in zip(*rows)], matched
+
+
+# Coordinator dùng chung trong process web
+COORDINATOR = ShardCoordinator()
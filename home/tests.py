@@ -0,0 +1,737 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import faiss
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from home import views
+from home.admission import AdmissionController, Busy
+from home.answer_cache import _fresh, store as store_answer
+from home.bundles import BundleError, export_bundle, import_bundle
+from home.fields import CODEC_NONE, CODEC_ZLIB
+from home.index_store import (
+    GenerationWriter, IndexManifestError, current_generation, list_generations, previous_generation,
+    prune_generations, publish, publish_history,
+)
+from home.ingest import encode_bucketed, encode_threads
+from home.management.commands import import_pdfs
+from home.management.commands.eval_index import mean_recall
+from home.models import Answer, CachedAnswer, Document, ProcessedDocument, load_chunk_texts
+from home.rag import compress_hits, split_sentences, split_text_into_chunks
+from home.recall import rank_overlap, recall_at_k
+from home.shards import ShardCoordinator, ShardUnavailable
+from home.uploads import HashingUploadHandler, NOT_PDF_MESSAGE
+from home.warming import derive_questions, warm_document
+
+
+class MetricsViewTests(TestCase):
+    def test_requires_staff_or_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer sai').status_code, 403)
+        User.objects.create_user('admin', password='p', is_staff=True)
+        self.client.login(username='admin', password='p')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_PUBLIC=True)
+    def test_public_opt_in(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"rag_stage_duration_seconds", response.content)
+
+
+class HistoryCursorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', password='p')
+
+    def make_answers(self, count, same_time=False):
+        answers = [Answer.objects.create(ask_content=f"q{i}", answer_content="a", uploaded_by=self.user)
+                   for i in range(count)]
+        if same_time:
+            Answer.objects.filter(uploaded_by=self.user).update(ask_at=timezone.now())
+        return answers
+
+    def test_cursor_round_trip(self):
+        answer = self.make_answers(1)[0]
+        self.assertEqual(views.decode_cursor(views.encode_cursor(answer)), (answer.ask_at, answer.id))
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "không-phải-base64", "YWJj"):
+            with self.assertRaises(ValueError):
+                views.decode_cursor(cursor)
+
+    def test_pages_cover_all_answers_with_equal_timestamps(self):
+        # Cùng ask_at: thứ tự theo id, không trùng / sót câu nào giữa các trang
+        answers = self.make_answers(5, same_time=True)
+        seen, cursor = [], None
+        while True:
+            page, cursor = views.history_page(self.user, cursor, limit=2)
+            seen.extend(answer.id for answer in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted((answer.id for answer in answers), reverse=True))
+
+    def test_no_next_cursor_on_exact_last_page(self):
+        self.make_answers(4)
+        page, cursor = views.history_page(self.user, limit=4)
+        self.assertEqual(len(page), 4)
+        self.assertIsNone(cursor)
+        page, cursor = views.history_page(self.user, limit=3)
+        self.assertIsNotNone(cursor)
+        page, cursor = views.history_page(self.user, cursor, limit=3)
+        self.assertEqual(len(page), 1)
+        self.assertIsNone(cursor)
+
+    def test_history_is_per_user(self):
+        self.make_answers(2)
+        other = User.objects.create_user('v', password='p')
+        self.assertEqual(views.history_page(other), ([], None))
+
+
+LONG_TEXT = " ".join(f"Câu số {i} nói về quy định nội bộ của công ty trong năm." for i in range(120))
+
+
+def make_processed(text, document=None):
+    """ProcessedDocument của `text` với embeddings tạo bởi model của views."""
+    chunks = split_text_into_chunks(text, chunk_size=settings.RAG_CHUNK_SIZE)
+    return ProcessedDocument.objects.create(
+        file_name="doc.pdf",
+        document=document,
+        text_content=text,
+        text_hash=hashlib.sha1(text.encode('utf-8')).hexdigest(),
+        embeddings=pickle.dumps(np.asarray(views.EMBEDDING_MODEL.encode(chunks), dtype=np.float32)),
+        embedding_model=settings.RAG_EMBEDDING_MODEL,
+    )
+
+
+def hits_for(doc):
+    """Các hit (như retrieve_chunks trả về) cho mọi chunk của `doc`."""
+    chunks = split_text_into_chunks(doc.text_content, chunk_size=settings.RAG_CHUNK_SIZE)
+    return [{"doc": doc.id, "chunk": i, "score": float(i), "version": doc.text_hash[:16], "text": chunk}
+            for i, chunk in enumerate(chunks)]
+
+
+class ChunkRefsTests(TestCase):
+    def setUp(self):
+        self.doc = make_processed(LONG_TEXT)
+        self.hits = hits_for(self.doc)
+
+    def test_round_trip(self):
+        refs = views.chunk_refs(self.hits)
+        self.assertTrue(all("text" not in ref for ref in refs))
+        self.assertEqual(load_chunk_texts(refs), [hit["text"] for hit in self.hits])
+
+    def test_compressed_sentences(self):
+        hit = dict(self.hits[0], sentences=[0, 2])
+        sentences = split_sentences(hit["text"])
+        self.assertEqual(load_chunk_texts(views.chunk_refs([hit])), [f"{sentences[0]} … {sentences[2]}"])
+
+    def test_reprocessed_document_is_skipped(self):
+        refs = views.chunk_refs(self.hits)
+        ProcessedDocument.objects.filter(id=self.doc.id).update(text_hash="0" * 40)
+        self.assertEqual(load_chunk_texts(refs), [])
+
+    def test_other_chunk_size_is_skipped(self):
+        refs = views.chunk_refs(self.hits)
+        with override_settings(RAG_CHUNK_SIZE=settings.RAG_CHUNK_SIZE // 2):
+            self.assertEqual(load_chunk_texts(refs), [])
+
+    def test_legacy_refs_without_chunk_size(self):
+        refs = [{key: value for key, value in ref.items() if key != "chunk_size"}
+                for ref in views.chunk_refs(self.hits)]
+        self.assertEqual(len(load_chunk_texts(refs)), len(self.hits))
+
+
+class DocumentScopeTests(TestCase):
+    def setUp(self):
+        make_processed(LONG_TEXT, document=Document.objects.create(description="xong", is_processed=True))
+        self.pending = Document.objects.create(description="chưa xử lý")
+
+    def test_retrieve_never_widens_scope(self):
+        self.assertTrue(views.retrieve_chunks("quy định nội bộ"))
+        self.assertEqual(views.retrieve_chunks("quy định nội bộ", document_ids=[self.pending.id]), [])
+
+    def test_chat_reports_empty_scope(self):
+        session = self.client.session
+        session["selected_documents"] = [self.pending.id]
+        session.save()
+        response = self.client.post('/', {"question": "Quy định nội bộ là gì?"})
+        self.assertIn(views.SCOPE_EMPTY_MESSAGE, [str(message) for message in get_messages(response.wsgi_request)])
+
+
+class GenerationTests(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+
+    def write_generation(self, chunk_size=1000):
+        writer = GenerationWriter(self.index_dir, 4, settings={'chunk_size': chunk_size})
+        writer.add_document(1, 1, "v", np.ones((2, 4), dtype=np.float32), ["a", "b"])
+        return writer.finish()
+
+    def test_publish_refuses_mismatched_manifest(self):
+        name = self.write_generation(chunk_size=500)
+        with self.assertRaises(IndexManifestError):
+            publish(self.index_dir, name, expected={'chunk_size': 1000})
+        self.assertIsNone(current_generation(self.index_dir))
+
+    def test_publish_refuses_truncated_file(self):
+        name = self.write_generation()
+        with open(os.path.join(self.index_dir, name, 'vectors.f32'), 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(IndexManifestError):
+            publish(self.index_dir, name, expected={'chunk_size': 1000})
+
+    def test_rollback_steps_back_each_time(self):
+        names = [self.write_generation() for _ in range(3)]
+        for name in names:
+            publish(self.index_dir, name)
+        for expected in (names[1], names[0]):
+            previous = previous_generation(self.index_dir)
+            self.assertEqual(previous, expected)
+            publish(self.index_dir, previous, rollback=True)
+            self.assertEqual(current_generation(self.index_dir), expected)
+        self.assertIsNone(previous_generation(self.index_dir))
+
+    def test_publish_after_rollback(self):
+        names = [self.write_generation() for _ in range(3)]
+        publish(self.index_dir, names[0])
+        publish(self.index_dir, names[1])
+        publish(self.index_dir, names[0], rollback=True)
+        publish(self.index_dir, names[2])
+        self.assertEqual(previous_generation(self.index_dir), names[0])
+
+    def test_prune_keeps_rollback_targets(self):
+        names = [self.write_generation() for _ in range(5)]
+        for name in names:
+            publish(self.index_dir, name)
+        unpublished = self.write_generation()
+        self.assertEqual(prune_generations(self.index_dir, 2), names[:2])
+        self.assertEqual(list_generations(self.index_dir), names[2:] + [unpublished])
+        # Mọi generation còn trong HISTORY vẫn rollback được
+        self.assertEqual(publish_history(self.index_dir), names[2:])
+        for expected in (names[3], names[2]):
+            self.assertEqual(previous_generation(self.index_dir), expected)
+            publish(self.index_dir, expected, rollback=True)
+        self.assertIsNone(previous_generation(self.index_dir))
+
+
+def pdf_bytes(*pages):
+    """PDF tối giản: mỗi tham số là văn bản (ASCII) của một trang."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(len(pages))), len(pages)),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        stream = b"BT /F1 12 Tf 20 150 Td (%s) Tj ET" % text.encode('ascii')
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 300 300] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % (5 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class ImportPdfsTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=os.path.join(self.root, 'media'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source = os.path.join(self.root, 'pdfs')
+        os.makedirs(self.source)
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(self.source, f'{name}.pdf'), 'wb') as f:
+                f.write(pdf_bytes(f"Noi dung tai lieu {name} ve quy dinh nghi phep."))
+        self.checkpoint = os.path.join(self.root, 'checkpoint.json')
+
+    def import_pdfs(self, *args):
+        """Chạy import_pdfs, trả về trạng thái từng file trong checkpoint."""
+        call_command('import_pdfs', self.source, '--workers', '1', '--checkpoint', self.checkpoint, *args,
+                     stdout=StringIO(), stderr=StringIO())
+        with open(self.checkpoint, encoding='utf-8') as f:
+            return {relpath: entry['status'] for relpath, entry in json.load(f)['files'].items()}
+
+    def test_save_error_marks_file_failed_and_continues(self):
+        save = import_pdfs.save_processed_document
+
+        def flaky_save(doc, *args):
+            if doc.description == 'b':
+                raise OSError("disk full")
+            return save(doc, *args)
+
+        with mock.patch.object(import_pdfs, 'save_processed_document', flaky_save):
+            self.assertEqual(self.import_pdfs(), {'a.pdf': 'done', 'b.pdf': 'failed', 'c.pdf': 'done'})
+        self.assertEqual(ProcessedDocument.objects.count(), 2)
+        self.assertEqual(self.import_pdfs('--retry-failed'), {'a.pdf': 'done', 'b.pdf': 'done', 'c.pdf': 'done'})
+        self.assertEqual(ProcessedDocument.objects.count(), 3)
+
+    def test_duplicate_files_are_skipped(self):
+        shutil.copy(os.path.join(self.source, 'a.pdf'), os.path.join(self.source, 'a_copy.pdf'))
+        with open(os.path.join(self.source, 'c.pdf'), 'rb') as f:
+            content = f.read()
+        Document.objects.create(description="web", document=ContentFile(content, name="web.pdf"),
+                                content_hash=hashlib.sha256(content).hexdigest())
+        statuses = {'a.pdf': 'done', 'a_copy.pdf': 'duplicate', 'b.pdf': 'done', 'c.pdf': 'duplicate'}
+        self.assertEqual(self.import_pdfs(), statuses)
+        self.assertEqual(Document.objects.count(), 3)
+        self.assertEqual(self.import_pdfs(), statuses)
+
+
+class EncodeBucketedTests(TestCase):
+    def test_keeps_input_order(self):
+        model = views.EMBEDDING_MODEL
+        texts = [" ".join(f"w{i}" for i in range(length)) for length in (3, 40, 1, 17, 40, 8, 25, 2, 60, 5)]
+        vectors = encode_bucketed(model, texts, batch_size=2, max_batch_chars=80)
+        np.testing.assert_allclose(vectors, model.encode(texts), rtol=1e-4, atol=1e-5)
+
+    def test_empty(self):
+        model = views.EMBEDDING_MODEL
+        self.assertEqual(encode_bucketed(model, []).shape, (0, model.get_sentence_embedding_dimension()))
+
+    def test_encode_threads_restores_previous_setting(self):
+        before = faiss.omp_get_max_threads()
+        with encode_threads(before + 1):
+            self.assertEqual(faiss.omp_get_max_threads(), before + 1)
+        self.assertEqual(faiss.omp_get_max_threads(), before)
+
+
+class ReprocessDocumentsTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.old = {}
+        for name, content in (('ok', pdf_bytes("Quy dinh moi ve nghi phep.")), ('broken', b"%PDF-1.4 hong")):
+            document = Document.objects.create(description=name, is_processed=True,
+                                               document=ContentFile(content, name=f"{name}.pdf"))
+            self.old[name] = make_processed(LONG_TEXT, document=document)
+
+    def test_replaces_rows_and_keeps_failed_documents(self):
+        call_command('reprocess_documents', stdout=StringIO(), stderr=StringIO())
+        ok = ProcessedDocument.objects.get(document__description='ok')
+        self.assertNotEqual(ok.id, self.old['ok'].id)
+        self.assertIn("Quy dinh moi", ok.text_content)
+        # Tài liệu xử lý lại lỗi vẫn tìm kiếm được bằng bản cũ
+        self.assertEqual(ProcessedDocument.objects.get(document__description='broken').id, self.old['broken'].id)
+
+
+@override_settings(API_TOKEN="s3cret")
+class BatchApiTests(TestCase):
+    def setUp(self):
+        self.document = Document.objects.create(description="xong", is_processed=True)
+        make_processed(LONG_TEXT, document=self.document)
+        self.pending = Document.objects.create(description="chưa xử lý")
+
+    def ask(self, **payload):
+        return self.client.post('/api/ask/', json.dumps(payload), content_type="application/json",
+                                HTTP_AUTHORIZATION="Bearer s3cret")
+
+    def test_requires_token(self):
+        response = self.client.post('/api/ask/', json.dumps({"questions": ["?"]}), content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_chunks_per_question(self):
+        response = self.ask(questions=["Quy định nội bộ?", "Nghỉ phép?"], k=2, answer=False,
+                            document_ids=[self.document.id])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([len(result["chunks"]) for result in results], [2, 2])
+        self.assertTrue(all(ref["doc"] == self.document.id for result in results for ref in result["chunks"]))
+
+    def test_empty_scope_is_conflict(self):
+        response = self.ask(questions=["Quy định nội bộ?"], answer=False, document_ids=[self.pending.id])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["error"], views.SCOPE_EMPTY_MESSAGE)
+
+
+class CompressedTextFieldTests(TestCase):
+    def raw_text(self, doc):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT text_content FROM home_processeddocument WHERE id = %s", [doc.id])
+            return bytes(cursor.fetchone()[0])
+
+    def test_round_trip(self):
+        for text in ("", "ngắn", LONG_TEXT, "Tiếng Việt có dấu: ả ã ạ ằ ẳ ẵ ặ ể ễ ệ " * 50):
+            doc = make_processed(text or "x")
+            ProcessedDocument.objects.filter(id=doc.id).update(text_content=text)
+            self.assertEqual(ProcessedDocument.objects.get(id=doc.id).text_content, text)
+
+    def test_long_text_is_compressed(self):
+        doc = make_processed(LONG_TEXT)
+        raw = self.raw_text(doc)
+        self.assertEqual(raw[:1], CODEC_ZLIB)
+        self.assertLess(len(raw), len(LONG_TEXT.encode('utf-8')))
+        self.assertEqual(self.raw_text(make_processed("ngắn"))[:1], CODEC_NONE)
+
+
+class CompressTextMigrationTests(TransactionTestCase):
+    before = [('home', '0019_document_extractor')]
+    after = [('home', '0020_compress_text_content')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_rows_are_compressed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        texts = ["ngắn", LONG_TEXT]
+        ids = [old_apps.get_model('home', 'ProcessedDocument').objects.create(file_name="d", text_content=text).id
+               for text in texts]
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        new_apps = executor.loader.project_state(self.after).apps
+        model = new_apps.get_model('home', 'ProcessedDocument')
+        self.assertEqual([model.objects.get(id=pk).text_content for pk in ids], texts)
+
+
+class AdmissionControllerTests(TestCase):
+    def hold(self, controller):
+        """Giữ một chỗ chạy tới khi gọi hàm trả về."""
+        slot = controller.admit(0)
+        slot.__enter__()
+        return lambda: slot.__exit__(None, None, None)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def test_higher_priority_is_admitted_first(self):
+        controller = AdmissionController(limit=1, queue_size=4, timeout=5)
+        release = self.hold(controller)
+        order = []
+
+        def run(priority):
+            with controller.admit(priority):
+                order.append(priority)
+
+        threads = []
+        for priority in (3, 2, 0, 2):
+            threads.append(threading.Thread(target=run, args=(priority,)))
+            threads[-1].start()
+            self.wait_for(lambda: controller.waiting == len(threads))
+        release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, [0, 2, 2, 3])
+        self.assertEqual((controller.active, controller.waiting), (0, 0))
+
+    def test_queue_full(self):
+        controller = AdmissionController(limit=1, queue_size=0, timeout=5)
+        release = self.hold(controller)
+        with self.assertRaises(Busy) as raised:
+            with controller.admit(0):
+                pass
+        self.assertEqual(raised.exception.reason, 'queue_full')
+        release()
+        self.assertEqual(controller.active, 0)
+
+    def test_timeout(self):
+        controller = AdmissionController(limit=1, queue_size=2, timeout=0.05)
+        release = self.hold(controller)
+        with self.assertRaises(Busy) as raised:
+            with controller.admit(0):
+                pass
+        self.assertEqual(raised.exception.reason, 'timeout')
+        self.assertEqual(controller.waiting, 0)
+        release()
+        with controller.admit(0):
+            self.assertEqual(controller.active, 1)
+
+    def test_unlimited(self):
+        controller = AdmissionController(limit=0, queue_size=0, timeout=0)
+        with controller.admit(3), controller.admit(3):
+            self.assertEqual(controller.active, 2)
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        User.objects.create_user('admin', password='p', is_staff=True)
+        self.client.login(username='admin', password='p')
+
+    def upload(self, name, content):
+        response = self.client.post('/upload/', {'description': name, 'document': SimpleUploadedFile(name, content)})
+        return response, [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_accepts_pdf_and_stores_hash(self):
+        content = pdf_bytes("Quy dinh")
+        self.upload('a.pdf', content)
+        self.assertEqual(Document.objects.get().content_hash, hashlib.sha256(content).hexdigest())
+
+    def test_rejects_non_pdf(self):
+        _, messages = self.upload('a.pdf', b'not a pdf' * 10)
+        self.assertIn(NOT_PDF_MESSAGE, messages)
+        self.assertFalse(Document.objects.exists())
+
+    def test_non_pdf_is_rejected_after_header_window(self):
+        receive = HashingUploadHandler.receive_data_chunk
+        with mock.patch.object(HashingUploadHandler, 'receive_data_chunk', autospec=True,
+                               side_effect=receive) as spy:
+            _, messages = self.upload('a.pdf', b'x' * (3 * HashingUploadHandler.chunk_size))
+        # Chunk đầu đã đủ HEADER_WINDOW: các chunk sau không được nhận
+        self.assertEqual(spy.call_count, 1)
+        self.assertIn(NOT_PDF_MESSAGE, messages)
+        self.assertFalse(Document.objects.exists())
+
+    def test_rejects_duplicate(self):
+        content = pdf_bytes("Quy dinh")
+        self.upload('a.pdf', content)
+        _, messages = self.upload('b.pdf', content)
+        self.assertTrue(any("đã được upload" in message for message in messages))
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_rejects_oversize(self):
+        with override_settings(RAG_UPLOAD_MAX_SIZE=1024):
+            _, messages = self.upload('a.pdf', pdf_bytes("Quy dinh") + b'%' * 4096)
+        self.assertTrue(any("quá lớn" in message for message in messages))
+        self.assertFalse(Document.objects.exists())
+
+    def test_rejects_too_many_pages(self):
+        with override_settings(RAG_UPLOAD_MAX_PAGES=2):
+            _, messages = self.upload('a.pdf', pdf_bytes("Mot", "Hai", "Ba"))
+        self.assertTrue(any("3 trang" in message for message in messages))
+        self.assertFalse(Document.objects.exists())
+
+
+class ShardScopeTests(TestCase):
+    def test_missing_shard_gives_partial_results_within_scope(self):
+        coordinator = ShardCoordinator(urls=['http://a', 'http://b'], timeout=5)
+        hit = {'doc': 7, 'chunk': 0, 'score': 0.5, 'version': 'v', 'text': "x"}
+        bodies = []
+
+        def call(url, body, timeout):
+            bodies.append(json.loads(body))
+            if url == 'http://a':
+                raise ShardUnavailable('http_503')
+            return {'results': [[hit]], 'matched': 1}
+
+        with mock.patch.object(coordinator, '_call', side_effect=call):
+            results, matched = coordinator.search(np.zeros((1, 4), dtype=np.float32), k=2, document_ids=[7])
+        self.assertEqual((results, matched), ([[hit]], 1))
+        self.assertEqual([body['document_ids'] for body in bodies], [[7], [7]])
+
+    @override_settings(RAG_SHARD_URLS=['http://a'])
+    def test_retrieve_never_widens_scope(self):
+        with mock.patch.object(views.SHARDS, 'search', return_value=([[]], 0)) as search:
+            self.assertEqual(views.retrieve_chunks_batch(["Quy định?"], document_ids=[3]), [[]])
+        search.assert_called_once()
+        self.assertEqual(search.call_args.kwargs['document_ids'], [3])
+
+
+class CompressHitsTests(TestCase):
+    def setUp(self):
+        filler = [f"Phòng họp số {i} được sửa chữa vào tháng trước." for i in range(40)]
+        filler[23] = "Nhân viên được nghỉ phép mười hai ngày mỗi năm."
+        text = " ".join(filler)
+        self.hits = [{"doc": 1, "chunk": i, "score": 0.0, "version": "v", "text": chunk}
+                     for i, chunk in enumerate(split_text_into_chunks(text, chunk_size=500))]
+        self.question = "Nhân viên được nghỉ phép bao nhiêu ngày mỗi năm?"
+
+    def test_keeps_relevant_sentence_within_budget(self):
+        compressed = compress_hits(self.question, self.hits, views.EMBEDDING_MODEL, budget=300, neighbours=1)
+        self.assertLessEqual(sum(len(hit["text"]) for hit in compressed), 300 + 10)
+        self.assertTrue(any("mười hai ngày" in hit["text"] for hit in compressed))
+        for hit in compressed:
+            original = next(h for h in self.hits if h["chunk"] == hit["chunk"])
+            sentences = split_sentences(original["text"])
+            self.assertTrue(all(sentences[i] in hit["text"] for i in hit["sentences"]))
+
+    def test_no_compression_when_within_budget(self):
+        self.assertIs(compress_hits(self.question, self.hits, views.EMBEDDING_MODEL, budget=0), self.hits)
+        self.assertIs(compress_hits(self.question, self.hits, views.EMBEDDING_MODEL, budget=10 ** 6), self.hits)
+
+    def test_tiny_budget_keeps_best_sentence(self):
+        compressed = compress_hits(self.question, self.hits, views.EMBEDDING_MODEL, budget=5)
+        self.assertEqual([hit["text"] for hit in compressed], ["Nhân viên được nghỉ phép mười hai ngày mỗi năm."])
+
+
+class RecallMetricTests(TestCase):
+    def test_recall_at_k(self):
+        truth = [(1, 0), (1, 1), (2, 0), (3, 5)]
+        self.assertEqual(recall_at_k(truth, truth), 1.0)
+        self.assertEqual(recall_at_k([(1, 0), (9, 9), (2, 0), (8, 8)], truth), 0.5)
+        self.assertEqual(recall_at_k([], truth), 0.0)
+        self.assertEqual(recall_at_k([(1, 0)], []), 1.0)
+
+    def test_rank_overlap(self):
+        truth = [(1, 0), (1, 1), (2, 0)]
+        self.assertEqual(rank_overlap(truth, truth), 1.0)
+        self.assertEqual(rank_overlap([], []), 1.0)
+        self.assertEqual(rank_overlap([(9, 9)] * 3, truth), 0.0)
+        # Cùng tập kết quả, sai thứ tự: thấp hơn 1 nhưng recall vẫn 1
+        swapped = [(1, 1), (1, 0), (2, 0)]
+        self.assertAlmostEqual(rank_overlap(swapped, truth), (0 + 1 + 1) / 3)
+        self.assertEqual(recall_at_k(swapped, truth), 1.0)
+
+
+    def test_mean_recall_ignores_missing_ids(self):
+        truth = np.array([[0, 1], [2, -1]])
+        found = np.array([[1, -1], [2, 3]])
+        self.assertEqual(mean_recall(truth, found), (0.5 + 1.0) / 2)
+
+
+class WarmingTests(TestCase):
+    TEXT = (
+        "CHÍNH SÁCH NHÂN SỰ\n"
+        "Điều 1. Nghỉ phép năm\n"
+        "Nhân viên được nghỉ phép mười hai ngày mỗi năm.\n"
+        "2.1 Bảo hiểm sức khỏe\n"
+        "Nhân viên thử việc có được nghỉ phép không? Không, chỉ nhân viên chính thức.\n"
+        "Một dòng văn bản bình thường kết thúc bằng dấu chấm.\n"
+    )
+
+    def test_derive_questions(self):
+        questions = derive_questions(self.TEXT, ["Giờ làm việc là mấy giờ?", "", "giờ làm việc là mấy giờ"],
+                                     limit=10)
+        self.assertEqual(questions, [
+            "Giờ làm việc là mấy giờ?",
+            "Nhân viên thử việc có được nghỉ phép không?",
+            "Quy định về chính sách nhân sự như thế nào?",
+            "Quy định về nghỉ phép năm như thế nào?",
+            "Quy định về bảo hiểm sức khỏe như thế nào?",
+        ])
+        self.assertEqual(len(derive_questions(self.TEXT, limit=2)), 2)
+
+    def make_entry(self):
+        doc = make_processed(LONG_TEXT)
+        store_answer("Câu hỏi?", "Trả lời", views.chunk_refs(hits_for(doc)[:2]))
+        return doc, CachedAnswer.objects.get()
+
+    def test_fresh_entry(self):
+        _, entry = self.make_entry()
+        self.assertTrue(_fresh(entry))
+
+    def test_stale_after_reprocess(self):
+        doc, entry = self.make_entry()
+        ProcessedDocument.objects.filter(id=doc.id).update(text_hash="0" * 40)
+        self.assertFalse(_fresh(entry))
+
+    def test_stale_after_delete(self):
+        doc, entry = self.make_entry()
+        doc.delete()
+        self.assertFalse(_fresh(entry))
+
+    def test_stale_after_ttl(self):
+        _, entry = self.make_entry()
+        entry.created_at = timezone.now() - timedelta(seconds=settings.RAG_ANSWER_CACHE_TTL + 1)
+        self.assertFalse(_fresh(entry))
+
+    def test_stale_after_chunk_size_change(self):
+        _, entry = self.make_entry()
+        with override_settings(RAG_CHUNK_SIZE=settings.RAG_CHUNK_SIZE // 2):
+            self.assertFalse(_fresh(entry))
+
+
+class WarmDocumentTests(TransactionTestCase):
+    # Trả lời trước chạy trong thread riêng (kết nối DB riêng): không bọc test trong transaction
+    @override_settings(RAG_WARM_LLM_CONCURRENCY=1)
+    def test_context_is_compressed_once_per_question(self):
+        document = Document.objects.create(description="xong", is_processed=True,
+                                           warm_questions="Quy định nội bộ?\nNăm nào?")
+        make_processed(LONG_TEXT, document=document)
+        compress = mock.Mock(side_effect=lambda question, hits: [dict(hits[0], sentences=[0])])
+        with mock.patch.object(views, 'compress_context', compress), \
+                mock.patch.object(views, '_answer_with_context', return_value=("Trả lời", None)):
+            done, total = warm_document(document.id)
+        self.assertEqual((done, compress.call_count), (total, total))
+        # chunk_refs lưu đúng các câu đã gửi LLM
+        self.assertTrue(all(len(entry.chunk_refs) == 1 and entry.chunk_refs[0]["sentences"] == [0]
+                            for entry in CachedAnswer.objects.all()))
+
+
+class BundleTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=os.path.join(self.root, 'media'),
+                                     RAG_INDEX_DIR=os.path.join(self.root, 'index'), RAG_INDEX_DIMS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.bundle = os.path.join(self.root, 'bundle')
+        for i in range(3):
+            document = Document.objects.create(description=f"d{i}", is_processed=True,
+                                               document=ContentFile(b"%PDF-1.4 " + bytes([i]), name=f"d{i}.pdf"))
+            make_processed(f"Tài liệu {i}. " + LONG_TEXT, document=document)
+
+    def snapshot(self):
+        return {doc.text_hash: (doc.document.description, pickle.loads(doc.embeddings).tolist())
+                for doc in ProcessedDocument.objects.select_related('document')}
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        manifest = export_bundle(self.bundle, with_files=True)
+        self.assertEqual(manifest['n_docs'], 3)
+        Document.objects.all().delete()
+
+        stats = import_bundle(self.bundle, build_index=True)
+        self.assertEqual((stats['imported'], stats['skipped']), (3, 0))
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(current_generation(settings.RAG_INDEX_DIR), stats['generation'])
+        for document in Document.objects.all():
+            self.assertTrue(document.is_processed)
+            self.assertTrue(os.path.exists(document.document.path))
+
+        # Chạy lại: tài liệu đã có được bỏ qua
+        self.assertEqual(import_bundle(self.bundle)['skipped'], 3)
+        self.assertEqual(ProcessedDocument.objects.count(), 3)
+
+    def test_refuses_other_chunk_size(self):
+        export_bundle(self.bundle)
+        with override_settings(RAG_CHUNK_SIZE=settings.RAG_CHUNK_SIZE // 2):
+            with self.assertRaises(BundleError):
+                import_bundle(self.bundle)
+
+    def test_refuses_corrupted_vectors(self):
+        export_bundle(self.bundle)
+        with open(os.path.join(self.bundle, 'vectors.f32'), 'r+b') as f:
+            f.write(b'\xff' * 8)
+        with self.assertRaises(BundleError):
+            import_bundle(self.bundle)
+
+    def test_refuses_existing_bundle(self):
+        export_bundle(self.bundle)
+        with self.assertRaises(BundleError):
+            export_bundle(self.bundle)
@@ -0,0 +1,103 @@
+"""
+Xử lý file upload: ghi thẳng xuống file tạm theo từng chunk (không giữ file trong bộ nhớ),
+tính SHA-256 và kiểm tra header PDF ngay trong lúc nhận dữ liệu, dừng nhận file quá RAG_UPLOAD_MAX_SIZE
+hoặc không có header PDF trong HEADER_WINDOW byte đầu.
+
+Kết quả gắn vào file đã upload (`sha256`, `is_pdf`) hoặc lỗi vào `request.upload_errors`;
+DocumentForm dùng chúng để từ chối file trùng/hỏng trước khi lưu và xử lý.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b'%PDF-'
+# Header PDF có thể đứng sau vài byte rác (theo đặc tả, trong 1024 byte đầu)
+HEADER_WINDOW = 1024
+# Phần request ngoài nội dung file (các field khác của form, boundary multipart)
+FORM_OVERHEAD = 64 * 1024
+NOT_PDF_MESSAGE = "File không phải PDF."
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """TemporaryFileUploadHandler tính SHA-256, kiểm tra header PDF và giới hạn kích thước khi đang nhận file."""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.content_length = content_length
+        return super().handle_raw_input(input_data, META, content_length, boundary, encoding)
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        self.max_size = settings.RAG_UPLOAD_MAX_SIZE
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        # Cả request đã lớn hơn giới hạn: bỏ qua ngay, không ghi gì xuống đĩa
+        if self.max_size and (getattr(self, 'content_length', None) or 0) > self.max_size + FORM_OVERHEAD:
+            self._reject(field_name, file_name, f"File quá lớn (tối đa {filesizeformat(self.max_size)})")
+        super().new_file(field_name, file_name, *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.max_size and self.size > self.max_size:
+            self.file.close()
+            self._reject(self.field_name, self.file_name, f"File quá lớn (tối đa {filesizeformat(self.max_size)})")
+        if len(self.head) < HEADER_WINDOW:
+            self.head += raw_data[:HEADER_WINDOW - len(self.head)]
+            # Đã đủ HEADER_WINDOW byte mà không có header PDF: dừng nhận, không ghi phần còn lại xuống đĩa
+            if len(self.head) >= HEADER_WINDOW and PDF_MAGIC not in self.head:
+                self.file.close()
+                self._reject(self.field_name, self.file_name, NOT_PDF_MESSAGE)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.digest.hexdigest()
+        uploaded.is_pdf = PDF_MAGIC in self.head
+        return uploaded
+
+    def _reject(self, field_name, file_name, reason):
+        logger.warning(f"Từ chối upload {file_name}: {reason}")
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[field_name] = reason
+        # SkipFile: phần còn lại của file được đọc bỏ đi, các field khác của form vẫn nhận bình thường
+        raise SkipFile(reason)
+
+
+def inspect_upload(uploaded):
+    """
+    (SHA-256, có header PDF không) của file đã upload: lấy từ HashingUploadHandler,
+    hoặc đọc lại file nếu được nhận bằng handler khác.
+    """
+    if hasattr(uploaded, 'sha256'):
+        return uploaded.sha256, uploaded.is_pdf
+    digest = hashlib.sha256()
+    head = b''
+    for chunk in uploaded.chunks():
+        if len(head) < HEADER_WINDOW:
+            head += chunk[:HEADER_WINDOW - len(head)]
+        digest.update(chunk)
+    uploaded.seek(0)
+    return digest.hexdigest(), PDF_MAGIC in head
+
+
+def pdf_page_count(uploaded):
+    """
+    Số trang của file PDF đã upload (chỉ đọc bảng xref, không trích xuất văn bản).
+    Raise exception nếu file hỏng hoặc bị mã hóa.
+    """
+    import PyPDF2
+
+    if hasattr(uploaded, 'temporary_file_path'):
+        reader = PyPDF2.PdfReader(uploaded.temporary_file_path())
+    else:
+        reader = PyPDF2.PdfReader(uploaded)
+        uploaded.seek(0)
+    if reader.is_encrypted:
+        raise ValueError("File PDF bị mã hóa")
+    return len(reader.pages)
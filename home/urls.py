@@ -9,5 +9,10 @@ urlpatterns = [
     path('account/', views.account, name='account'),
     path('logout/', views.logout_view, name='logout'),
     path('upload/', views.upload, name='upload'),
+    path('upload/warm/', views.warm_status, name='warm_status'),
     path('selected/', views.select_files, name='select_file'),
+    path('history/', views.history, name='history'),
+    path('history/<int:answer_id>/', views.history_detail, name='history_detail'),
+    path('api/ask/', views.ask_batch, name='ask_batch'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,4 +1,9 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.db.models import Q
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
 from home.models import Document, Answer, ProcessedDocument
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
@@ -7,29 +12,64 @@ from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import logout
 from home.forms import DocumentForm, AnswerForm
-from home.rag import split_text_into_chunks, asking, extract_text_from_pdf
+from home.rag import GEMINI_API_KEY, compress_hits, extractive_answer, start_answer
+from home import metrics
+from home.metrics import span
+from home.admission import CONTROLLER as ADMISSION, PRIORITY_BATCH, Busy, request_priority
+from home.retrieval import STORE, active_embedding_model
+from home.shards import COORDINATOR as SHARDS
+from home.recall import MONITOR as RECALL
+from home import answer_cache, warming
+from home.embeddings import get_model
+from home.index_store import read_job_status
+from home.ingest import BatchEncoder, document_pages, encode_threads, save_processed_document, split_pages
+import gc
+import json
 import logging
 import os
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-import pickle
+import time
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 # Mô hình Sentence Transformer cho embedding
-EMBEDDING_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-CHUNK_SIZE = 1000  # Kích thước chunk cho split_text_into_chunks
+EMBEDDING_MODEL_NAME = settings.RAG_EMBEDDING_MODEL
+EMBEDDING_MODEL = get_model(EMBEDDING_MODEL_NAME)
+CHUNK_SIZE = settings.RAG_CHUNK_SIZE  # Kích thước chunk cho split_text_into_chunks
+HISTORY_PAGE_SIZE = 10  # Số câu hỏi mỗi trang lịch sử
+HISTORY_MAX_PAGE_SIZE = 100
+SCOPE_EMPTY_MESSAGE = "Các tài liệu đã chọn chưa được xử lý xong (hoặc chưa tìm kiếm được), vui lòng thử lại sau."
+
+
+def preload():
+    """
+    Load model embedding và index trước khi fork worker (gunicorn --preload, RAG_PRELOAD=1).
+    Các worker con dùng chung trọng số model (copy-on-write) và vectors của generation (mmap).
+    """
+    if settings.RAG_SHARD_URLS:
+        get_model(SHARDS.embedding_model)
+    else:
+        STORE.sync()
+        get_model(STORE.embedding_model)
+    # Không chia sẻ kết nối DB của process cha cho các worker con
+    connections.close_all()
+    # Đưa các object đã load ra khỏi GC để GC của worker không ghi vào các trang bộ nhớ dùng chung
+    gc.freeze()
+    logger.info(f"Preload xong: model {STORE.embedding_model}, {len(STORE)} vectors, generation={STORE.generation_name}")
 
 
 def process_new_documents():
     """
     Xử lý các tài liệu PDF chưa được xử lý:
-    - Trích xuất văn bản từ PDF
+    - Trích xuất văn bản từ PDF (dùng cache nếu file đã từng được trích xuất)
     - Chia thành chunks
-    - Tạo embeddings
+    - Tạo embeddings (gom chunks của nhiều tài liệu, encode theo nhóm độ dài với batch lớn)
     - Lưu vào database
     """
     try:
@@ -39,119 +79,314 @@ def process_new_documents():
             logger.info("Không có tài liệu chưa xử lý.")
             return
 
-        for doc in unprocessed_docs:
-            try:
-                logger.info(f"Đang xử lý tài liệu: {doc.description or doc.document.name}")
-                
-                file_path = doc.document.path
-                text_content = extract_text_from_pdf(file_path)
-                
-                if not text_content:
-                    logger.warning(f"Không thể trích xuất văn bản từ {doc.document.name}")
-                    continue
-                
-                # Chia thành chunks (sử dụng CHUNK_SIZE constant)
-                chunks = split_text_into_chunks(text_content, chunk_size=CHUNK_SIZE)
-                
-                if not chunks:
-                    logger.warning(f"Không có chunks hợp lệ cho {doc.document.name}")
-                    continue
-                
-                # Tạo embeddings
-                chunk_embeddings = np.array(EMBEDDING_MODEL.encode(chunks))
+        # Encode bằng model của index đang phục vụ để tài liệu mới tìm được cùng generation hiện tại
+        model_name = active_embedding_model()
+        encoder = BatchEncoder(get_model(model_name), batch_size=settings.RAG_ENCODE_BATCH_SIZE)
+
+        saved_ids = []
+
+        def save(results):
+            for doc, text_content, chunk_embeddings in results:
+                try:
+                    # Lưu vào ProcessedDocument và đánh dấu tài liệu đã xử lý
+                    save_processed_document(doc, text_content, chunk_embeddings, model_name)
+                    saved_ids.append(doc.id)
+                    logger.info(f"Xử lý thành công tài liệu: {doc.description or doc.document.name}")
+                except Exception as e:
+                    logger.error(f"Lỗi lưu tài liệu {doc.id}: {e}")
+
+        # Số thread encode chỉ đổi trong lúc ingest: encode câu hỏi của các request khác giữ cấu hình mặc định
+        with encode_threads(settings.RAG_ENCODE_THREADS):
+            for doc in unprocessed_docs:
+                try:
+                    logger.info(f"Đang xử lý tài liệu: {doc.description or doc.document.name}")
                 
-                # Lưu vào ProcessedDocument
-                ProcessedDocument.objects.create(
-                    file_name=doc.description or doc.document.name,
-                    text_content=text_content,
-                    embeddings=pickle.dumps(chunk_embeddings),
-                    document=doc
-                )
+                    text_content, chunks = split_pages(document_pages(doc), CHUNK_SIZE)
                 
-                # Đánh dấu tài liệu đã xử lý
-                doc.is_processed = True
-                doc.save()
+                    if not chunks:
+                        logger.warning(f"Không thể trích xuất văn bản từ {doc.document.name}")
+                        continue
                 
-                logger.info(f"Xử lý thành công tài liệu: {doc.description or doc.document.name}")
+                    save(encoder.add(doc, text_content, chunks))
                 
-            except Exception as e:
-                logger.error(f"Lỗi xử lý tài liệu {doc.id}: {e}")
+                except Exception as e:
+                    logger.error(f"Lỗi xử lý tài liệu {doc.id}: {e}")
+
+            save(encoder.flush())
+
+        # Trả lời trước các câu hỏi dự đoán của tài liệu mới (thread nền)
+        if settings.RAG_WARM_CACHE and saved_ids:
+            warming.schedule(saved_ids)
                 
     except Exception as e:
         logger.error(f"Lỗi trong process_new_documents: {e}")
 
 
-def making_context(question):
+def question_model_name():
+    """Model encode câu hỏi: model của index đang phục vụ (trong process hoặc ở các process shard)."""
+    return SHARDS.embedding_model if settings.RAG_SHARD_URLS else STORE.embedding_model
+
+
+def retrieve_chunks(question, k=5, document_ids=None, embedding=None):
     """
-    Tạo context cho câu hỏi bằng cách:
-    - Load tất cả embeddings từ ProcessedDocument
-    - Xây dựng FAISS index
-    - Tìm top-5 chunks liên quan nhất
-    - Ghép nó thành một chuỗi context
+    Tìm các chunks liên quan nhất đến câu hỏi:
+    - Đồng bộ vector store với ProcessedDocument (chỉ load tài liệu mới/thay đổi)
+    - Encode câu hỏi
+    - Tìm top-k chunks trong toàn bộ tài liệu hoặc chỉ trong các tài liệu được chọn
     
     Args:
         question: Câu hỏi của user
+        k: Số chunks cần lấy
+        document_ids: Danh sách Document id để giới hạn tìm kiếm (None: toàn bộ)
+        embedding: Embedding câu hỏi đã có (None: encode)
         
     Returns:
-        Chuỗi context ghép từ các chunks liên quan
+        Danh sách dict {"doc", "chunk", "score", "version", "text"} theo độ liên quan giảm dần
+        (doc: id ProcessedDocument, chunk: vị trí chunk, score: khoảng cách L2, version: text_hash)
+    """
+    embeddings = None if embedding is None else embedding[None, :]
+    return retrieve_chunks_batch([question], k=k, document_ids=document_ids, embeddings=embeddings)[0]
+
+
+def retrieve_chunks_batch(questions, k=5, document_ids=None, embeddings=None):
+    """
+    Như retrieve_chunks cho nhiều câu hỏi: encode tất cả trong một batch và tìm kiếm một lần trên index.
+    `embeddings`: embeddings câu hỏi đã có (bằng question_model_name()), None: encode (dùng cache embedding).
+
+    Returns:
+        Danh sách (mỗi câu hỏi một list) các hit, cùng thứ tự với `questions`
     """
     try:
-        processed_docs = ProcessedDocument.objects.all()
-        
-        if not processed_docs.exists():
+        if settings.RAG_SHARD_URLS:
+            return _retrieve_from_shards(questions, k, document_ids, embeddings)
+        model_name = STORE.embedding_model
+        STORE.sync()
+        if len(STORE) == 0:
             logger.warning("Không có tài liệu đã xử lý. Trả về context rỗng.")
-            return ""
+            return [[] for _ in questions]
+
+        shard_ids = None
+        if document_ids:
+            shard_ids = STORE.shard_ids_for_documents(document_ids)
+            if not shard_ids:
+                # Giữ phạm vi user đã chọn: không tìm sang các tài liệu khác
+                logger.warning(f"Không có tài liệu đã xử lý trong lựa chọn {document_ids}.")
+                return [[] for _ in questions]
+
+        # Câu hỏi được encode bằng model của index đang phục vụ (encode lại nếu index vừa đổi model)
+        with span('embed'):
+            if embeddings is None or model_name != STORE.embedding_model:
+                embeddings = answer_cache.encode_questions(list(questions), STORE.embedding_model)
+            question_embeddings = embeddings
+        with span('index_search'):
+            results = STORE.search(question_embeddings, k=k, doc_ids=shard_ids)
+        # Một phần câu hỏi được tìm lại chính xác trong nền để đo recall (không làm chậm request)
+        RECALL.maybe_sample(STORE, question_embeddings, k, shard_ids, results)
+
+        for question, hits in zip(questions, results):
+            if not hits:
+                logger.warning(f"Không tìm thấy chunks liên quan cho câu hỏi: {question}")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Lỗi trong retrieve_chunks: {e}")
+        return [[] for _ in questions]
 
-        # Khởi tạo FAISS index
-        dimension = EMBEDDING_MODEL.encode(["sample"]).shape[1]
-        faiss_index = faiss.IndexFlatL2(dimension)
 
-        all_chunks = []
+def _retrieve_from_shards(questions, k, document_ids=None, embeddings=None):
+    """retrieve_chunks_batch khi index được chia cho các process shard (RAG_SHARD_URLS): encode ở đây, tìm ở shard."""
+    with span('embed'):
+        if embeddings is None:
+            embeddings = answer_cache.encode_questions(list(questions), SHARDS.embedding_model)
+        question_embeddings = embeddings
+    with span('index_search'):
+        # Shard không trả lời kịp chỉ làm thiếu kết quả; không bao giờ bỏ phạm vi document_ids
+        results, matched = SHARDS.search(question_embeddings, k=k, document_ids=document_ids)
+    if document_ids and not matched:
+        logger.warning(f"Không có tài liệu đã xử lý trong lựa chọn {document_ids} trên các shard đã trả lời.")
+    return results
 
-        # Load embeddings từ database
-        for doc in processed_docs:
-            if not doc.embeddings:
-                continue
-                
-            try:
-                embeddings = pickle.loads(doc.embeddings)
-                
-                if not isinstance(embeddings, np.ndarray):
-                    logger.warning(f"Embeddings của doc {doc.id} không phải numpy array. Bỏ qua.")
-                    continue
-                
-                # Thêm vào FAISS index
-                faiss_index.add(embeddings)
-                
-                # Lấy chunks từ text_content (phải dùng cùng CHUNK_SIZE)
-                chunks = split_text_into_chunks(doc.text_content, chunk_size=CHUNK_SIZE)
-                all_chunks.extend(chunks)
-                
-            except pickle.UnpicklingError as e:
-                logger.error(f"Lỗi giải mã pickle cho doc {doc.id}: {e}")
 
-        if faiss_index.ntotal == 0:
-            logger.warning("FAISS index rỗng. Không có dữ liệu để tìm kiếm.")
-            return ""
+def join_chunks(hits):
+    """Ghép text của các chunks thành một chuỗi context."""
+    return " ".join(hit["text"] for hit in hits)
 
-        # Tìm kiếm top-5 chunks liên quan
-        question_embedding = EMBEDDING_MODEL.encode([question])
-        distances, top_indices = faiss_index.search(question_embedding, k=5)
 
-        if top_indices.shape[1] == 0:
-            logger.warning(f"Không tìm thấy chunks liên quan cho câu hỏi: {question}")
-            return ""
+def compress_context(question, hits):
+    """
+    Chỉ giữ các câu liên quan nhất của các chunks (tối đa RAG_CONTEXT_BUDGET ký tự) trước khi gửi LLM.
+    Câu được chấm điểm bằng model đã encode câu hỏi khi tìm kiếm. Lỗi thì dùng nguyên các chunks.
+    """
+    try:
+        with span('compress'):
+            model = get_model(question_model_name())
+            compressed = compress_hits(question, hits, model)
+    except Exception as e:
+        logger.error(f"Lỗi nén context: {e}")
+        return hits
+    before = sum(len(hit["text"]) for hit in hits)
+    if before:
+        metrics.CONTEXT_KEPT_RATIO.observe(sum(len(hit["text"]) for hit in compressed) / before)
+    return compressed
 
-        # Ghép các chunks liên quan
-        relevant_chunks = [all_chunks[i] for i in top_indices[0] if i < len(all_chunks)]
-        context = " ".join(relevant_chunks)
-        
-        logger.info(f"Tạo context thành công từ {len(relevant_chunks)} chunks")
-        return context
+
+def chunk_refs(hits):
+    """
+    Bỏ text, chỉ giữ tham chiếu (doc, chunk, score, version, chunk_size) để lưu vào Answer.chunk_refs
+    (kèm "sentences" nếu context đã được nén). Vị trí chunk chỉ có nghĩa với chunk_size lúc tìm kiếm.
+    """
+    refs = []
+    for hit in hits:
+        ref = {key: hit[key] for key in ("doc", "chunk", "score", "version")}
+        ref["chunk_size"] = CHUNK_SIZE
+        if "sentences" in hit:
+            ref["sentences"] = hit["sentences"]
+        refs.append(ref)
+    return refs
+
+
+def making_context(question, document_ids=None):
+    """
+    Tạo context cho câu hỏi: ghép các câu liên quan nhất của top-5 chunks thành một chuỗi.
+    
+    Args:
+        question: Câu hỏi của user
+        document_ids: Danh sách Document id để giới hạn tìm kiếm (None: toàn bộ)
         
+    Returns:
+        Chuỗi context ghép từ các chunks liên quan
+    """
+    hits = compress_context(question, retrieve_chunks(question, document_ids=document_ids))
+    if hits:
+        logger.info(f"Tạo context thành công từ {len(hits)} chunks")
+    return join_chunks(hits)
+
+
+def deliver_late_answer(answer_id):
+    """Callback cho AnswerJob: ghi câu trả lời đầy đủ (về sau hạn chờ) vào Answer đang ở trạng thái pending."""
+    def callback(job):
+        try:
+            pending = Answer.objects.filter(id=answer_id, status=Answer.STATUS_PENDING)
+            if job.ok:
+                pending.update(answer_content=job.text, status=Answer.STATUS_COMPLETE, answer_at=timezone.now())
+                metrics.LLM_LATE_ANSWERS.inc(result="complete")
+                logger.info(f"Cập nhật câu trả lời đầy đủ cho answer {answer_id}")
+            else:
+                pending.update(status=Answer.STATUS_DEGRADED)
+                metrics.LLM_LATE_ANSWERS.inc(result="failed")
+        finally:
+            # Callback chạy trong thread của pool LLM: không giữ kết nối DB giữa các lần dùng
+            close_old_connections()
+    return callback
+
+
+def answer_question(request, question, history):
+    """
+    Trả lời một câu hỏi của trang chat: tìm chunks, gọi AI (có hạn chờ), lưu answer và render.
+    Chỉ chạy sau khi được ADMISSION nhận.
+    """
+    answer_obj = None
+    started = time.perf_counter()
+    timings = metrics.start_request()
+    status = "error"
+    try:
+        document_ids = request.session.get("selected_documents")
+        embedding = None
+        if not history and not document_ids:
+            # Câu hỏi độc lập trên toàn bộ tài liệu: dùng câu trả lời đã cache (trả lời trước) nếu có
+            model_name = question_model_name()
+            with span('embed'):
+                embedding = answer_cache.encode_questions([question], model_name)[0]
+            with span('answer_cache'):
+                cached = answer_cache.ANSWERS.lookup(question, embedding, model_name)
+            if cached is not None:
+                answer_obj = Answer(
+                    ask_content=question,
+                    answer_content=cached.answer_content,
+                    chunk_refs=cached.chunk_refs,
+                    timings=dict(timings) if settings.RAG_STORE_TIMINGS else None,
+                    status=Answer.STATUS_COMPLETE,
+                )
+                history.append((question, cached.answer_content))
+                request.session["chat_history"] = history
+                if request.user.is_authenticated:
+                    answer_obj.uploaded_by = request.user
+                    answer_obj.save()
+                else:
+                    messages.warning(request, "Bạn cần đăng nhập để lưu lịch sử trò chuyện.")
+                status = "cached"
+                return render(request, 'home/chatGoD.html', {"answer": answer_obj})
+
+        # Tạo context từ documents
+        hits = retrieve_chunks(question, document_ids=document_ids, embedding=embedding)
+        if document_ids and not hits:
+            # Không trả lời từ tài liệu ngoài lựa chọn của user
+            status = "empty"
+            messages.warning(request, SCOPE_EMPTY_MESSAGE)
+            return render(request, 'home/chatGoD.html', {"answer": None})
+        context_hits = compress_context(question, hits)
+        context = join_chunks(context_hits)
+            
+        # Gọi AI trong thread nền, chỉ chờ tới hạn; quá hạn thì trả lời dự phòng từ các chunks đã tìm được
+        job = start_answer(question, context, history)
+        with span('llm_wait'):
+            finished = job.wait(settings.RAG_LLM_DEADLINE, settings.RAG_LLM_TIMEOUT)
+        answer_status = Answer.STATUS_COMPLETE
+        if finished and job.ok:
+            answer_text = job.text
+        else:
+            reason = "error" if finished else "deadline"
+            metrics.LLM_FALLBACKS.inc(reason=reason)
+            logger.warning(f"LLM {'lỗi' if finished else 'quá hạn'}, trả lời dự phòng: {job.error or ''}")
+            with span('fallback'):
+                answer_text = extractive_answer(question, hits, unavailable=finished)
+            answer_status = Answer.STATUS_DEGRADED if finished else Answer.STATUS_PENDING
+            
+        if not answer_text:
+            status = "empty"
+            messages.error(request, "Không thể tạo câu trả lời.")
+            return render(request, 'home/chatGoD.html', {"answer": None})
+            
+        # Cập nhật lịch sử (chỉ câu trả lời đầy đủ: đoạn trích dự phòng không đưa vào prompt các câu sau)
+        if answer_status == Answer.STATUS_COMPLETE:
+            history.append((question, answer_text))
+            request.session["chat_history"] = history
+
+        # Chỉ lưu tham chiếu chunks; context được ghép lại khi cần (Answer.get_context)
+        answer_obj = Answer(
+            ask_content=question,
+            answer_content=answer_text,
+            chunk_refs=chunk_refs(context_hits),
+            timings=dict(timings) if settings.RAG_STORE_TIMINGS else None,
+            status=answer_status,
+        )
+
+        # Lưu vào database nếu user đã đăng nhập
+        if request.user.is_authenticated:
+            answer_obj.uploaded_by = request.user
+            answer_obj.save()
+            logger.info(f"Lưu answer cho user {request.user.username} (answer_id={answer_obj.id})")
+            if answer_status == Answer.STATUS_PENDING:
+                # Câu trả lời đầy đủ về sau được cập nhật vào Answer; trang chat hỏi lại qua /history/<id>/
+                job.then(deliver_late_answer(answer_obj.id))
+        else:
+            messages.warning(request, "Bạn cần đăng nhập để lưu lịch sử trò chuyện.")
+            if answer_status == Answer.STATUS_PENDING:
+                job.cancel()
+        status = "ok" if answer_status == Answer.STATUS_COMPLETE else "degraded"
+                
     except Exception as e:
-        logger.error(f"Lỗi trong making_context: {e}")
-        return ""
+        logger.error(f"Lỗi trong chatGoD: {e}")
+        messages.error(request, f"Lỗi: {str(e)}")
+    finally:
+        metrics.QUESTIONS.inc(status=status)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, status=status)
+        logger.info(f"Timings (ms): {timings}")
+
+    # Trả về câu trả lời vừa tạo (trang chat đọc nó từ #ctrl)
+    with span('render'):
+        response = render(request, 'home/chatGoD.html', {"answer": answer_obj})
+    return response
 
 
 def chatGoD(request):
@@ -166,6 +401,7 @@ def chatGoD(request):
     if request.method == "POST":
         if "clear_history" in request.POST:
             request.session.pop("chat_history", None)
+            request.session.pop("selected_documents", None)
             if request.user.is_authenticated:
                 Answer.objects.filter(uploaded_by=request.user).delete()
             return render(request, 'home/chatGoD.html', {"answer": None})
@@ -191,47 +427,245 @@ def chatGoD(request):
         question = request.POST.get("question", "").strip()
         if not question:
             messages.warning(request, "Vui lòng nhập một câu hỏi.")
-            return render(request, 'home/chatGoD.html', {"answer": Answer.objects.last()})
+            return render(request, 'home/chatGoD.html', {"answer": None})
 
+        # Giới hạn số câu hỏi chạy pipeline đồng thời; hàng đợi đầy thì báo bận ngay
         try:
-            # Tạo context từ documents
-            context = making_context(question)
-            
-            # Gọi AI để tạo câu trả lời
-            answer_text = asking(question, context, history)
-            
-            if not answer_text:
-                messages.error(request, "Không thể tạo câu trả lời.")
-                return render(request, 'home/chatGoD.html', {"answer": Answer.objects.last()})
-            
-            # Cập nhật lịch sử
-            history.append((question, answer_text))
-            request.session["chat_history"] = history
-
-            # Lưu vào database nếu user đã đăng nhập
-            if request.user.is_authenticated:
-                answer_obj = Answer(
-                    ask_content=question,
-                    answer_content=answer_text,
-                    context=context,
-                    uploaded_by=request.user
-                )
-                answer_obj.save()
-                logger.info(f"Lưu answer cho user {request.user.username} (answer_id={answer_obj.id})")
-            else:
-                messages.warning(request, "Bạn cần đăng nhập để lưu lịch sử trò chuyện.")
-                
-        except Exception as e:
-            logger.error(f"Lỗi trong chatGoD: {e}")
-            messages.error(request, f"Lỗi: {str(e)}")
-
-    # Lấy lịch sử hội thoại của user nếu đã đăng nhập
+            with ADMISSION.admit(request_priority(request)):
+                return answer_question(request, question, history)
+        except Busy as e:
+            logger.warning(f"Từ chối câu hỏi ({e.reason}): {question[:50]}")
+            metrics.QUESTIONS.inc(status="busy")
+            response = HttpResponse("Hệ thống đang bận, vui lòng thử lại sau ít giây.", status=429)
+            response["Retry-After"] = str(e.retry_after)
+            return response
+
+    # Lấy trang đầu lịch sử hội thoại của user nếu đã đăng nhập (các trang cũ hơn qua /history/)
     if request.user.is_authenticated:
-        answers = Answer.objects.filter(uploaded_by=request.user).order_by('-ask_at')[:10]
+        answers, next_cursor = history_page(request.user)
     else:
-        answers = []
+        answers, next_cursor = [], None
+
+    with span('render'):
+        response = render(request, 'home/chatGoD.html', {
+            "answer": None,
+            "answers": answers,
+            "next_cursor": next_cursor,
+        })
+    return response
+
+
+def encode_cursor(answer):
+    """Mã hóa vị trí (ask_at, id) của một answer thành cursor cho keyset pagination."""
+    raw = f"{answer.ask_at.isoformat()}|{answer.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Giải mã cursor thành (ask_at, id). Raise ValueError nếu cursor không hợp lệ."""
+    try:
+        ask_at, answer_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ask_at), int(answer_id)
+    except Exception as e:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from e
+
+
+def history_page(user, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Lấy một trang lịch sử Q&A của user theo keyset (ask_at, id) giảm dần.
+    Chỉ tải các cột nhẹ; answer_content/context lấy riêng qua history_detail.
+    
+    Args:
+        user: User sở hữu lịch sử
+        cursor: Cursor từ trang trước (None: trang mới nhất)
+        limit: Số câu hỏi mỗi trang
+        
+    Returns:
+        (danh sách Answer, cursor trang tiếp theo hoặc None)
+    """
+    answers = (Answer.objects.filter(uploaded_by=user)
+               .only('id', 'ask_content', 'ask_at', 'uploaded_by')
+               .order_by('-ask_at', '-id'))
+    if cursor:
+        ask_at, answer_id = decode_cursor(cursor)
+        answers = answers.filter(Q(ask_at__lt=ask_at) | Q(ask_at=ask_at, id__lt=answer_id))
+
+    rows = list(answers[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def history(request):
+    """
+    API JSON lịch sử hội thoại: GET /history/?cursor=<cursor>&limit=<n>
+    Trả về {"results": [...], "next_cursor": ...}.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Bạn cần đăng nhập."}, status=401)
+
+    try:
+        limit = min(max(int(request.GET.get("limit", HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        answers, next_cursor = history_page(request.user, request.GET.get("cursor"), limit)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    results = [
+        {"id": a.id, "ask_content": a.ask_content, "ask_at": a.ask_at.isoformat()}
+        for a in answers
+    ]
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+
+def history_detail(request, answer_id):
+    """API JSON chi tiết một câu hỏi trong lịch sử (kèm câu trả lời và context)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Bạn cần đăng nhập."}, status=401)
+
+    answer = get_object_or_404(Answer, id=answer_id)
+    if answer.uploaded_by_id != request.user.id and not request.user.is_staff:
+        return JsonResponse({"error": "Bạn không có quyền xem lịch sử này."}, status=403)
+
+    return JsonResponse({
+        "id": answer.id,
+        "ask_content": answer.ask_content,
+        "ask_at": answer.ask_at.isoformat(),
+        "answer_content": answer.answer_content,
+        "answer_at": answer.answer_at.isoformat(),
+        "status": answer.status,
+        "context": answer.get_context(),
+        "chunk_refs": answer.chunk_refs,
+    })
+
+
+@metrics.REGISTRY.add_collector
+def _collect_ingest_queue():
+    metrics.INGEST_QUEUE.set(Document.objects.filter(is_processed=False).count())
+
+
+@metrics.REGISTRY.add_collector
+def _collect_reembed_status():
+    status = read_job_status(settings.RAG_INDEX_DIR)
+    if not status:
+        return
+    metrics.REEMBED_PROGRESS.set(status.get('progress', 0), model=status['model'])
+    metrics.REEMBED_THROUGHPUT.set(status.get('chunks_per_second', 0), model=status['model'])
+
+
+def metrics_view(request):
+    """
+    Xuất metrics dạng Prometheus text format.
+    Yêu cầu user staff hoặc header "Authorization: Bearer <METRICS_TOKEN>", trừ khi đặt METRICS_PUBLIC.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = (settings.METRICS_PUBLIC or request.user.is_staff
+                  or (token and request.headers.get("Authorization") == f"Bearer {token}"))
+    if not authorized:
+        return HttpResponseForbidden("Forbidden")
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _api_authorized(request):
+    """API: cho phép header "Authorization: Bearer <API_TOKEN>" hoặc user staff (kèm CSRF token như form)."""
+    token = settings.API_TOKEN
+    if token and request.headers.get("Authorization") == f"Bearer {token}":
+        return True
+    if not request.user.is_staff:
+        return False
+    # View được csrf_exempt cho tích hợp dùng token; request dùng session vẫn phải qua kiểm tra CSRF
+    return CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {}) is None
+
 
-    return render(request, 'home/chatGoD.html', {"answer": Answer.objects.last(), "answers": answers})
+def _answer_one(question, hits, history=None):
+    """Gọi LLM cho một câu hỏi của batch (tối đa RAG_LLM_TIMEOUT giây). Trả về (câu trả lời, lỗi)."""
+    return _answer_with_context(question, join_chunks(compress_context(question, hits)), history)
+
+
+def _answer_with_context(question, context, history=None):
+    """Như _answer_one với context đã nén sẵn."""
+    try:
+        job = start_answer(question, context, history)
+    except Exception as e:
+        logger.error(f"Lỗi khi gọi Gemini API (batch): {e}")
+        return None, str(e)
+    if not job.wait(settings.RAG_LLM_TIMEOUT, settings.RAG_LLM_TIMEOUT):
+        job.cancel()
+        return None, f"Quá {settings.RAG_LLM_TIMEOUT:g} giây chờ Gemini"
+    if job.error is not None:
+        logger.error(f"Lỗi khi gọi Gemini API (batch): {job.error}")
+        return None, str(job.error)
+    return job.text, None
+
+
+@csrf_exempt
+def ask_batch(request):
+    """
+    API JSON trả lời nhiều câu hỏi trong một request: POST /api/ask/
+    Body: {"questions": [...], "k": 5, "document_ids": [...], "answer": true, "include_text": false}
+
+    Các câu hỏi được encode trong một batch và tìm kiếm một lần trên index; các lần gọi LLM chạy song song
+    (tối đa RAG_BATCH_LLM_CONCURRENCY). "answer": false chỉ trả về chunks (không gọi LLM).
+
+    Returns:
+        {"results": [{"question", "answer", "error", "chunks": [{doc, chunk, score, version[, text]}]}], "timings"}
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Chỉ hỗ trợ POST."}, status=405)
+    if not _api_authorized(request):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+        questions = payload["questions"]
+        if not isinstance(questions, list) or not all(isinstance(q, str) and q.strip() for q in questions):
+            raise ValueError("questions phải là danh sách câu hỏi không rỗng")
+        if not 0 < len(questions) <= settings.RAG_BATCH_MAX_QUESTIONS:
+            raise ValueError(f"Số câu hỏi phải từ 1 đến {settings.RAG_BATCH_MAX_QUESTIONS}")
+        k = int(payload.get("k", 5))
+        if not 0 < k <= 50:
+            raise ValueError("k phải từ 1 đến 50")
+        document_ids = [int(i) for i in payload.get("document_ids") or []]
+    except (ValueError, TypeError, KeyError) as e:
+        return JsonResponse({"error": f"Request không hợp lệ: {e}"}, status=400)
+
+    questions = [q.strip() for q in questions]
+    try:
+        with ADMISSION.admit(PRIORITY_BATCH):
+            return _run_batch(questions, k, document_ids, payload)
+    except Busy as e:
+        response = JsonResponse({"error": "Hệ thống đang bận, vui lòng thử lại sau.", "reason": e.reason}, status=429)
+        response["Retry-After"] = str(e.retry_after)
+        return response
+
+
+def _run_batch(questions, k, document_ids, payload):
+    """Chạy batch đã được ADMISSION nhận: tìm kiếm một lần rồi gọi LLM song song."""
+    started = time.perf_counter()
+    timings = metrics.start_request()
+    results = retrieve_chunks_batch(questions, k=k, document_ids=document_ids or None)
+    if document_ids and not any(results):
+        return JsonResponse({"error": SCOPE_EMPTY_MESSAGE}, status=409)
+
+    answers = [(None, None)] * len(questions)
+    if payload.get("answer", True):
+        if not GEMINI_API_KEY:
+            answers = [(None, "Chưa cấu hình API key Gemini")] * len(questions)
+        else:
+            with span('llm_batch'), ThreadPoolExecutor(
+                    max_workers=min(settings.RAG_BATCH_LLM_CONCURRENCY, len(questions))) as pool:
+                answers = list(pool.map(_answer_one, questions, results))
+
+    include_text = bool(payload.get("include_text"))
+    response = []
+    for question, hits, (answer_text, error) in zip(questions, results, answers):
+        chunks = chunk_refs(hits)
+        if include_text:
+            for ref, hit in zip(chunks, hits):
+                ref["text"] = hit["text"]
+        response.append({"question": question, "answer": answer_text, "error": error, "chunks": chunks})
+        metrics.QUESTIONS.inc(status="error" if error else "batch")
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, status="batch")
+    logger.info(f"Batch {len(questions)} câu hỏi, timings (ms): {timings}")
+    return JsonResponse({"results": response, "timings": timings})
 
 
 def admin_check(user):
@@ -289,39 +723,64 @@ def upload(request):
                 messages.error(request, "Có lỗi khi cập nhật mô tả.")
             return redirect('upload')
 
-        # Xử lý upload PDF mới
+        # Xử lý upload PDF mới (file quá lớn đã bị bỏ qua ngay khi nhận, xem home.uploads)
+        upload_errors = getattr(request, 'upload_errors', None)
+        if upload_errors:
+            for reason in upload_errors.values():
+                messages.error(request, reason)
+            return redirect('upload')
         form = DocumentForm(request.POST, request.FILES)
-        if form.is_valid():
-            document = form.save(commit=False)
+        if not form.is_valid():
+            for errors in form.errors.values():
+                for error in errors:
+                    messages.error(request, error)
+            logger.warning(f"Upload bị từ chối: {form.errors.as_text()}")
+            return redirect('upload')
+        document = form.save(commit=False)
+        try:
+            document.uploaded_by = request.user
+            document.save()
+            
+            # Xử lý document mới (trích xuất, embedding, etc.)
+            process_new_documents()
+            
+            messages.success(request, "Tải lên thành công!")
+            logger.info(f"Upload document {document.id} thành công")
+            
+        except Exception as e:
+            logger.error(f"Lỗi upload: {e}")
+            messages.error(request, f"Có lỗi khi tải lên: {str(e)}")
+            
+            # Rollback: xóa document và file
             try:
-                document.uploaded_by = request.user
-                document.save()
-                
-                # Xử lý document mới (trích xuất, embedding, etc.)
-                process_new_documents()
-                
-                messages.success(request, "Tải lên thành công!")
-                logger.info(f"Upload document {document.id} thành công")
-                
-            except Exception as e:
-                logger.error(f"Lỗi upload: {e}")
-                messages.error(request, f"Có lỗi khi tải lên: {str(e)}")
+                if document.document and os.path.exists(document.document.path):
+                    os.remove(document.document.path)
+                document.delete()
+            except Exception as cleanup_e:
+                logger.error(f"Lỗi cleanup sau upload failed: {cleanup_e}")
                 
-                # Rollback: xóa document và file
-                try:
-                    if document.document and os.path.exists(document.document.path):
-                        os.remove(document.document.path)
-                    document.delete()
-                except Exception as cleanup_e:
-                    logger.error(f"Lỗi cleanup sau upload failed: {cleanup_e}")
-                    
-            return redirect('upload')
+        return redirect('upload')
 
     # GET request: hiển thị danh sách tài liệu
     documents = Document.objects.all().order_by('-uploaded_at')
     return render(request, 'admin/uploadManage.html', {'documents': documents})
 
 
+@user_passes_test(admin_check, login_url='home')
+def warm_status(request):
+    """Tiến độ trả lời trước của các tài liệu (trang upload hỏi lại khi còn job đang chạy)."""
+    documents = {
+        str(doc.id): {
+            'status': doc.warm_status,
+            'label': doc.get_warm_status_display() if doc.warm_status else "",
+            'done': doc.warm_done,
+            'total': doc.warm_total,
+        }
+        for doc in Document.objects.only('id', 'warm_status', 'warm_done', 'warm_total')
+    }
+    return JsonResponse({'documents': documents})
+
+
 def logout_view(request):
     """Đăng xuất."""
     logout(request)
@@ -331,8 +790,25 @@ def logout_view(request):
 
 
 def select_files(request):
-    """Trang chọn files (placeholder)."""
-    return render(request, 'home/select_files.html')
+    """
+    Chọn tập tài liệu cho hội thoại hiện tại (lưu trong session).
+    Câu hỏi tiếp theo chỉ tìm context trong các tài liệu được chọn; bỏ chọn hết = toàn bộ.
+    """
+    if request.method == "POST":
+        selected = [int(doc_id) for doc_id in request.POST.getlist("selected_files") if doc_id.isdigit()]
+        if selected:
+            request.session["selected_documents"] = selected
+            messages.success(request, f"Đã chọn {len(selected)} tài liệu cho hội thoại.")
+        else:
+            request.session.pop("selected_documents", None)
+            messages.success(request, "Đã bỏ chọn, tìm kiếm trên toàn bộ tài liệu.")
+        return redirect('select_file')
+
+    files = Document.objects.filter(is_processed=True).only('id', 'description', 'document')
+    return render(request, 'home/select_files.html', {
+        'files': files,
+        'selected': set(request.session.get("selected_documents", [])),
+    })
 
 
 def admin_base(request):
@@ -0,0 +1,146 @@
+"""
+Trả lời trước (cache warming): sau khi một tài liệu được xử lý, sinh các câu hỏi có khả năng được hỏi
+(câu hỏi admin nhập, câu hỏi có sẵn trong tài liệu dạng hỏi đáp, tiêu đề mục/điều khoản), trả lời chúng theo batch
+(tối đa RAG_WARM_LLM_CONCURRENCY lần gọi LLM song song, ưu tiên thấp nhất trong kiểm soát tải) và lưu vào cache
+câu trả lời + embedding (home.answer_cache). Tiến độ ghi vào Document.warm_* và hiển thị ở trang upload.
+"""
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+
+from home import answer_cache
+from home.admission import CONTROLLER as ADMISSION, PRIORITY_BATCH, Busy
+from home.models import Document, ProcessedDocument
+
+logger = logging.getLogger(__name__)
+
+# Tiêu đề có đánh số: "Điều 5. Nghỉ phép năm", "Chương II: ...", "3.2 Bảo hiểm", "IV. Phụ cấp"
+_NUMBERED_HEADING_RE = re.compile(
+    r'^(?:(?:điều|chương|mục|phần|khoản)\s+[\dIVXLC]+|[\dIVXLC]+(?:\.\d+)*)\s*[.:)\-–]?\s+(?P<title>\S.*)$',
+    re.IGNORECASE)
+_QUESTION_RE = re.compile(r'[^.!?\n]{10,200}\?')
+HEADING_MAX_WORDS = 12
+QUESTION_MAX_WORDS = 30
+
+
+def derive_questions(text, extra=(), limit=None):
+    """
+    Các câu hỏi dự đoán cho một tài liệu: `extra` (admin nhập) trước, rồi câu hỏi có sẵn trong văn bản
+    (mục hỏi đáp), rồi câu hỏi sinh từ tiêu đề. Bỏ trùng theo câu hỏi đã chuẩn hóa.
+
+    Args:
+        text: Văn bản tài liệu (ProcessedDocument.text_content)
+        extra: Câu hỏi admin nhập
+        limit: Số câu hỏi tối đa (mặc định settings.RAG_WARM_MAX_QUESTIONS)
+    """
+    limit = settings.RAG_WARM_MAX_QUESTIONS if limit is None else limit
+    candidates = [line.strip() for line in extra if line.strip()]
+    candidates += [match.group(0).strip() for match in _QUESTION_RE.finditer(text)
+                   if len(match.group(0).split()) <= QUESTION_MAX_WORDS]
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or len(line.split()) > HEADING_MAX_WORDS or line.endswith(('.', ',', ';', '?')):
+            continue
+        match = _NUMBERED_HEADING_RE.match(line)
+        title = match.group('title') if match else (line if line.isupper() and len(line.split()) >= 2 else None)
+        if title and len(title.split()) >= 2:
+            candidates.append(f"Quy định về {title.strip(' :').lower()} như thế nào?")
+
+    questions, seen = [], set()
+    for question in candidates:
+        key = answer_cache.normalize_question(question)
+        if key and key not in seen:
+            seen.add(key)
+            questions.append(question)
+    return questions[:limit]
+
+
+def _progress(document_id, **fields):
+    Document.objects.filter(id=document_id).update(**fields)
+
+
+def warm_document(document_id):
+    """
+    Trả lời trước các câu hỏi dự đoán của một tài liệu. Câu hỏi đã có câu trả lời còn hiệu lực được bỏ qua.
+
+    Returns:
+        (số câu đã trả lời, tổng số câu hỏi)
+    """
+    # Import muộn: home.views import module này
+    from home.views import (
+        _answer_with_context, chunk_refs, compress_context, join_chunks, question_model_name, retrieve_chunks_batch,
+    )
+
+    document = Document.objects.get(id=document_id)
+    processed = ProcessedDocument.objects.filter(document=document).order_by('-id').first()
+    if processed is None:
+        raise ValueError(f"Tài liệu {document_id} chưa được xử lý")
+    questions = derive_questions(processed.text_content, document.warm_questions.splitlines())
+    _progress(document_id, warm_status='running', warm_done=0, warm_total=len(questions))
+    if not questions:
+        _progress(document_id, warm_status='done')
+        return 0, 0
+
+    model_name = question_model_name()
+    embeddings = answer_cache.encode_questions(questions, model_name)
+    results = retrieve_chunks_batch(questions, embeddings=embeddings)
+    done = 0
+
+    def warm_one(question, hits, embedding):
+        try:
+            if answer_cache.ANSWERS.lookup(question) is not None:
+                return True
+            # Nhường chỗ cho câu hỏi của user: chạy với độ ưu tiên thấp nhất, hệ thống bận thì bỏ qua câu này
+            with ADMISSION.admit(PRIORITY_BATCH):
+                # Nén context một lần: chunk_refs lưu đúng các câu đã gửi LLM
+                context_hits = compress_context(question, hits)
+                answer, error = _answer_with_context(question, join_chunks(context_hits))
+            if error or not answer:
+                logger.warning(f"Không trả lời trước được '{question[:50]}': {error}")
+                return False
+            answer_cache.store(question, answer, chunk_refs(context_hits), embedding, model_name, document=document)
+            _progress(document_id, warm_done=F('warm_done') + 1)
+            return True
+        except Busy as e:
+            logger.info(f"Hệ thống bận ({e.reason}), bỏ qua trả lời trước '{question[:50]}'")
+            return False
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=max(1, settings.RAG_WARM_LLM_CONCURRENCY),
+                            thread_name_prefix='warm-llm') as pool:
+        for ok in pool.map(warm_one, questions, results, embeddings):
+            done += ok
+    _progress(document_id, warm_status='done', warm_done=done)
+    logger.info(f"Trả lời trước tài liệu {document_id}: {done}/{len(questions)} câu hỏi")
+    return done, len(questions)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run(document_id):
+    try:
+        warm_document(document_id)
+    except Exception as e:
+        logger.error(f"Lỗi trả lời trước tài liệu {document_id}: {e}")
+        _progress(document_id, warm_status='failed')
+    finally:
+        close_old_connections()
+
+
+def schedule(document_ids):
+    """Đưa các tài liệu vào hàng đợi trả lời trước (một thread nền, lần lượt từng tài liệu)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warm')
+    for document_id in document_ids:
+        _progress(document_id, warm_status='queued', warm_done=0, warm_total=0)
+        _executor.submit(_run, document_id)
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pythonweb.settings')
 
 application = get_asgi_application()
+
+# RAG_PRELOAD=1 (dùng với gunicorn --preload): load model + index trong process master trước khi fork
+# để các worker dùng chung bộ nhớ thay vì mỗi worker tự load một bản.
+if os.getenv('RAG_PRELOAD', '').lower() in ('1', 'true', 'yes'):
+    from home.views import preload
+    preload()
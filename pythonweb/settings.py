@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'home.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -150,6 +151,86 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# RAG pipeline / hiệu năng
+# Model SentenceTransformer dùng cho embedding
+RAG_EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+# Kích thước chunk (ký tự) khi chia văn bản; đổi giá trị cần xử lý lại tài liệu
+RAG_CHUNK_SIZE = int(os.getenv('RAG_CHUNK_SIZE', '1000'))
+# Encode khi ingest: số chunks mỗi batch (với chunks dài nhất) và số thread torch/faiss (0: mặc định)
+RAG_ENCODE_BATCH_SIZE = int(os.getenv('RAG_ENCODE_BATCH_SIZE', '128'))
+RAG_ENCODE_THREADS = int(os.getenv('RAG_ENCODE_THREADS', '0'))
+# Tìm kiếm hai mức: chia mỗi tài liệu thành section RAG_SECTION_SIZE chunks; khi index có từ
+# RAG_COARSE_MIN_VECTORS vectors, chỉ tìm chính xác trong RAG_COARSE_TOP_M section gần nhất (0: luôn tìm toàn bộ)
+RAG_SECTION_SIZE = int(os.getenv('RAG_SECTION_SIZE', '32'))
+RAG_COARSE_TOP_M = int(os.getenv('RAG_COARSE_TOP_M', '16'))
+RAG_COARSE_MIN_VECTORS = int(os.getenv('RAG_COARSE_MIN_VECTORS', '50000'))
+# Backend trích xuất PDF mặc định: pypdf2 | pdfminer | pypdfium2 | auto (backend tốt nhất đã cài);
+# mỗi trang quá RAG_EXTRACT_PAGE_TIMEOUT giây bị bỏ qua (0: không giới hạn, trích xuất ngay trong process)
+RAG_PDF_EXTRACTOR = os.getenv('RAG_PDF_EXTRACTOR', 'pypdf2')
+RAG_EXTRACT_PAGE_TIMEOUT = float(os.getenv('RAG_EXTRACT_PAGE_TIMEOUT', '30'))
+# Giảm chiều vectors khi build generation: RAG_INDEX_DIMS > 0 để bật, RAG_INDEX_REDUCTION = pca | truncate
+# (truncate: giữ các chiều đầu, cho model Matryoshka). Kiểm tra recall bằng manage.py eval_index
+RAG_INDEX_DIMS = int(os.getenv('RAG_INDEX_DIMS', '0'))
+RAG_INDEX_REDUCTION = os.getenv('RAG_INDEX_REDUCTION', 'pca')
+RAG_PCA_TRAIN_SIZE = int(os.getenv('RAG_PCA_TRAIN_SIZE', '50000'))
+# Thư mục chứa các generation index trên đĩa (manage.py build_index), worker mở read-only bằng mmap
+RAG_INDEX_DIR = os.getenv('RAG_INDEX_DIR', os.path.join(BASE_DIR, 'index'))
+# Chu kỳ (giây) worker kiểm tra generation mới được publish
+RAG_INDEX_RELOAD_INTERVAL = float(os.getenv('RAG_INDEX_RELOAD_INTERVAL', '5'))
+# Tìm kiếm phân tán: danh sách URL các process shard (manage.py retrieval_shard), cách nhau bởi dấu phẩy.
+# Để trống: tìm trên index trong process. Shard không trả lời trong RAG_SHARD_TIMEOUT giây bị bỏ qua
+RAG_SHARD_URLS = [url.strip() for url in os.getenv('RAG_SHARD_URLS', '').split(',') if url.strip()]
+RAG_SHARD_TIMEOUT = float(os.getenv('RAG_SHARD_TIMEOUT', '2'))
+RAG_SHARD_TOKEN = os.getenv('RAG_SHARD_TOKEN', '')
+# Hạn chờ LLM (giây): chưa có phần văn bản đầu tiên sau RAG_LLM_DEADLINE thì trả câu trả lời dự phòng
+# trích từ tài liệu, câu trả lời đầy đủ được cập nhật sau; RAG_LLM_TIMEOUT giới hạn tổng thời gian gọi LLM
+RAG_LLM_DEADLINE = float(os.getenv('RAG_LLM_DEADLINE', '8'))
+RAG_LLM_TIMEOUT = float(os.getenv('RAG_LLM_TIMEOUT', '60'))
+RAG_LLM_WORKERS = int(os.getenv('RAG_LLM_WORKERS', '8'))
+# Nén context trước khi gửi LLM: chỉ giữ các câu gần câu hỏi nhất (kèm RAG_CONTEXT_NEIGHBOURS câu liền kề)
+# tới RAG_CONTEXT_BUDGET ký tự (0: gửi nguyên các chunks)
+RAG_CONTEXT_BUDGET = int(os.getenv('RAG_CONTEXT_BUDGET', '1500'))
+RAG_CONTEXT_NEIGHBOURS = int(os.getenv('RAG_CONTEXT_NEIGHBOURS', '1'))
+# Đo recall của tìm kiếm nhanh: tỉ lệ câu hỏi được tìm lại chính xác (brute-force) trong nền,
+# số mẫu gần nhất để tính trung bình và ngưỡng recall@k bật cảnh báo (rag_recall_alert)
+RAG_RECALL_SAMPLE_RATE = float(os.getenv('RAG_RECALL_SAMPLE_RATE', '0.01'))
+RAG_RECALL_WINDOW = int(os.getenv('RAG_RECALL_WINDOW', '200'))
+RAG_RECALL_ALERT_THRESHOLD = float(os.getenv('RAG_RECALL_ALERT_THRESHOLD', '0.9'))
+# Trả lời trước (cache warming) sau khi xử lý tài liệu mới: số câu hỏi dự đoán tối đa mỗi tài liệu
+# và số lần gọi LLM song song của job nền
+RAG_WARM_CACHE = os.getenv('RAG_WARM_CACHE', 'false').lower() in ('1', 'true', 'yes')
+RAG_WARM_MAX_QUESTIONS = int(os.getenv('RAG_WARM_MAX_QUESTIONS', '20'))
+RAG_WARM_LLM_CONCURRENCY = int(os.getenv('RAG_WARM_LLM_CONCURRENCY', '2'))
+# Cache câu trả lời: thời gian hiệu lực (giây, 0: không hết hạn) và độ tương đồng cosine tối thiểu
+# để dùng câu trả lời của một câu hỏi gần giống (lớn hơn 1: chỉ khớp đúng câu hỏi)
+RAG_ANSWER_CACHE_TTL = int(os.getenv('RAG_ANSWER_CACHE_TTL', str(7 * 24 * 3600)))
+RAG_ANSWER_CACHE_SIMILARITY = float(os.getenv('RAG_ANSWER_CACHE_SIMILARITY', '0.95'))
+# Lưu timings từng stage vào Answer.timings
+RAG_STORE_TIMINGS = os.getenv('RAG_STORE_TIMINGS', 'true').lower() in ('1', 'true', 'yes')
+# Kiểm soát tải (mỗi process): tối đa RAG_MAX_CONCURRENT câu hỏi chạy pipeline cùng lúc (0: không giới hạn),
+# RAG_QUEUE_SIZE câu hỏi chờ tối đa RAG_QUEUE_TIMEOUT giây; vượt quá thì trả HTTP 429
+RAG_MAX_CONCURRENT = int(os.getenv('RAG_MAX_CONCURRENT', '4'))
+RAG_QUEUE_SIZE = int(os.getenv('RAG_QUEUE_SIZE', '16'))
+RAG_QUEUE_TIMEOUT = float(os.getenv('RAG_QUEUE_TIMEOUT', '10'))
+# Upload: file ghi thẳng xuống file tạm theo từng chunk, tính SHA-256 và kiểm tra header PDF khi đang nhận;
+# file lớn hơn RAG_UPLOAD_MAX_SIZE bytes bị dừng nhận ngay, PDF nhiều hơn RAG_UPLOAD_MAX_PAGES trang bị từ chối (0: không giới hạn)
+FILE_UPLOAD_HANDLERS = ['home.uploads.HashingUploadHandler']
+RAG_UPLOAD_MAX_SIZE = int(os.getenv('RAG_UPLOAD_MAX_SIZE', str(200 * 1024 * 1024)))
+RAG_UPLOAD_MAX_PAGES = int(os.getenv('RAG_UPLOAD_MAX_PAGES', '5000'))
+# API hỏi nhiều câu (POST /api/ask/): token "Authorization: Bearer <API_TOKEN>" (để trống: chỉ user staff),
+# số câu hỏi tối đa mỗi request và số lần gọi LLM song song
+API_TOKEN = os.getenv('API_TOKEN', '')
+RAG_BATCH_MAX_QUESTIONS = int(os.getenv('RAG_BATCH_MAX_QUESTIONS', '100'))
+RAG_BATCH_LLM_CONCURRENCY = int(os.getenv('RAG_BATCH_LLM_CONCURRENCY', '4'))
+# /metrics yêu cầu user staff hoặc header "Authorization: Bearer <METRICS_TOKEN>";
+# METRICS_PUBLIC=true để mở cho mọi người (chỉ khi endpoint không ra ngoài mạng nội bộ)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', 'false').lower() in ('1', 'true', 'yes')
+# Profile request: staff bật bằng header "X-Profile: 1" hoặc "?_profile=1";
+# PROFILE_SAMPLE_RATE > 0 để profile ngẫu nhiên một tỉ lệ request
+PROFILE_VIEWS = ('home', 'upload')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 